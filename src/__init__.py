@@ -6,17 +6,57 @@
 - compatibility: 相性数据处理
 - calculator: 七马相性计算器
 - five_horses_calculator: 五马循环计算器
+- engine: 常驻计算引擎
+- pedigree_optimizer: 七马血统约束优化器
+- instrumentation: 阶段计时与指标
+- cancellation: 搜索的截止时间与取消
+- checkpoint: 长时间搜索的检查点
+- result_cache: 持久化的查询结果缓存
+- server: 本地查询服务
 """
 
 __version__ = "1.0.0"
 __author__ = "UmamusumeCalculator"
 
-from .compatibility import CompatibilityData
-from .calculator import CompatibilityCalculator
-from .five_horses_calculator import FiveHorsesCalculator
+from importlib import import_module
+
+# 公开的类及其所在模块。类在首次访问时才导入（PEP 562），
+# 只读取缓存的命令行或工作进程不必在导入包时加载全部模块
+_LAZY_EXPORTS = {
+    'CompatibilityData': '.compatibility',
+    'CompatibilityCalculator': '.calculator',
+    'FiveHorsesCalculator': '.five_horses_calculator',
+    'FiveHorsesEngine': '.engine',
+    'PedigreeOptimizer': '.pedigree_optimizer',
+    'Instrumentation': '.instrumentation',
+    'JsonLinesExporter': '.instrumentation',
+    'CancelToken': '.cancellation',
+    'ResultCache': '.result_cache',
+    'QueryService': '.server'
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
+
 
 __all__ = [
     'CompatibilityData',
     'CompatibilityCalculator', 
-    'FiveHorsesCalculator'
+    'FiveHorsesCalculator',
+    'FiveHorsesEngine',
+    'PedigreeOptimizer',
+    'Instrumentation',
+    'JsonLinesExporter',
+    'CancelToken',
+    'ResultCache',
+    'QueryService'
 ] 
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""
+性能基准测试
+
+generate_dataset生成与相性数据表.csv格式相同的合成数据（马娘数、组数、组大小和分数分布均可配置），
+run_benchmarks在其上依次计时CSV读取、两两/三三相性表构建、缓存保存与加载、单次查询、
+五马最优/前N搜索、七马血统搜索和批量计分，结果为可直接保存为JSON的字典，便于在不同版本之间对比。
+冷启动各阶段的用时取自CompatibilityData构造时记录的阶段（见COLD_START_PHASES），与实际加载流程一致。
+
+命令行用法：
+    python -m src.benchmark --umas 114 --groups 2462 --output benchmark.json
+    python -m src.benchmark --csv data/相性数据表.csv --compare old.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .calculator import CompatibilityCalculator
+from .compatibility import CompatibilityData
+from .five_horses_calculator import FiveHorsesCalculator
+from .instrumentation import Instrumentation
+from .pedigree_optimizer import PedigreeOptimizer
+
+# 结果格式版本，字段含义变化时递增
+BENCHMARK_FORMAT_VERSION = 1
+
+# 默认分布按相性数据表.csv统计：绝大多数组只有1~2名成员、1分，少数大组（学年、同生年等）分数较高
+DEFAULT_SIZE_WEIGHTS = {1: 639, 2: 1673, 3: 24, 4: 25, 5: 11, 6: 17, 8: 20, 12: 20, 18: 15, 30: 10, 60: 5, 106: 3}
+DEFAULT_SCORE_WEIGHTS = {1: 2305, 2: 119, 7: 10, 8: 28}
+DEFAULT_CATEGORIES = ["寝室", "组合", "同生日", "血缘", "历史G1胜鞍", "对手", "同生年", "班级"]
+# 冷启动各阶段由CompatibilityData构造时记录的哪些阶段组成（用时相加）
+COLD_START_PHASES = {
+    'source_hash': ('source_hash',),
+    'csv_ingest': ('csv_read', 'map'),
+    'pair_build': ('pair_build',),
+    'pair_triple_build': ('pair_build', 'triple_build'),
+    'partner_index_build': ('partner_index_build',),
+    'cache_save': ('cache_save',)
+}
+# vectorized的用时随数据分布变化很大（剪枝不足时单个parent可达十几秒），需要时用--methods指定
+DEFAULT_METHODS = ('branch_and_bound', 'decomposition')
+
+
+def generate_dataset(csv_path: str, num_umas: int = 114, num_groups: int = 2462,
+                     size_weights: Dict[int, float] = None, score_weights: Dict[int, float] = None,
+                     seed: int = 0) -> List[str]:
+    """
+    生成与相性数据表.csv格式相同的合成数据
+
+    Args:
+        csv_path: 输出文件路径
+        num_umas: 马娘数
+        num_groups: 组数
+        size_weights: {组大小: 权重}，超过马娘数的组大小按马娘数计，默认按真实数据统计
+        score_weights: {分数: 权重}，默认按真实数据统计
+        seed: 随机种子，相同参数和种子生成的文件逐字节相同
+
+    Returns:
+        马娘名称列表
+    """
+    if num_umas < 2 or num_groups < 1:
+        raise ValueError("至少需要2只马娘和1个组")
+    size_weights = size_weights or DEFAULT_SIZE_WEIGHTS
+    score_weights = score_weights or DEFAULT_SCORE_WEIGHTS
+
+    rng = random.Random(seed)
+    umas = [f"马娘{i:04d}" for i in range(num_umas)]
+    sizes = rng.choices(list(size_weights), weights=list(size_weights.values()), k=num_groups)
+    scores = rng.choices(list(score_weights), weights=list(score_weights.values()), k=num_groups)
+
+    output_dir = os.path.dirname(csv_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_index, (size, score) in enumerate(zip(sizes, scores)):
+            members = rng.sample(umas, min(size, num_umas))
+            category = DEFAULT_CATEGORIES[group_index % len(DEFAULT_CATEGORIES)]
+            f.write(f'{group_index + 1},{score},{category},,"{", ".join(members)}"\n')
+    return umas
+
+
+def _time_repeated(func: Callable, repeat: int, ops: int = 1, warmup: bool = False) -> Dict:
+    """
+    重复执行并计时（静默运行，屏蔽进度输出）
+
+    Args:
+        func: 无参数的被测函数，每次执行完成ops次操作
+        repeat: 重复次数
+        ops: 每次执行包含的操作数
+        warmup: 是否先执行一次不计时（排除首次导入模块等一次性开销）
+
+    Returns:
+        {'seconds': 最短用时, 'median_seconds', 'repeat', 'ops', 'ops_per_second'}
+    """
+    timings = []
+    if warmup:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            func()
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return _summarize(timings, ops)
+
+
+def _summarize(timings: List[float], ops: int = 1) -> Dict:
+    """将多次用时汇总为计时结果（格式见_time_repeated）"""
+    best = min(timings)
+    return {
+        'seconds': best,
+        'median_seconds': statistics.median(timings),
+        'repeat': len(timings),
+        'ops': ops,
+        'ops_per_second': ops / best if best > 0 else None
+    }
+
+
+def _time_cold_start(csv_path: str, work_dir: str, repeat: int, num_processes: int,
+                     precompute_triples: bool) -> Dict[str, Dict]:
+    """
+    在空缓存目录中重复调用CompatibilityData的构造函数，按其记录的阶段分别计时
+
+    Args:
+        csv_path: 相性数据CSV路径
+        work_dir: 存放各次缓存的目录
+        repeat: 重复次数
+        num_processes: 构建三三相性表的进程数
+        precompute_triples: 是否构建三三相性表
+
+    Returns:
+        {阶段: 计时结果}，包含COLD_START_PHASES中的各阶段和整个构造过程cold_start_total
+    """
+    # 先完成一次不建三三相性表的冷启动，不计时（排除首次导入pandas等一次性开销）
+    CompatibilityData(csv_path, cache_dir=os.path.join(work_dir, "warmup"), num_processes=num_processes,
+                      precompute_triples=False, instrumentation=Instrumentation(quiet=True))
+
+    timings = {name: [] for name in list(COLD_START_PHASES) + ['cold_start_total']}
+    for attempt in range(repeat):
+        instrumentation = Instrumentation(quiet=True)
+        start = time.perf_counter()
+        CompatibilityData(csv_path, cache_dir=os.path.join(work_dir, f"cold_start_{attempt}"),
+                          num_processes=num_processes, precompute_triples=precompute_triples,
+                          instrumentation=instrumentation)
+        timings['cold_start_total'].append(time.perf_counter() - start)
+        for name, phases in COLD_START_PHASES.items():
+            timings[name].append(sum(instrumentation.phases[phase]['seconds'] for phase in phases
+                                     if phase in instrumentation.phases))
+    return {name: _summarize(values) for name, values in timings.items()}
+
+
+def _random_pedigrees(rng: np.random.Generator, num_umas: int, count: int) -> np.ndarray:
+    """随机生成合法的七马血统ID矩阵（形状为count×7，顺序同SLOTS）"""
+    rows = np.empty((count, 7), dtype=np.int64)
+    for i in range(count):
+        target, parent1, parent2 = rng.choice(num_umas, 3, replace=False)
+        others1 = np.setdiff1d(np.arange(num_umas), [target, parent1])
+        others2 = np.setdiff1d(np.arange(num_umas), [target, parent2])
+        rows[i, :3] = target, parent1, parent2
+        rows[i, 3:5] = rng.choice(others1, 2, replace=False)
+        rows[i, 5:] = rng.choice(others2, 2, replace=False)
+    return rows
+
+
+def run_benchmarks(csv_path: str, work_dir: str, repeat: int = 3, num_processes: int = 1,
+                   precompute_triples: bool = True, methods=DEFAULT_METHODS, num_parents: int = 5,
+                   top_n: int = 10, num_queries: int = 10000, num_bulk_rows: int = 1 << 20,
+                   seed: int = 0, verbose: bool = True) -> Dict:
+    """
+    依次计时各阶段
+
+    Args:
+        csv_path: 相性数据CSV路径
+        work_dir: 存放缓存的临时目录
+        repeat: 每个阶段的重复次数（取最短用时）
+        num_processes: 构建三三相性表的进程数
+        precompute_triples: 是否构建三三相性表
+        methods: 参与计时的五马搜索方式
+        num_parents: 五马和七马搜索计时的parent（target）数
+        top_n: 前N搜索的N
+        num_queries: 单次查询计时的查询数
+        num_bulk_rows: 批量计分的七马血统数
+        seed: 随机种子
+        verbose: 是否在完成每个阶段时打印用时
+
+    Returns:
+        {'format_version', 'environment', 'dataset', 'config', 'results': {阶段: 计时结果}}
+    """
+    results = {}
+
+    def report(name: str, result: Dict):
+        results[name] = result
+        if verbose:
+            print(f"{name:<32} {result['seconds'] * 1000:>10.2f} ms")
+        return result
+
+    def record(name: str, func: Callable, ops: int = 1, times: int = repeat, warmup: bool = False):
+        return report(name, _time_repeated(func, times, ops, warmup))
+
+    # 冷启动各阶段：通过公开的构造函数在空缓存目录中计时
+    cold_start = _time_cold_start(csv_path, os.path.join(work_dir, "build"), repeat, num_processes,
+                                  precompute_triples)
+    for name, result in cold_start.items():
+        report(name, result)
+
+    cache_dir = os.path.join(work_dir, "cache")
+    CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=num_processes,
+                      precompute_triples=precompute_triples, instrumentation=Instrumentation(quiet=True))
+    record("cache_load", lambda: CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=num_processes,
+                                                   precompute_triples=precompute_triples))
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=num_processes,
+                                 precompute_triples=precompute_triples)
+
+    # 单次查询
+    rng = np.random.default_rng(seed)
+    umas = data.uma_list
+    pairs = [(umas[i], umas[j]) for i, j in rng.choice(data.num_umas, (num_queries, 2))]
+    triples = [(umas[i], umas[j], umas[k]) for i, j, k in rng.choice(data.num_umas, (num_queries, 3))]
+    pedigrees = _random_pedigrees(rng, data.num_umas, min(num_queries, 2000))
+    named_pedigrees = [[umas[uma_id] for uma_id in row] for row in pedigrees]
+    calculator = CompatibilityCalculator(data)
+
+    record("pair_lookup", lambda: [data.get_pair_compatibility(*pair) for pair in pairs], ops=len(pairs))
+    record("triple_lookup", lambda: [data.get_triple_compatibility(*triple) for triple in triples], ops=len(triples))
+    record("seven_score", lambda: [calculator.calculate_compatibility_score(*row) for row in named_pedigrees],
+           ops=len(named_pedigrees))
+    record("top_partners", lambda: [data.get_top_partners(uma, k=top_n) for uma in umas], ops=len(umas))
+
+    # 批量计分
+    bulk = pedigrees[rng.integers(0, len(pedigrees), num_bulk_rows)]
+    record("score_many", lambda: calculator.score_many(bulk), ops=num_bulk_rows)
+
+    # 五马与七马搜索
+    parents = [umas[i] for i in rng.choice(data.num_umas, min(num_parents, data.num_umas), replace=False)]
+    five_horses = FiveHorsesCalculator(data)
+    for method in methods:
+        record(f"five_best[{method}]",
+               lambda: [five_horses.calculate_best_combination(parent, verbose=False, method=method)
+                        for parent in parents], ops=len(parents))
+        record(f"five_top{top_n}[{method}]",
+               lambda: [five_horses.get_top_combinations(parent, top_n=top_n, verbose=False, method=method)
+                        for parent in parents], ops=len(parents))
+
+    optimizer = PedigreeOptimizer(data)
+    record("pedigree_best[target]",
+           lambda: [optimizer.calculate_best_pedigree({'target': parent}) for parent in parents], ops=len(parents))
+    record(f"pedigree_top{top_n}[target]",
+           lambda: [optimizer.get_top_pedigrees({'target': parent}, top_n=top_n) for parent in parents],
+           ops=len(parents))
+
+    return {
+        'format_version': BENCHMARK_FORMAT_VERSION,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'dataset': {
+            'num_umas': data.num_umas,
+            'num_groups': len(data.group_bitsets.to_arrays()['group_ids']),
+            'source_hash': data.source_hash
+        },
+        'config': {
+            'repeat': repeat,
+            'num_processes': num_processes,
+            'precompute_triples': precompute_triples,
+            'methods': list(methods),
+            'num_parents': len(parents),
+            'top_n': top_n,
+            'num_queries': num_queries,
+            'num_bulk_rows': num_bulk_rows,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def compare_results(baseline: Dict, current: Dict) -> Dict[str, Optional[float]]:
+    """
+    对比两次基准测试结果
+
+    Args:
+        baseline: 旧版本的run_benchmarks结果
+        current: 新版本的run_benchmarks结果
+
+    Returns:
+        {阶段: 新用时/旧用时}，只包含两次都有的阶段；大于1表示变慢
+    """
+    ratios = {}
+    for name, result in current['results'].items():
+        if name in baseline['results']:
+            old_seconds = baseline['results'][name]['seconds']
+            ratios[name] = result['seconds'] / old_seconds if old_seconds > 0 else None
+    return ratios
+
+
+def main(argv: List[str] = None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="赛马娘相性计算器性能基准测试")
+    parser.add_argument("--csv", help="使用已有的相性数据CSV，不指定时生成合成数据")
+    parser.add_argument("--umas", type=int, default=114, help="合成数据的马娘数")
+    parser.add_argument("--groups", type=int, default=2462, help="合成数据的组数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--repeat", type=int, default=3, help="每个阶段的重复次数")
+    parser.add_argument("--processes", type=int, default=1, help="构建三三相性表的进程数")
+    parser.add_argument("--no-triples", action="store_true", help="不构建三三相性表")
+    parser.add_argument("--methods", default=",".join(DEFAULT_METHODS), help="参与计时的五马搜索方式，逗号分隔")
+    parser.add_argument("--parents", type=int, default=5, help="搜索计时的parent数")
+    parser.add_argument("--bulk-rows", type=int, default=1 << 20, help="批量计分的七马血统数")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    parser.add_argument("--compare", help="与之对比的旧结果JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = args.csv
+        if csv_path is None:
+            csv_path = os.path.join(work_dir, "相性数据表.csv")
+            generate_dataset(csv_path, num_umas=args.umas, num_groups=args.groups, seed=args.seed)
+        report = run_benchmarks(csv_path, work_dir, repeat=args.repeat, num_processes=args.processes,
+                                precompute_triples=not args.no_triples, methods=args.methods.split(","),
+                                num_parents=args.parents, num_bulk_rows=args.bulk_rows, seed=args.seed)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n与旧结果对比（新用时/旧用时）：")
+        for name, ratio in compare_results(baseline, report).items():
+            print(f"{name:<32} {'-' if ratio is None else f'{ratio:.2f}x'}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
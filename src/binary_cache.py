@@ -0,0 +1,106 @@
+import json
+import os
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+# 缓存格式版本，格式发生不兼容变化时递增，旧版本缓存会被视为无效并重新计算
+CACHE_FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+
+
+def save_binary_cache(cache_dir: str, metadata: Dict, arrays: Dict[str, np.ndarray]):
+    """
+    将按ID索引的数组保存为二进制缓存
+
+    每个数组保存为一个.npy文件，清单文件manifest.json记录格式版本、元数据以及各数组的
+    文件名、类型和形状。清单最后写入，因此只有完整写完的缓存才会被读取。
+    写入清单后删除旧清单中列出、新清单中不再使用的数组文件（旧版本或旧布局留下的数组），
+    目录中不属于缓存的文件不受影响。
+
+    Args:
+        cache_dir: 缓存目录
+        metadata: 需要一同保存的元数据（须可JSON序列化）
+        arrays: 数组名到数组的映射
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    previous_files = _manifest_files(manifest_path)
+    # 先删除旧清单，写入中途失败时缓存整体失效而不是新旧混杂
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    array_info = {}
+    for name, array in arrays.items():
+        file_name = f"{name}.npy"
+        tmp_path = os.path.join(cache_dir, file_name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, os.path.join(cache_dir, file_name))
+        array_info[name] = {
+            'file': file_name,
+            'dtype': np.dtype(array.dtype).str,
+            'shape': list(array.shape)
+        }
+
+    manifest = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'metadata': metadata,
+        'arrays': array_info
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+    current = {info['file'] for info in array_info.values()}
+    for file_name in previous_files - current:
+        path = os.path.join(cache_dir, file_name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _manifest_files(manifest_path: str) -> Set[str]:
+    """清单中列出的数组文件名（不论格式版本）；清单不存在或无法解析时为空集合"""
+    if not os.path.exists(manifest_path):
+        return set()
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            arrays = json.load(f)['arrays']
+        return {os.path.basename(info['file']) for info in arrays.values()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def load_binary_cache(cache_dir: str, mmap: bool = True) -> Optional[Tuple[Dict, Dict[str, np.ndarray]]]:
+    """
+    读取二进制缓存
+
+    Args:
+        cache_dir: 缓存目录
+        mmap: 是否以只读内存映射方式打开数组。映射后数据按需从页缓存读取，
+              同一台机器上的多个进程共享同一份物理内存
+
+    Returns:
+        (元数据, 数组字典)的元组；缓存不存在、版本不符或文件不完整时返回None
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != CACHE_FORMAT_VERSION:
+        return None
+
+    arrays = {}
+    for name, info in manifest['arrays'].items():
+        path = os.path.join(cache_dir, info['file'])
+        if not os.path.exists(path):
+            return None
+        array = np.load(path, mmap_mode='r' if mmap else None)
+        if array.dtype.str != info['dtype'] or list(array.shape) != info['shape']:
+            return None
+        arrays[name] = array
+
+    return manifest['metadata'], arrays
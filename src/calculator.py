@@ -1,6 +1,16 @@
-from typing import List, Tuple
+from itertools import islice
+from typing import Dict, List, Tuple, Iterable, Union
+
+import numpy as np
+
 from .compatibility import CompatibilityData
 
+# 七个位置，顺序与calculate_compatibility_score的参数一致
+SLOTS = ('target', 'parent1', 'parent2', 'grandparent1', 'grandparent2', 'grandparent3', 'grandparent4')
+
+# 相性点数的七项（以SLOTS中的下标表示），顺序与公式一致
+SCORE_TERMS = ((0, 1), (0, 2), (1, 2), (0, 1, 3), (0, 1, 4), (0, 2, 5), (0, 2, 6))
+
 class CompatibilityCalculator:
     def __init__(self, compatibility_data: CompatibilityData):
         """
@@ -71,4 +81,135 @@ class CompatibilityCalculator:
 
         if verbose:
             print(f"总相性点数: {total_score}")
-        return total_score
\ No newline at end of file
+        return total_score
+
+    def score_many(self, pedigrees: Union[np.ndarray, Iterable], return_terms: bool = False,
+                   chunk_size: int = 1 << 20):
+        """
+        批量计算七马血统的相性点数
+
+        每块最多chunk_size行：先批量将名称转换为ID（一次二分查找完成校验），
+        再用数组取值一次性算出全部七项，不逐行调用calculate_compatibility_score。
+
+        Args:
+            pedigrees: 形状为(行数, 7)的数组或由7元组组成的可迭代对象，每行按SLOTS的顺序排列，
+                       元素为马娘名称或马娘ID
+            return_terms: 是否同时返回每一项的分数
+            chunk_size: 每块处理的行数
+
+        Returns:
+            int64分数数组；return_terms为True时返回(分数数组, 形状为(行数, 7)的各项分数数组)，
+            各列顺序与SCORE_TERMS一致
+        """
+        score_chunks, term_chunks = [], []
+        for chunk in self._iter_chunks(pedigrees, chunk_size):
+            terms = self._score_chunk(self._to_id_rows(chunk))
+            score_chunks.append(terms.sum(axis=1))
+            if return_terms:
+                term_chunks.append(terms)
+
+        scores = np.concatenate(score_chunks) if score_chunks else np.zeros(0, dtype=np.int64)
+        if not return_terms:
+            return scores
+        terms = np.concatenate(term_chunks) if term_chunks else np.zeros((0, len(SCORE_TERMS)), dtype=np.int64)
+        return scores, terms
+
+    def explain(self, target: str, parent1: str, parent2: str, grandparent1: str, grandparent2: str,
+                grandparent3: str, grandparent4: str) -> Dict:
+        """
+        解释七只马娘的相性点数：每一项的分数，以及产生该分数的共同组
+
+        Args:
+            target ~ grandparent4: 七个位置的马娘，含义同calculate_compatibility_score
+
+        Returns:
+            解释字典，格式见explain_many
+        """
+        return self.explain_many([(target, parent1, parent2, grandparent1, grandparent2, grandparent3, grandparent4)])[0]
+
+    def explain_many(self, pedigrees: Union[np.ndarray, Iterable], chunk_size: int = 1 << 16) -> List[Dict]:
+        """
+        批量解释七马血统的相性点数
+
+        各项分数按score_many批量计算，共同组由compatibility_data.group_index查出，
+        同一次调用中相同的马娘组合只查一次（前N优结果的各行通常共用parent和祖父马娘）。
+
+        Args:
+            pedigrees: 七马血统，格式同score_many（马娘名称或马娘ID）
+            chunk_size: 每块处理的行数
+
+        Returns:
+            每行一个字典：{'score': 相性点数和,
+                           'terms': 按SCORE_TERMS顺序的七项，每项为
+                                    {'slots': 位置名元组, 'umas': 马娘名称列表, 'score': 该项分数,
+                                     'groups': 共同组信息（组号、分数、分类、补充）列表}}；
+            组信息字典在各行之间共用，请勿修改
+        """
+        data = self.compatibility_data
+        index = data.group_index
+        term_slots = [tuple(SLOTS[position] for position in term) for term in SCORE_TERMS]
+        groups_by_key: Dict[Tuple[int, ...], List[Dict]] = {}
+        explanations = []
+        for chunk in self._iter_chunks(pedigrees, chunk_size):
+            ids = self._to_id_rows(chunk)
+            terms = self._score_chunk(ids)
+            for row, row_terms in zip(ids.tolist(), terms.tolist()):
+                items = []
+                for slots, term, score in zip(term_slots, SCORE_TERMS, row_terms):
+                    key = tuple(sorted(row[position] for position in term))
+                    groups = groups_by_key.get(key)
+                    if groups is None:
+                        groups = groups_by_key[key] = index.explain(key)
+                    items.append({
+                        'slots': slots,
+                        'umas': [data.uma_list[row[position]] for position in term],
+                        'score': score,
+                        'groups': groups
+                    })
+                explanations.append({'score': sum(row_terms), 'terms': items})
+        return explanations
+
+    def _iter_chunks(self, pedigrees: Union[np.ndarray, Iterable], chunk_size: int):
+        """将七马血统按chunk_size行分块（数组直接切片，可迭代对象逐块取出）"""
+        if chunk_size < 1:
+            raise ValueError("chunk_size必须为正整数")
+        if isinstance(pedigrees, np.ndarray):
+            return (pedigrees[start:start + chunk_size] for start in range(0, len(pedigrees), chunk_size))
+        rows = iter(pedigrees)
+        return iter(lambda: list(islice(rows, chunk_size)), [])
+
+    def _to_id_rows(self, chunk) -> np.ndarray:
+        """将一块七马血统（名称或ID）转换为(行数, 7)的int64 ID数组"""
+        rows = np.asarray(chunk)
+        if rows.ndim != 2 or rows.shape[1] != len(SLOTS):
+            raise ValueError(f"七马血统须为形状(行数, {len(SLOTS)})的数组，实际为{rows.shape}")
+        if rows.dtype.kind in 'iu':
+            if rows.size and (rows.min() < 0 or rows.max() >= self.compatibility_data.num_umas):
+                raise ValueError(f"马娘ID须在0 ~ {self.compatibility_data.num_umas - 1}之间")
+            return rows.astype(np.int64)
+        return self.compatibility_data.get_uma_ids(rows)
+
+    def _score_chunk(self, ids: np.ndarray) -> np.ndarray:
+        """按ID计算一块七马血统的各项分数，返回形状为(行数, 7)的数组"""
+        data = self.compatibility_data
+        n = data.num_umas
+        pair_flat = np.asarray(data.pair_matrix).reshape(-1)
+        terms = np.empty((len(ids), len(SCORE_TERMS)), dtype=np.int64)
+
+        for column, term in enumerate(SCORE_TERMS):
+            if len(term) == 2:
+                terms[:, column] = pair_flat.take(ids[:, term[0]] * n + ids[:, term[1]])
+
+        triple_columns = [(column, term) for column, term in enumerate(SCORE_TERMS) if len(term) == 3]
+        if data.triple_store is not None:
+            for column, (a, b, c) in triple_columns:
+                terms[:, column] = data.triple_store.lookup(ids[:, a], ids[:, b], ids[:, c])
+        else:
+            # 未预计算三三相性表时，按target分组，每个target只计算一次三三相性切片
+            targets = ids[:, 0]
+            for target in np.unique(targets).tolist():
+                rows = np.flatnonzero(targets == target)
+                slice_flat = data.get_triple_slice(target).reshape(-1)
+                for column, (_, b, c) in triple_columns:
+                    terms[rows, column] = slice_flat.take(ids[rows, b] * n + ids[rows, c])
+        return terms
@@ -0,0 +1,63 @@
+"""
+搜索的截止时间与取消
+
+CancelToken可由其他线程调用cancel取消，也可带有截止时间。求解器在每个分支或数据块之间检查它，
+被取消时停止搜索并返回当时已找到的最优结果（当前最优解），同时报告是否已证明最优以及已覆盖的搜索空间比例。
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class CancelToken:
+    def __init__(self, timeout: float = None, parent: 'CancelToken' = None):
+        """
+        初始化取消令牌
+
+        Args:
+            timeout: 从现在起的最长搜索时间（秒），None表示不限时
+            parent: 上级令牌，上级被取消或超时时本令牌也视为已取消
+        """
+        self._event = threading.Event()
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.parent = parent
+
+    def cancel(self):
+        """取消搜索（可从其他线程调用）"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已被取消或已超过截止时间"""
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.parent is not None and self.parent.cancelled
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数（不早于0），不限时为None"""
+        remaining = None if self.deadline is None else max(self.deadline - time.monotonic(), 0.0)
+        if self.parent is not None and self.parent.remaining is not None:
+            remaining = self.parent.remaining if remaining is None else min(remaining, self.parent.remaining)
+        return remaining
+
+
+def make_cancel_token(timeout: float = None, cancel_token: CancelToken = None) -> Optional[CancelToken]:
+    """
+    合并超时和外部取消令牌
+
+    Args:
+        timeout: 最长搜索时间（秒），None表示不限时
+        cancel_token: 调用方持有的取消令牌
+
+    Returns:
+        同时受两者约束的令牌；两者都为None时返回None
+    """
+    if timeout is None:
+        return cancel_token
+    if timeout < 0:
+        raise ValueError("timeout不能为负数")
+    return CancelToken(timeout, parent=cancel_token)
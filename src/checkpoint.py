@@ -0,0 +1,152 @@
+"""
+长时间五马搜索的检查点
+
+brute_force按排列序号区间（限制了候选池时为各角色候选池笛卡尔积的序号区间）分片计算。
+检查点文件记录本次搜索的参数、分片划分、已完成的分片以及已完成部分的前N名，
+定期（以及被取消或中断时）原子地写入磁盘。
+以相同参数重新运行时跳过已完成的分片，合并结果与一次性完成的搜索完全相同。
+全部分片完成后检查点文件即被删除。
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+from .five_horses_solver import IdResult, sort_results
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+# 两次写入检查点之间的最短间隔（秒）
+DEFAULT_CHECKPOINT_INTERVAL = 30.0
+
+
+class SearchCheckpoint:
+    def __init__(self, path: str, signature: Dict, shards: List[Tuple[int, int]], top_n: int,
+                 interval: float = DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        初始化空的检查点（通常由open创建）
+
+        Args:
+            path: 检查点文件路径
+            signature: 搜索参数（parent、候选池、数据来源等），恢复时必须完全一致
+            shards: 序号区间的分片划分
+            top_n: 保留的结果数
+            interval: 两次写入之间的最短间隔（秒）
+        """
+        self.path = path
+        self.signature = signature
+        self.shards = [tuple(shard) for shard in shards]
+        self.top_n = top_n
+        self.interval = interval
+        self.completed = set()
+        # 已完成分片的前N名，按(分数降序, ID升序)排列
+        self.results: List[IdResult] = []
+        # 已完成分片中计算了分数的组合数
+        self.evaluated = 0
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def open(cls, path: str, signature: Dict, shards: List[Tuple[int, int]], top_n: int,
+             interval: float = DEFAULT_CHECKPOINT_INTERVAL) -> 'SearchCheckpoint':
+        """
+        读取已有的检查点，文件不存在时创建新的检查点
+
+        恢复时沿用文件中的分片划分（与本次的进程数无关）。
+
+        Args:
+            path: 检查点文件路径
+            signature: 本次搜索的参数
+            shards: 没有已有检查点时使用的分片划分
+            top_n: 保留的结果数
+            interval: 两次写入之间的最短间隔（秒）
+
+        Returns:
+            检查点
+
+        Raises:
+            ValueError: 文件格式不符，或文件中的搜索参数与本次不一致
+        """
+        if not os.path.exists(path):
+            return cls(path, signature, shards, top_n, interval)
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                state = json.load(f)
+            except json.JSONDecodeError:
+                raise ValueError(f"检查点文件 '{path}' 已损坏") from None
+        if state.get('format_version') != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f"检查点文件 '{path}' 的格式版本不受支持")
+        # 签名经过一次JSON往返后再比较（元组会变为列表）
+        if state['signature'] != json.loads(json.dumps(signature)) or state['top_n'] != top_n:
+            raise ValueError(f"检查点文件 '{path}' 与本次搜索的参数不一致")
+
+        checkpoint = cls(path, signature, state['shards'], top_n, interval)
+        checkpoint.completed = {tuple(shard) for shard in state['completed']}
+        checkpoint.results = [(score, tuple(ids)) for score, ids in state['results']]
+        checkpoint.evaluated = state['evaluated']
+        return checkpoint
+
+    @property
+    def total(self) -> int:
+        """全部分片的序号数"""
+        return sum(end - start for start, end in self.shards)
+
+    @property
+    def covered(self) -> int:
+        """已完成分片的序号数"""
+        return sum(end - start for start, end in self.completed)
+
+    @property
+    def complete(self) -> bool:
+        """是否所有分片都已完成"""
+        return len(self.completed) == len(self.shards)
+
+    def pending(self) -> List[Tuple[int, int]]:
+        """尚未完成的分片（按序号顺序）"""
+        return [shard for shard in self.shards if shard not in self.completed]
+
+    def record(self, shard: Tuple[int, int], results: List[IdResult], evaluated: int):
+        """
+        记录一个已完成的分片，距上次写入超过interval时写入磁盘
+
+        Args:
+            shard: 分片的(起始序号, 结束序号)
+            results: 该分片的前N名
+            evaluated: 该分片中计算了分数的组合数
+        """
+        shard = tuple(shard)
+        if shard in self.completed:
+            return
+        self.completed.add(shard)
+        self.evaluated += evaluated
+        self.results = sort_results(self.results + list(results))[:self.top_n]
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """原子地写入检查点文件（先写临时文件再替换）"""
+        state = {
+            'format_version': CHECKPOINT_FORMAT_VERSION,
+            'signature': self.signature,
+            'top_n': self.top_n,
+            'shards': [list(shard) for shard in self.shards],
+            'completed': sorted(list(shard) for shard in self.completed),
+            'results': [[score, list(ids)] for score, ids in self.results],
+            'evaluated': self.evaluated
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def remove(self):
+        """删除检查点文件（搜索完成后调用，文件不存在时无副作用）"""
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
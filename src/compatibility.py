@@ -1,52 +1,43 @@
-import pandas as pd
-import json
+import numpy as np
 import os
-from typing import List, Dict, Set, Tuple
-from itertools import combinations
-from tqdm import tqdm
+import hashlib
+from typing import List, Dict, Set, Optional, Tuple
 import multiprocessing
 from multiprocessing import Pool
-import math
+from .group_bitset import GroupBitsets
+from .binary_cache import save_binary_cache, load_binary_cache
+from .partner_index import PartnerIndex
+from .group_index import GroupIndex
+from .triple_store import TripleStore, canonical_keys, triple_entries
+from .instrumentation import Instrumentation
 
-def process_chunk(chunk_data):
+# 相性表的计算口径版本，计算规则变化时递增，旧口径的缓存会被整体重建
+SCHEMA_VERSION = 1
+
+def compute_source_hash(csv_path: str) -> str:
+    """计算相性数据CSV文件内容的SHA-256摘要，用于判断缓存是否过期"""
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# 工作进程中的组掩码（由init_chunk_worker在进程启动时设置一次）
+_chunk_group_bitsets: Optional[GroupBitsets] = None
+
+def init_chunk_worker(group_bitsets: GroupBitsets):
+    """三三相性计算进程池的初始化函数"""
+    global _chunk_group_bitsets
+    _chunk_group_bitsets = group_bitsets
+
+def process_chunk(chunk):
     """处理一个数据块的函数"""
-    chunk, uma_groups, df_data = chunk_data
-    chunk_results = {}
-    # 重建数据
-    uma_to_groups = {k: set(v) for k, v in uma_groups.items()}
-    df = pd.DataFrame(df_data)
-    
-    for uma1, uma2, uma3 in chunk:
-        score = 0
-        # 找出三个马娘共同所在的组
-        groups1 = {g['组号'] for g in get_uma_groups_internal(uma1, uma_to_groups, df)}
-        groups2 = {g['组号'] for g in get_uma_groups_internal(uma2, uma_to_groups, df)}
-        groups3 = {g['组号'] for g in get_uma_groups_internal(uma3, uma_to_groups, df)}
-        common_groups = groups1.intersection(groups2).intersection(groups3)
-        
-        # 累加共同组的分数
-        for group in get_uma_groups_internal(uma1, uma_to_groups, df):
-            if group['组号'] in common_groups:
-                score += group['分数']
-        
-        # 存储所有可能的排列
-        for perm in [(uma1, uma2, uma3), (uma1, uma3, uma2), 
-                    (uma2, uma1, uma3), (uma2, uma3, uma1),
-                    (uma3, uma1, uma2), (uma3, uma2, uma1)]:
-            chunk_results[perm] = score
-    return chunk_results
-
-def get_uma_groups_internal(uma_name: str, uma_to_groups: Dict[str, Set[int]], df: pd.DataFrame) -> List[Dict]:
-    """获取指定马娘所在的所有组信息"""
-    if uma_name not in uma_to_groups:
-        return []
-        
-    group_ids = uma_to_groups[uma_name]
-    groups = df[df['组号'].isin(group_ids)].to_dict('records')
-    return groups
+    # 每个马娘ID对应以其为最小ID的全部非零三三相性
+    return [triple_entries(_chunk_group_bitsets, uma_id) for uma_id in chunk]
 
 class CompatibilityData:
-    def __init__(self, csv_path: str = "data/相性数据表.csv", cache_dir: str = "data/cache", num_processes: int = None):
+    def __init__(self, csv_path: str = "data/相性数据表.csv", cache_dir: str = "data/cache", num_processes: int = None,
+                 precompute_triples: bool = True, instrumentation: Instrumentation = None):
         """
         初始化相性数据处理器
         
@@ -54,182 +45,440 @@ class CompatibilityData:
             csv_path: CSV文件路径
             cache_dir: 缓存目录路径
             num_processes: 计算三三相性时使用的进程数，默认为CPU核心数
+            precompute_triples: 是否预先计算并缓存三三相性表（TripleStore）；为False时三三相性由组掩码即时计算
+            instrumentation: 阶段计时与指标收集器，默认只打印进度；传入Instrumentation(quiet=True)可完全静默
         """
         self.cache_dir = cache_dir
         self.num_processes = num_processes or multiprocessing.cpu_count()
+        self.precompute_triples = precompute_triples
+        self.instrumentation = instrumentation or Instrumentation()
+        # 最近一次增量更新缓存的变更报告，未发生增量更新时为None
+        self.cache_update_report: Optional[Dict] = None
+        # 按相性排序的搭档索引，随缓存保存，首次使用时构建
+        self._partner_index: Optional[PartnerIndex] = None
+        # 马娘集合到共同组的索引，首次使用时构建
+        self._group_index: Optional[GroupIndex] = None
         os.makedirs(cache_dir, exist_ok=True)
         
-        # 尝试从缓存加载数据
-        if self._load_from_cache():
-            return
-            
-        print("正在加载CSV数据...")
-        # 如果没有缓存，则从CSV加载并计算
-        self.df = pd.read_csv(csv_path)
-        self.df['成员'] = self.df['成员'].apply(lambda x: [name.strip() for name in x.split(',')])
+        # 缓存以CSV内容摘要和计算口径版本为键，两者一致时直接加载
+        with self.instrumentation.phase('source_hash'):
+            self.source_hash = compute_source_hash(csv_path) if os.path.exists(csv_path) else None
+        with self.instrumentation.phase('cache_load'):
+            cache = load_binary_cache(self.cache_dir)
+            if cache is not None and self._is_cache_usable(cache[0]):
+                if self.source_hash is None or cache[0].get('source_hash') == self.source_hash:
+                    self._load_from_cache(cache)
+                    return
         
-        print("正在创建马娘到组号的映射...")
-        # 创建马娘到组号的映射
-        self.uma_to_groups: Dict[str, Set[int]] = {}
-        for _, row in tqdm(self.df.iterrows(), total=len(self.df), desc="处理组数据"):
-            group_id = row['组号']
-            for uma in row['成员']:
-                # 跳过"无"，但保留名字中带"无"的马娘
-                if uma == "无":
-                    continue
-                if uma not in self.uma_to_groups:
-                    self.uma_to_groups[uma] = set()
-                self.uma_to_groups[uma].add(group_id)
+        self._load_csv(csv_path)
         
-        # 获取所有马娘列表（去重）
-        self.all_umas = set(self.uma_to_groups.keys())
+        if cache is not None and self._is_cache_usable(cache[0]):
+            # CSV有改动：只重算受影响马娘之间的相性
+            with self.instrumentation.phase('cache_update'):
+                self._update_from_cache(cache)
+        else:
+            # 计算并缓存相性数据
+            self._calculate_compatibility()
+        del cache
+        self._save_to_cache()
+    
+    def _is_cache_usable(self, metadata: Dict) -> bool:
+        """缓存口径版本一致、包含组的分类和补充，且在需要三三相性表时包含该表"""
+        if metadata.get('schema_version') != SCHEMA_VERSION or 'group_categories' not in metadata:
+            return False
+        return metadata['has_triple_table'] or not self.precompute_triples
+    
+    def _load_csv(self, csv_path: str):
+        """从CSV加载组数据，建立马娘ID映射和组掩码（整列向量化处理，不逐行遍历）"""
+        import pandas as pd
         
-        print(f"共发现 {len(self.all_umas)} 个马娘")
-        print("马娘列表：")
-        for uma in sorted(self.all_umas):
-            print(f"- {uma}")
+        self.instrumentation.log("正在加载CSV数据...")
+        with self.instrumentation.phase('csv_read'):
+            self.df = pd.read_csv(csv_path)
         
-        # 计算并缓存相性数据
-        self._calculate_compatibility()
-        self._save_to_cache()
+        with self.instrumentation.phase('map'):
+            # 成员列展开为(行号, 马娘)的长表，行号按升序排列；空白单元格和多余的逗号不产生成员
+            members = self.df['成员'].fillna("").astype(str)
+            names = members.str.split(',').explode().str.strip().to_numpy(dtype=str)
+            rows = np.arange(len(self.df)).repeat(members.str.count(',').to_numpy() + 1)
+            rows, names = rows[names != ""], names[names != ""]
+            counts = np.bincount(rows, minlength=len(self.df))
+            self.df['成员'] = [chunk.tolist() for chunk in np.split(names, np.cumsum(counts)[:-1])]
+            
+            # 跳过"无"，但保留名字中带"无"的马娘
+            keep = names != "无"
+            rows, names = rows[keep], names[keep]
+            
+            # 获取所有马娘列表（去重），名称按排序后的位置驻留为ID
+            self._build_uma_index(np.unique(names).tolist())
+            uma_ids = self.get_uma_ids(names)
+            
+            # 创建马娘到组号的映射
+            group_ids = self.df['组号'].to_numpy()
+            order = np.argsort(uma_ids, kind='stable')
+            boundaries = np.flatnonzero(np.diff(uma_ids[order])) + 1
+            self.uma_to_groups: Dict[str, Set[int]] = {
+                self.uma_list[uma_id]: set(groups.tolist())
+                for uma_id, groups in zip(uma_ids[order][np.r_[0, boundaries]].tolist(),
+                                          np.split(group_ids[rows[order]], boundaries))
+            }
+            
+            # 组的分类和补充（空白为空字符串），用于解释相性分数的来源
+            self.group_categories = self._text_column('分类')
+            self.group_notes = self._text_column('补充')
+            
+            # 组成员以CSR形式交给组掩码（rows已按行号排列）
+            member_indptr = np.zeros(len(self.df) + 1, dtype=np.int64)
+            member_indptr[1:] = np.cumsum(np.bincount(rows, minlength=len(self.df)))
+            self.group_bitsets = GroupBitsets.from_arrays(
+                group_ids,
+                self.df['分数'].to_numpy(),
+                member_indptr,
+                uma_ids,
+                self.num_umas
+            )
+        
+        self.instrumentation.log(f"共发现 {self.num_umas} 个马娘")
     
+    def _text_column(self, column: str) -> List[str]:
+        """读取CSV中的文本列，缺失的列或空白单元格为空字符串"""
+        if column not in self.df:
+            return [""] * len(self.df)
+        return self.df[column].fillna("").astype(str).str.strip().tolist()
+    
+    @classmethod
+    def from_tables(cls, uma_list: List[str], pair_matrix: np.ndarray,
+                    triple_store: TripleStore = None,
+                    group_bitsets: GroupBitsets = None) -> 'CompatibilityData':
+        """
+        直接由已计算好的相性表构建实例（不读取CSV，也不读写缓存），供子进程重建数据使用
+
+        Args:
+            uma_list: 按ID排列的马娘名称列表
+            pair_matrix: N×N两两相性矩阵
+            triple_store: 三三相性表，为None时由group_bitsets即时计算
+            group_bitsets: 组掩码
+
+        Returns:
+            CompatibilityData实例
+        """
+        data = cls.__new__(cls)
+        data._build_uma_index(uma_list)
+        data._partner_index = None
+        data._group_index = None
+        data.group_categories = None
+        data.group_notes = None
+        data.instrumentation = Instrumentation(quiet=True)
+        data.source_hash = None
+        data.pair_matrix = pair_matrix
+        data.triple_store = triple_store
+        data.group_bitsets = group_bitsets
+        return data
+
+    def _build_uma_index(self, umas):
+        """将马娘名称驻留为连续的整数ID（按名称排序），并建立名称与ID的双向映射"""
+        self.uma_list: List[str] = sorted(umas)
+        self.uma_to_id: Dict[str, int] = {uma: i for i, uma in enumerate(self.uma_list)}
+        self.all_umas = set(self.uma_list)
+        self.num_umas = len(self.uma_list)
+
     def _calculate_compatibility(self):
         """计算所有马娘之间的相性分数"""
-        print("\n正在计算两两相性...")
-        # 计算两两相性
-        self.pair_compatibility: Dict[Tuple[str, str], int] = {}
-        pair_combinations = list(combinations(sorted(self.all_umas), 2))
-        for uma1, uma2 in tqdm(pair_combinations, desc="计算两两相性"):
-            score = self._calculate_pair_score(uma1, uma2)
-            self.pair_compatibility[(uma1, uma2)] = score
-            self.pair_compatibility[(uma2, uma1)] = score  # 对称性
+        self.instrumentation.log("\n正在计算两两相性...")
+        # 计算两两相性，按ID存入对称矩阵
+        with self.instrumentation.phase('pair_build'):
+            self.pair_matrix = self.group_bitsets.pair_matrix()
         
-        print("\n正在计算三三相性...")
-        # 计算三三相性
-        self.triple_compatibility: Dict[Tuple[str, str, str], int] = {}
-        triple_combinations = list(combinations(sorted(self.all_umas), 3))
+        if not self.precompute_triples:
+            # 三三相性由组掩码即时计算，不预先建表
+            self.triple_store = None
+            return
         
-        # 将组合列表分成多个块，每个进程处理一个块
-        chunk_size = math.ceil(len(triple_combinations) / self.num_processes)
-        chunks = [triple_combinations[i:i + chunk_size] for i in range(0, len(triple_combinations), chunk_size)]
+        self.instrumentation.log("\n正在计算三三相性...")
+        # 计算三三相性，每个三元组按升序ID只保存一次，只保留非零项
+        keys, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int32)]
+        uma_ids = list(range(self.num_umas))
         
-        # 准备进程间共享的数据
-        uma_groups_data = {k: list(v) for k, v in self.uma_to_groups.items()}
-        df_data = self.df.to_dict('records')
+        # 将马娘ID交错分成多个块（ID越小，以其为最小ID的三元组越多），每个进程处理一个块
+        num_chunks = min(self.num_processes, len(uma_ids)) or 1
+        chunks = [uma_ids[i::num_chunks] for i in range(num_chunks)]
         
         # 使用进程池并行处理
-        with Pool(processes=self.num_processes) as pool:
-            # 准备任务数据
-            chunk_data = [(chunk, uma_groups_data, df_data) for chunk in chunks]
+        with self.instrumentation.phase('triple_build'), \
+                Pool(processes=self.num_processes, initializer=init_chunk_worker, initargs=(self.group_bitsets,)) as pool:
+            # 组掩码在进程启动时传递一次，每个任务只携带马娘ID
+            chunk_data = chunks
             
-            # 使用tqdm显示总体进度
-            with tqdm(total=len(triple_combinations), desc="计算三三相性") as pbar:
+            # 显示总体进度
+            with self.instrumentation.progress(total=len(uma_ids), desc="计算三三相性") as pbar:
                 # 处理完成的任务
                 for chunk_results in pool.imap_unordered(process_chunk, chunk_data):
-                    self.triple_compatibility.update(chunk_results)
+                    for uma_keys, uma_values in chunk_results:
+                        keys.append(uma_keys)
+                        values.append(uma_values)
                     # 更新进度条
-                    pbar.update(chunk_size)
+                    pbar.update(len(chunk_results))
+            self.triple_store = TripleStore.from_entries(self.num_umas, np.concatenate(keys), np.concatenate(values))
     
     def _calculate_pair_score(self, uma1: str, uma2: str) -> int:
         """计算两个马娘之间的相性分数"""
-        score = 0
-        groups1 = self.get_uma_groups(uma1)
-        groups2 = self.get_uma_groups(uma2)
-        
-        # 找出两个马娘共同所在的组
-        group_ids1 = {g['组号'] for g in groups1}
-        group_ids2 = {g['组号'] for g in groups2}
-        common_groups = group_ids1.intersection(group_ids2)
-        
-        # 累加共同组的分数
-        for group in groups1:
-            if group['组号'] in common_groups:
-                score += group['分数']
-                
-        return score
+        return self.group_bitsets.pair_score(self.uma_to_id[uma1], self.uma_to_id[uma2])
     
     def _calculate_triple_score(self, uma1: str, uma2: str, uma3: str) -> int:
         """计算三个马娘之间的相性分数"""
-        score = 0
-        groups1 = self.get_uma_groups(uma1)
-        groups2 = self.get_uma_groups(uma2)
-        groups3 = self.get_uma_groups(uma3)
+        return self.group_bitsets.triple_score(self.uma_to_id[uma1], self.uma_to_id[uma2], self.uma_to_id[uma3])
+    
+    def _save_to_cache(self):
+        """将计算结果保存到二进制缓存"""
+        arrays = {'pair_matrix': self.pair_matrix}
+        if self.triple_store is not None:
+            arrays.update(self.triple_store.to_arrays())
+        arrays.update(self.group_bitsets.to_arrays())
+        arrays.update(self.partner_index.to_arrays())
         
-        # 找出三个马娘共同所在的组
-        group_ids1 = {g['组号'] for g in groups1}
-        group_ids2 = {g['组号'] for g in groups2}
-        group_ids3 = {g['组号'] for g in groups3}
-        common_groups = group_ids1.intersection(group_ids2).intersection(group_ids3)
+        self.instrumentation.log("\n正在保存计算结果到缓存...")
         
-        # 累加共同组的分数
-        for group in groups1:
-            if group['组号'] in common_groups:
-                score += group['分数']
-                
-        return score
+        metadata = {
+            'uma_list': self.uma_list,
+            'has_triple_table': self.triple_store is not None,
+            'source_hash': self.source_hash,
+            'schema_version': SCHEMA_VERSION,
+            'group_categories': self.group_categories,
+            'group_notes': self.group_notes
+        }
+        with self.instrumentation.phase('cache_save'):
+            save_binary_cache(self.cache_dir, metadata, arrays)
+        self.instrumentation.log("缓存保存完成！")
     
-    def _save_to_cache(self):
-        """将计算结果保存到缓存"""
-        print("\n正在保存计算结果到缓存...")
-        # 保存两两相性
-        pair_cache = {f"{k[0]},{k[1]}": v for k, v in tqdm(self.pair_compatibility.items(), desc="保存两两相性")}
-        with open(os.path.join(self.cache_dir, "pair_compatibility.json"), "w", encoding="utf-8") as f:
-            json.dump(pair_cache, f, ensure_ascii=False, indent=2)
+    def _load_from_cache(self, cache):
+        """从缓存加载数据（数组以只读内存映射方式打开，几乎不占用加载时间）"""
+        metadata, arrays = cache
         
-        # 保存三三相性
-        triple_cache = {f"{k[0]},{k[1]},{k[2]}": v for k, v in tqdm(self.triple_compatibility.items(), desc="保存三三相性")}
-        with open(os.path.join(self.cache_dir, "triple_compatibility.json"), "w", encoding="utf-8") as f:
-            json.dump(triple_cache, f, ensure_ascii=False, indent=2)
-
-        # 保存马娘列表
-        uma_list_cache = list(self.all_umas)
-        with open(os.path.join(self.cache_dir, "uma_list.json"), "w", encoding="utf-8") as f:
-            json.dump(uma_list_cache, f, ensure_ascii=False, indent=2)
-            
-        print("缓存保存完成！")
+        self.instrumentation.log("正在从缓存加载数据...")
+        self._build_uma_index(metadata['uma_list'])
+        self.group_categories = metadata['group_categories']
+        self.group_notes = metadata['group_notes']
+        self.pair_matrix = arrays['pair_matrix']
+        self.triple_store = TripleStore.from_arrays(arrays, self.num_umas) if self.precompute_triples else None
+        self.group_bitsets = GroupBitsets.from_arrays(
+            arrays['group_ids'],
+            arrays['group_scores'],
+            arrays['group_member_indptr'],
+            arrays['group_member_indices'],
+            self.num_umas
+        )
+        if 'partner_order' in arrays:
+            self._partner_index = PartnerIndex.from_arrays(arrays)
+        
+        self.instrumentation.log("缓存加载完成！")
     
-    def _load_from_cache(self) -> bool:
-        """从缓存加载数据"""
-        pair_cache_path = os.path.join(self.cache_dir, "pair_compatibility.json")
-        triple_cache_path = os.path.join(self.cache_dir, "triple_compatibility.json")
-        uma_list_path = os.path.join(self.cache_dir, "uma_list.json")
+    def _update_from_cache(self, cache):
+        """
+        CSV改动后增量更新相性表
+
+        比较缓存中的组与新CSV中的组，找出新增、删除、分数变化和成员变化的组，
+        这些组的新旧成员即为受影响的马娘。只有全部成员都受影响的两两/三三组合才可能改变，
+        因此其余组合直接从旧表按名称搬运，只重算受影响马娘之间的子块。
+        """
+        metadata, arrays = cache
+        old_uma_list = metadata['uma_list']
+        old_bitsets = GroupBitsets.from_arrays(
+            arrays['group_ids'],
+            arrays['group_scores'],
+            arrays['group_member_indptr'],
+            arrays['group_member_indices'],
+            len(old_uma_list)
+        )
         
-        if not (os.path.exists(pair_cache_path) and os.path.exists(triple_cache_path) and os.path.exists(uma_list_path)):
-            return False
+        self.instrumentation.log("\n检测到相性数据有改动，正在增量更新缓存...")
+        old_groups = {
+            group_id: (score, frozenset(old_uma_list[uma_id] for uma_id in members))
+            for group_id, score, members in zip(old_bitsets.group_ids, old_bitsets.group_scores, old_bitsets.group_members)
+        }
+        new_groups = {
+            group_id: (score, frozenset(self.uma_list[uma_id] for uma_id in members))
+            for group_id, score, members in zip(self.group_bitsets.group_ids, self.group_bitsets.group_scores, self.group_bitsets.group_members)
+        }
+        added_groups = sorted(set(new_groups) - set(old_groups))
+        removed_groups = sorted(set(old_groups) - set(new_groups))
+        common_groups = sorted(set(old_groups) & set(new_groups))
+        rescored_groups = [g for g in common_groups if old_groups[g][0] != new_groups[g][0]]
+        member_changed_groups = [g for g in common_groups if old_groups[g][1] != new_groups[g][1]]
         
-        print("正在从缓存加载数据...")
-        # 加载两两相性
-        with open(pair_cache_path, "r", encoding="utf-8") as f:
-            pair_cache = json.load(f)
-        self.pair_compatibility = {tuple(k.split(",")): v for k, v in tqdm(pair_cache.items(), desc="加载两两相性")}
+        # 受影响的马娘：所有变动组的新旧成员中仍在名单内的马娘
+        affected = set()
+        for group_id in added_groups + rescored_groups + member_changed_groups:
+            affected |= new_groups[group_id][1]
+        for group_id in removed_groups + rescored_groups + member_changed_groups:
+            affected |= old_groups[group_id][1]
+        affected_ids = np.array(sorted(self.uma_to_id[uma] for uma in affected if uma in self.uma_to_id), dtype=np.int64)
         
-        # 加载三三相性
-        with open(triple_cache_path, "r", encoding="utf-8") as f:
-            triple_cache = json.load(f)
-        self.triple_compatibility = {tuple(k.split(",")): v for k, v in tqdm(triple_cache.items(), desc="加载三三相性")}
+        # 按名称把旧表中仍在名单内的马娘搬运到新ID下
+        old_uma_to_id = {uma: i for i, uma in enumerate(old_uma_list)}
+        kept_new = np.array([i for i, uma in enumerate(self.uma_list) if uma in old_uma_to_id], dtype=np.int64)
+        kept_old = np.array([old_uma_to_id[self.uma_list[i]] for i in kept_new], dtype=np.int64)
         
-        # 加载马娘列表
-        with open(uma_list_path, "r", encoding="utf-8") as f:
-            uma_list = json.load(f)
-        self.all_umas = set(uma_list)
+        self.pair_matrix = np.zeros((self.num_umas, self.num_umas), dtype=np.int32)
+        self.pair_matrix[np.ix_(kept_new, kept_new)] = arrays['pair_matrix'][np.ix_(kept_old, kept_old)]
+        self.pair_matrix[np.ix_(affected_ids, affected_ids)] = self.group_bitsets.pair_matrix(affected_ids)
+        num_affected = len(affected_ids)
         
-        print("缓存加载完成！")
-        return True
+        recomputed_triples = 0
+        if self.precompute_triples:
+            # 旧表的非零项换算到新ID下，去掉含已移除马娘或三只都受影响（需要重算）的三元组
+            old_ids, old_values = TripleStore.from_arrays(arrays, len(old_uma_list)).entries()
+            id_map = np.full(len(old_uma_list), -1, dtype=np.int64)
+            id_map[kept_old] = kept_new
+            new_ids = id_map[old_ids]
+            is_affected = np.zeros(self.num_umas, dtype=bool)
+            is_affected[affected_ids] = True
+            keep = (new_ids >= 0).all(axis=1)
+            keep[keep] = ~is_affected[new_ids[keep]].all(axis=1)
+            keys = [canonical_keys(new_ids[keep, 0], new_ids[keep, 1], new_ids[keep, 2])[0]]
+            values = [old_values[keep]]
+            with self.instrumentation.progress(total=len(affected_ids), desc="重算三三相性") as pbar:
+                for uma_id in affected_ids:
+                    uma_keys, uma_values = triple_entries(self.group_bitsets, uma_id, affected_ids)
+                    keys.append(uma_keys)
+                    values.append(uma_values)
+                    pbar.update(1)
+            self.triple_store = TripleStore.from_entries(self.num_umas, np.concatenate(keys), np.concatenate(values))
+            recomputed_triples = num_affected * (num_affected - 1) * (num_affected - 2) // 6
+        else:
+            self.triple_store = None
+        
+        self.cache_update_report = {
+            'old_source_hash': metadata.get('source_hash'),
+            'new_source_hash': self.source_hash,
+            'added_groups': added_groups,
+            'removed_groups': removed_groups,
+            'rescored_groups': rescored_groups,
+            'member_changed_groups': member_changed_groups,
+            'added_umas': sorted(set(self.uma_list) - set(old_uma_list)),
+            'removed_umas': sorted(set(old_uma_list) - set(self.uma_list)),
+            'affected_umas': [self.uma_list[i] for i in affected_ids],
+            'recomputed_pairs': num_affected * (num_affected - 1) // 2,
+            'recomputed_triples': recomputed_triples
+        }
+        report = self.cache_update_report
+        self.instrumentation.log(f"新增组: {len(report['added_groups'])}，删除组: {len(report['removed_groups'])}，"
+                                 f"分数变化组: {len(report['rescored_groups'])}，成员变化组: {len(report['member_changed_groups'])}")
+        self.instrumentation.log(f"新增马娘: {report['added_umas']}，移除马娘: {report['removed_umas']}")
+        self.instrumentation.log(f"受影响马娘 {len(affected_ids)} 个，重算两两相性 {report['recomputed_pairs']} 项，"
+                                 f"三三相性 {report['recomputed_triples']} 项")
     
+    def get_uma_id(self, uma_name: str) -> int:
+        """
+        获取马娘对应的整数ID
+
+        Args:
+            uma_name: 马娘名称
+
+        Returns:
+            马娘ID（0 ~ N-1）
+        """
+        if uma_name not in self.uma_to_id:
+            raise ValueError(f"马娘 '{uma_name}' 不存在于数据中")
+        return self.uma_to_id[uma_name]
+
+    def get_uma_ids(self, uma_names) -> np.ndarray:
+        """
+        批量获取马娘对应的整数ID
+
+        马娘列表按名称排序，ID即名称在列表中的位置，因此可用二分查找一次性完成转换和校验
+
+        Args:
+            uma_names: 任意形状的马娘名称数组（或可转换为数组的序列）
+
+        Returns:
+            形状相同的int64 ID数组
+        """
+        names = np.asarray(uma_names, dtype=str)
+        sorted_names = np.array(self.uma_list, dtype=str)
+        ids = np.searchsorted(sorted_names, names)
+        found = ids < self.num_umas
+        found[found] = sorted_names[ids[found]] == names[found]
+        if not found.all():
+            unknown = sorted(set(names[~found].tolist()))
+            raise ValueError(f"马娘 {', '.join(repr(uma) for uma in unknown)} 不存在于数据中")
+        return ids.astype(np.int64)
+
+    def get_uma_name(self, uma_id: int) -> str:
+        """
+        获取整数ID对应的马娘名称
+
+        Args:
+            uma_id: 马娘ID
+
+        Returns:
+            马娘名称
+        """
+        return self.uma_list[uma_id]
+
     def get_pair_compatibility(self, uma1: str, uma2: str) -> int:
         """获取两个马娘之间的相性分数"""
         # 检查是否有重复的马娘
         if uma1 == uma2:
             return 0
-        return self.pair_compatibility.get((uma1, uma2), 0)
+        id1 = self.uma_to_id.get(uma1)
+        id2 = self.uma_to_id.get(uma2)
+        if id1 is None or id2 is None:
+            return 0
+        return self.get_pair_compatibility_by_id(id1, id2)
+
+    def get_pair_compatibility_by_id(self, id1: int, id2: int) -> int:
+        """按ID获取两个马娘之间的相性分数（同一ID的对角线元素恒为0）"""
+        return int(self.pair_matrix[id1, id2])
     
     def get_triple_compatibility(self, uma1: str, uma2: str, uma3: str) -> int:
         """获取三个马娘之间的相性分数"""
         # 检查是否有重复的马娘
         if len({uma1, uma2, uma3}) < 3:  # 如果有重复，集合长度会小于3
             return 0
-        return self.triple_compatibility.get((uma1, uma2, uma3), 0)
+        id1 = self.uma_to_id.get(uma1)
+        id2 = self.uma_to_id.get(uma2)
+        id3 = self.uma_to_id.get(uma3)
+        if id1 is None or id2 is None or id3 is None:
+            return 0
+        return self.get_triple_compatibility_by_id(id1, id2, id3)
+
+    def get_triple_compatibility_by_id(self, id1: int, id2: int, id3: int) -> int:
+        """按ID获取三个马娘之间的相性分数（与顺序无关，含重复ID时为0）"""
+        if self.triple_store is None:
+            # 未预计算三三相性表时，由组掩码即时计算
+            if id1 == id2 or id1 == id3 or id2 == id3:
+                return 0
+            return self.group_bitsets.triple_score(id1, id2, id3)
+        return self.triple_store.score(id1, id2, id3)
+
+    def get_triple_slice(self, uma_id: int) -> np.ndarray:
+        """
+        获取指定马娘参与的全部三三相性
+
+        Args:
+            uma_id: 马娘ID
+
+        Returns:
+            N×N的int32矩阵，第(j, k)个元素为三三相性(uma_id, j, k)
+        """
+        if self.triple_store is None:
+            return self.group_bitsets.triple_slice(uma_id)
+        return self.triple_store.slice(uma_id)
     
+    def get_group_compatibility(self, umas: List[str]) -> int:
+        """
+        获取任意多个马娘之间的相性分数，即她们共同所在组的分数之和
+
+        Args:
+            umas: 马娘名称列表
+
+        Returns:
+            相性分数，有重复马娘时为0
+        """
+        if len(set(umas)) < len(umas):
+            return 0
+        return self.group_bitsets.score(self.get_uma_id(uma) for uma in umas)
+
     def get_uma_groups(self, uma_name: str) -> List[Dict]:
         """
         获取指定马娘所在的所有组信息
@@ -240,13 +489,68 @@ class CompatibilityData:
         Returns:
             包含组信息的字典列表，每个字典包含组号、分数、分类、补充和成员信息
         """
-        if uma_name not in self.uma_to_groups:
+        if uma_name not in self.uma_to_id:
             return []
-            
-        group_ids = self.uma_to_groups[uma_name]
-        groups = self.df[self.df['组号'].isin(group_ids)].to_dict('records')
-        return groups
+        
+        index = self.group_index
+        return [dict(index.groups[position], 成员=index.group_members(position))
+                for position in index.uma_groups(self.uma_to_id[uma_name]).tolist()]
     
+    @property
+    def group_index(self) -> GroupIndex:
+        """马娘集合到共同组的索引（首次使用时由组掩码构建）"""
+        if self._group_index is None:
+            with self.instrumentation.phase('group_index_build'):
+                self._group_index = GroupIndex(self.uma_list, self.group_bitsets,
+                                               self.group_categories, self.group_notes)
+        return self._group_index
+    
+    @property
+    def partner_index(self) -> PartnerIndex:
+        """按相性排序的搭档索引（缓存中没有时由相性表构建）"""
+        if self._partner_index is None:
+            with self.instrumentation.phase('partner_index_build'):
+                self._partner_index = PartnerIndex.build(self.pair_matrix, self.get_triple_slice)
+        return self._partner_index
+
+    def get_top_partners(self, uma_name: str, k: int = 10) -> List[Tuple[str, int]]:
+        """
+        获取与指定马娘两两相性最高的k个搭档
+
+        Args:
+            uma_name: 马娘名称
+            k: 搭档数
+
+        Returns:
+            按相性降序排列的(马娘名称, 相性分数)列表，同分时按ID升序
+        """
+        partner_ids, scores = self.partner_index.top_partners(self.get_uma_id(uma_name), k)
+        return [(self.uma_list[uma_id], score) for uma_id, score in zip(partner_ids.tolist(), scores.tolist())]
+
+    def get_best_thirds(self, uma1: str, uma2: str, k: int = 10) -> List[Tuple[str, int]]:
+        """
+        获取与一对马娘三三相性最高的k个第三成员
+
+        k不超过索引保存的数量时直接读取索引，否则由三三相性切片现算
+
+        Args:
+            uma1: 马娘1名称
+            uma2: 马娘2名称
+            k: 第三成员数
+
+        Returns:
+            按相性降序排列的(马娘名称, 三三相性)列表，同分时按ID升序
+        """
+        id1, id2 = self.get_uma_id(uma1), self.get_uma_id(uma2)
+        if k <= self.partner_index.num_thirds:
+            third_ids, scores = self.partner_index.best_thirds(id1, id2, k)
+        else:
+            row = self.get_triple_slice(id1)[id2]
+            third_ids = np.array([uma_id for uma_id in range(self.num_umas) if uma_id not in (id1, id2)], dtype=np.int64)
+            third_ids = third_ids[np.lexsort((third_ids, -row[third_ids]))][:k]
+            scores = row[third_ids]
+        return [(self.uma_list[uma_id], score) for uma_id, score in zip(third_ids.tolist(), scores.tolist())]
+
     def get_uma_compatibility(self, uma_name: str) -> Dict[str, int]:
         """
         获取指定马娘与其他马娘的相性分数
@@ -255,20 +559,11 @@ class CompatibilityData:
             uma_name: 马娘名称
             
         Returns:
-            字典，键为其他马娘名称，值为相性分数
+            字典，键为其他马娘名称，值为相性分数（只包含分数大于0的马娘，按分数降序排列）
         """
-        compatibility = {}
-        groups = self.get_uma_groups(uma_name)
-        
-        for group in groups:
-            score = group['分数']
-            for other_uma in group['成员']:
-                if other_uma != uma_name:
-                    if other_uma not in compatibility:
-                        compatibility[other_uma] = 0
-                    compatibility[other_uma] += score
-                    
-        return compatibility
+        if uma_name not in self.uma_to_id:
+            return {}
+        return {uma: score for uma, score in self.get_top_partners(uma_name, k=None) if score > 0}
 
     def get_all_umas(self) -> Set[str]:
         """
@@ -0,0 +1,144 @@
+"""
+常驻计算引擎
+
+连续查询多个parent时，每次新建进程池、重新放置相性表的开销会超过计算本身。
+引擎在start时只放置一次共享相性表并启动进程池，工作进程在初始化时挂载相性表后常驻，
+之后的每次查询直接复用这些进程，直到close为止。
+"""
+
+import multiprocessing
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .compatibility import CompatibilityData
+from .five_horses_calculator import FiveHorsesCalculator
+from .instrumentation import Instrumentation
+from .cancellation import CancelToken
+from .shared_tables import SharedTables, init_worker
+
+
+class FiveHorsesEngine:
+    def __init__(self, compatibility_data: CompatibilityData, num_processes: int = None,
+                 instrumentation: Instrumentation = None):
+        """
+        初始化常驻计算引擎（需调用start或使用with语句启动）
+
+        Args:
+            compatibility_data: 相性数据处理器实例
+            num_processes: 常驻进程数，默认为CPU核心数
+            instrumentation: 阶段计时与指标收集器，默认与相性数据处理器共用
+        """
+        self.compatibility_data = compatibility_data
+        self.num_processes = num_processes or multiprocessing.cpu_count()
+        self.calculator = FiveHorsesCalculator(compatibility_data, engine=self, instrumentation=instrumentation)
+        self.instrumentation = self.calculator.instrumentation
+        self._shared_tables: Optional[SharedTables] = None
+        self._pool = None
+
+    @property
+    def running(self) -> bool:
+        """引擎是否已启动"""
+        return self._pool is not None
+
+    @property
+    def pool(self):
+        """常驻进程池"""
+        self._check_running()
+        return self._pool
+
+    def _check_running(self):
+        """检查引擎是否已启动"""
+        if self._pool is None:
+            raise RuntimeError("引擎尚未启动，请先调用start()")
+
+    def start(self) -> 'FiveHorsesEngine':
+        """
+        放置共享相性表并启动常驻进程池（重复调用无副作用）
+
+        Returns:
+            引擎自身
+        """
+        if self.running:
+            return self
+        with self.instrumentation.phase('engine_start', processes=self.num_processes):
+            self._shared_tables = SharedTables(self.compatibility_data)
+            try:
+                self._pool = Pool(processes=self.num_processes, initializer=init_worker,
+                                  initargs=(self._shared_tables.spec,))
+            except Exception:
+                self._shared_tables.close()
+                self._shared_tables = None
+                raise
+        return self
+
+    def close(self):
+        """关闭进程池并释放共享相性表（重复调用无副作用）"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._shared_tables is not None:
+            self._shared_tables.close()
+            self._shared_tables = None
+
+    def __enter__(self) -> 'FiveHorsesEngine':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def search_report(self) -> Optional[Dict]:
+        """最近一次搜索的报告，见FiveHorsesCalculator.search_report"""
+        return self.calculator.search_report
+
+    def calculate_best_combination(self, parent: str, verbose: bool = False, method: str = 'vectorized',
+                                   allowed=None, excluded: Iterable[str] = None, timeout: float = None,
+                                   cancel_token: CancelToken = None, budget: int = None) -> Tuple[Dict, int]:
+        """
+        使用常驻进程计算给定parent下的最优五马组合
+
+        Args:
+            parent: 指定的父辈马娘
+            verbose: 是否显示详细进度信息
+            method: 搜索方式，见SEARCH_METHODS和HEURISTIC_SOLVERS
+            allowed: 候选池，见FiveHorsesCalculator.calculate_best_combination
+            excluded: 任何角色都不能使用的马娘
+            timeout: 最长搜索时间（秒），超时后返回当时找到的最优组合
+            cancel_token: 取消令牌，被取消后返回当时找到的最优组合
+            budget: 启发式搜索的计算量预算
+
+        Returns:
+            最优组合字典和最大相性点数的元组
+        """
+        self._check_running()
+        return self.calculator.calculate_best_combination(parent, verbose=verbose, method=method,
+                                                          allowed=allowed, excluded=excluded,
+                                                          timeout=timeout, cancel_token=cancel_token,
+                                                          budget=budget)
+
+    def get_top_combinations(self, parent: str, top_n: int = 10, verbose: bool = False, method: str = 'vectorized',
+                             allowed=None, excluded: Iterable[str] = None, timeout: float = None,
+                             cancel_token: CancelToken = None, budget: int = None) -> List[Tuple[Dict, int]]:
+        """
+        使用常驻进程获取指定parent下的前N个最优组合
+
+        Args:
+            parent: 指定的父辈马娘
+            top_n: 返回前N个结果
+            verbose: 是否显示详细进度信息
+            method: 搜索方式，见SEARCH_METHODS和HEURISTIC_SOLVERS
+            allowed: 候选池，见FiveHorsesCalculator.calculate_best_combination
+            excluded: 任何角色都不能使用的马娘
+            timeout: 最长搜索时间（秒），超时后返回当时找到的前N个组合
+            cancel_token: 取消令牌，被取消后返回当时找到的前N个组合
+            budget: 启发式搜索的计算量预算
+
+        Returns:
+            按分数降序排列的组合列表
+        """
+        self._check_running()
+        return self.calculator.get_top_combinations(parent, top_n=top_n, verbose=verbose, method=method,
+                                                    allowed=allowed, excluded=excluded,
+                                                    timeout=timeout, cancel_token=cancel_token,
+                                                    budget=budget)
@@ -1,26 +1,84 @@
-from typing import List, Tuple, Dict, Set
-from itertools import permutations
-from tqdm import tqdm
+from typing import List, Tuple, Dict, Set, Iterable, Optional, Union
 from .calculator import CompatibilityCalculator
 from .compatibility import CompatibilityData
-import heapq
+from .five_horses_solver import (FiveHorsesTables, IdResult, ROLES, _TopN, branch_and_bound_top_n,
+                                 decomposition_top_n, vectorized_top_n, sort_results)
+from .heuristic_solver import local_search_top_n
+from .permutation_shards import (count_permutations, count_products, iter_permutation_range,
+                                 iter_product_range, make_shards)
+from .shared_tables import SharedTables, init_worker, get_worker_data
+from .instrumentation import Instrumentation
+from .cancellation import CancelToken, make_cancel_token
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL, SearchCheckpoint
+from .result_cache import ResultCache, data_version, pool_fingerprint
+from contextlib import contextmanager
+from itertools import islice
+import json
+import os
+import queue
+import time
+import numpy as np
 import multiprocessing
 from multiprocessing import Pool
-import math
+
+# 可选的搜索方式：
+# - brute_force: 多进程逐一枚举全部排列（参考实现）
+# - branch_and_bound: 分支定界精确搜索，结果与逐一枚举一致
+# - decomposition: 按(g1, g2)分解为小规模指派问题的精确搜索，结果与逐一枚举一致
+# - vectorized: 分块向量化的逐一枚举，单核吞吐量远高于brute_force
+SEARCH_METHODS = ('brute_force', 'branch_and_bound', 'decomposition', 'vectorized')
+
+# brute_force每个进程分到的分片数（分片越多，进度显示越细）
+SHARDS_PER_PROCESS = 8
+
+# 等待工作进程结果时检查取消令牌的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.05
+
+# brute_force工作进程每枚举多少个组合检查一次截止时刻
+DEADLINE_CHECK_INTERVAL = 1024
+
+# 单进程精确求解器
+EXACT_SOLVERS = {
+    'branch_and_bound': branch_and_bound_top_n,
+    'decomposition': decomposition_top_n,
+    'vectorized': vectorized_top_n
+}
+
+# 启发式求解器（不保证最优，search_report中给出最优分数的上界和差距）：
+# - local_search: 多起点局部搜索，适合精确搜索过慢的大规模名单，计算量由budget限制
+HEURISTIC_SOLVERS = {
+    'local_search': local_search_top_n
+}
 
 class FiveHorsesCalculator:
-    def __init__(self, compatibility_data: CompatibilityData):
+    def __init__(self, compatibility_data: CompatibilityData, engine=None, instrumentation: Instrumentation = None,
+                 result_cache: ResultCache = None):
         """
         初始化五马循环计算器
         
         Args:
             compatibility_data: 相性数据处理器实例
+            engine: 常驻计算引擎（FiveHorsesEngine），启动后多进程计算复用其进程池
+            instrumentation: 阶段计时与指标收集器，默认与相性数据处理器共用
+            result_cache: 持久化的结果缓存（ResultCache），精确搜索的结果先查缓存，搜索完成后写入缓存
         """
+        if result_cache is not None and result_cache.version != data_version(compatibility_data):
+            raise ValueError("结果缓存的数据版本与相性数据不一致")
         self.compatibility_data = compatibility_data
+        self.engine = engine
+        self.result_cache = result_cache
+        self.instrumentation = instrumentation or compatibility_data.instrumentation
         self.calculator = CompatibilityCalculator(compatibility_data)
         self.all_umas = list(compatibility_data.get_all_umas())
-        
-    def calculate_best_combination(self, parent: str, verbose: bool = True, num_processes: int = None) -> Tuple[Dict, int]:
+        # 最近一次搜索的报告（是否已证明最优、已覆盖的搜索空间比例等），尚未搜索时为None
+        self.search_report: Optional[Dict] = None
+        
+    def calculate_best_combination(self, parent: str, verbose: bool = True, num_processes: int = None,
+                                   method: str = 'brute_force', allowed=None,
+                                   excluded: Iterable[str] = None, timeout: float = None,
+                                   cancel_token: CancelToken = None, budget: int = None,
+                                   checkpoint_path: str = None,
+                                   checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL) -> Tuple[Dict, int]:
         """
         计算给定parent下的最优五马组合（多进程优化版本）
         
@@ -34,67 +92,501 @@ class FiveHorsesCalculator:
         Args:
             parent: 指定的父辈马娘
             verbose: 是否显示详细进度信息
-            num_processes: 进程数，默认为CPU核心数
+            num_processes: 进程数，默认为CPU核心数（仅brute_force使用；引擎启动时使用引擎的进程数）
+            method: 搜索方式，见SEARCH_METHODS和HEURISTIC_SOLVERS
+            allowed: 候选池，可以是{角色: 马娘列表}（角色见ROLES，未列出的角色不受限制），
+                     也可以是马娘列表（所有角色共用，如玩家拥有的马娘）
+            excluded: 任何角色都不能使用的马娘
+            timeout: 最长搜索时间（秒），超时后返回当时找到的最优组合
+            cancel_token: 取消令牌，被取消后返回当时找到的最优组合
+            budget: 启发式搜索的计算量预算（计算了分数的组合数），默认见heuristic_solver.DEFAULT_BUDGET
+            checkpoint_path: 检查点文件路径（仅brute_force）。定期保存已完成的分片和当时的结果，
+                             以相同参数重新运行时从检查点继续，最终结果与一次完成的搜索相同；
+                             搜索完成后删除该文件
+            checkpoint_interval: 两次写入检查点之间的最短间隔（秒）
             
         Returns:
-            最优组合字典和最大相性点数的元组
+            最优组合字典和最大相性点数的元组；结果是否已证明最优见search_report
         """
         if parent not in self.all_umas:
             raise ValueError(f"马娘 '{parent}' 不存在于数据中")
         
-        # 排除parent，获取其他可选马娘
-        other_umas = [uma for uma in self.all_umas if uma != parent]
+        role_candidates = self._role_candidates(allowed, excluded)
+        # 排除parent，获取其他可选马娘（按ID排序，保证排列序号可复现）
+        other_umas = self._other_umas(parent, role_candidates)
         
         if len(other_umas) < 4:
             raise ValueError(f"可用马娘数量不足，需要至少4只其他马娘，当前只有{len(other_umas)}只")
         
-        # 使用permutations生成有序的四马组合
-        all_combinations = list(permutations(other_umas, 4))
-        total_combinations = len(all_combinations)
+        cancel_token = make_cancel_token(timeout, cancel_token)
         
-        if verbose:
-            print(f"正在为马娘 '{parent}' 计算最优五马组合...")
-            print(f"总共需要计算 {total_combinations} 种组合")
-            print(f"使用多进程加速（进程数: {num_processes or multiprocessing.cpu_count()}）")
-        
-        if num_processes is None:
-            num_processes = multiprocessing.cpu_count()
-        
-        # 将组合分块
-        chunk_size = math.ceil(len(all_combinations) / num_processes)
-        chunks = [all_combinations[i:i + chunk_size] for i in range(0, len(all_combinations), chunk_size)]
-        
-        # 准备兼容数据
-        compatibility_cache = {
-            'pair': self.compatibility_data.pair_compatibility,
-            'triple': self.compatibility_data.triple_compatibility,
-            'all_umas': self.compatibility_data.all_umas
-        }
+        results = self._search(parent, 1, method, verbose, other_umas, role_candidates, num_processes,
+                               cancel_token, budget, checkpoint_path, checkpoint_interval)
+        if not results:
+            self._raise_no_result()
+        combination, score = results[0]
+        return combination, score
+
+    def _search(self, parent: str, top_n: int, method: str, verbose: bool, other_umas: List[str],
+                role_candidates: Optional[Dict[str, np.ndarray]], num_processes: int,
+                cancel_token: CancelToken = None, budget: int = None, checkpoint_path: str = None,
+                checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL) -> List[Tuple[Dict, int]]:
+        """
+        按搜索方式计算前N优组合：设置了结果缓存时先查缓存，已证明最优的精确搜索结果写入缓存
+
+        Returns:
+            按分数降序排列的组合列表
+        """
+        if method != 'brute_force' and checkpoint_path is not None:
+            raise ValueError("检查点只支持brute_force搜索")
+
+        cache_key = self._cache_key(parent, method, role_candidates)
+        if cache_key is not None:
+            start_time = time.perf_counter()
+            cached = self.result_cache.get(*cache_key, top_n)
+            if cached is not None:
+                id_results, report = cached
+                self.search_report = dict(report, seconds=time.perf_counter() - start_time, cache_hit=True)
+                self.instrumentation.count('cache_hits')
+                if verbose:
+                    self.instrumentation.log(f"从结果缓存读取马娘 '{parent}' 的前{top_n}个最优组合")
+                return [(self._to_combination(parent, ids), score) for score, ids in id_results]
+
+        if method != 'brute_force':
+            id_results = self._solve_exact(parent, top_n, method, verbose, role_candidates, cancel_token, budget)
+        else:
+            id_results = self._brute_force(parent, top_n, other_umas, role_candidates, num_processes, verbose,
+                                           cancel_token, checkpoint_path, checkpoint_interval)
+
+        if cache_key is not None and self.search_report['proven_optimal']:
+            self.result_cache.put(*cache_key, top_n, id_results, self.search_report)
+        return [(self._to_combination(parent, ids), score) for score, ids in id_results]
+
+    def _cache_key(self, parent: str, method: str,
+                   role_candidates: Optional[Dict[str, np.ndarray]]) -> Optional[Tuple[str, str, str]]:
+        """
+        结果缓存的(parent, 搜索方式类别, 候选池指纹)
+
+        精确搜索方式（含brute_force）都按(分数降序, ID升序)取舍同分的组合，结果完全相同，共用'exact'类别；
+        启发式搜索的结果不写入缓存。没有设置结果缓存时返回None。
+        """
+        if self.result_cache is None or method not in SEARCH_METHODS:
+            return None
+        return parent, 'exact', pool_fingerprint(_role_key(role_candidates))
+
+    def _brute_force(self, parent: str, top_n: int, other_umas: List[str],
+                     role_candidates: Optional[Dict[str, np.ndarray]], num_processes: int, verbose: bool,
+                     cancel_token: CancelToken = None, checkpoint_path: str = None,
+                     checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL) -> List[IdResult]:
+        """
+        多进程逐一枚举前N优组合（top_n为1时各分片只求最优组合）
+
+        各分片的结果按(分数降序, ID升序)合并，合并结果与分片完成的顺序无关，
+        因此从检查点继续的搜索与一次完成的搜索结果相同。
+
+        Args:
+            parent: 指定的父辈马娘
+            top_n: 返回前N个结果
+            other_umas: 除parent以外可担任任一角色的马娘（按ID排序）
+            role_candidates: 每个角色可选的马娘ID，None表示不限制
+            num_processes: 进程数
+            verbose: 是否显示详细进度信息
+            cancel_token: 取消令牌，被取消时返回已取回分片的前N名（到达截止时刻的分片返回已枚举部分）
+            checkpoint_path: 检查点文件路径，None表示不保存检查点
+            checkpoint_interval: 两次写入检查点之间的最短间隔（秒）
+
+        Returns:
+            按分数降序排列的(分数, ID元组)列表
+        """
+        start_time = time.perf_counter()
+        # 有序的四马组合按排列序号寻址，不预先展开；限制了候选池时按各角色候选池的笛卡尔积寻址
+        role_pools = self._worker_constraints(parent, role_candidates)
+        if role_pools is None:
+            total_combinations = count_permutations(len(other_umas), 4)
+        else:
+            total_combinations = count_products(role_pools)
+        num_processes = self._resolve_num_processes(num_processes)
+        
+        # 将排列序号区间分片
+        shards = make_shards(total_combinations, num_processes * SHARDS_PER_PROCESS)
+        top = _TopN(top_n)
+        # 实际计算了分数的组合数（不含笛卡尔积中有重复马娘的元素）和已枚举的序号数
+        evaluated = 0
+        covered = 0
+        checkpoint = None
+        if checkpoint_path is not None:
+            signature = {
+                'parent': parent,
+                'role_key': _role_key(role_candidates),
+                'uma_list': list(self.compatibility_data.uma_list),
+                'source_hash': self.compatibility_data.source_hash
+            }
+            checkpoint = SearchCheckpoint.open(checkpoint_path, signature, shards, top_n, checkpoint_interval)
+            shards = checkpoint.pending()
+            for score, ids in checkpoint.results:
+                top.push(score, ids)
+            evaluated = checkpoint.evaluated
+            covered = checkpoint.covered
         
-        # 使用进程池处理
-        with Pool(processes=num_processes) as pool:
-            # 准备任务数据
-            chunk_data = [(chunk, parent, compatibility_cache) for chunk in chunks]
+        if verbose:
+            target = "最优五马组合" if top_n == 1 else f"前{top_n}个最优组合"
+            self.instrumentation.log(f"正在为马娘 '{parent}' 计算{target}...")
+            self.instrumentation.log(f"总共需要枚举 {total_combinations} 种组合")
+            if covered:
+                self.instrumentation.log(f"从检查点继续，已完成 {covered} 种组合")
+            self.instrumentation.log(f"使用多进程加速（进程数: {num_processes}）")
+        
+        with self.instrumentation.phase('search', parent=parent, method='brute_force', top_n=top_n), \
+                self._worker_pool(num_processes) as pool:
+            # 准备任务数据（每个任务只携带分片序号、parent、top_n、各角色候选池和截止时刻）
+            deadline = _deadline(cancel_token)
+            if top_n == 1:
+                chunk_function = process_best_combination_chunk
+                chunk_data = [(shard, parent, role_pools, deadline) for shard in shards]
+            else:
+                chunk_function = process_top_n_combinations_chunk
+                chunk_data = [(shard, parent, top_n, role_pools, deadline) for shard in shards]
             
-            # 使用tqdm显示进度
-            with tqdm(total=total_combinations, desc="计算最优组合", disable=not verbose) as pbar:
-                # 使用imap_unordered实时获取结果
-                best_score = -1
-                best_combination = {}
-                
-                for chunk_result in pool.imap_unordered(process_best_combination_chunk, chunk_data):
-                    # 更新最优结果
-                    if chunk_result['best_score'] > best_score:
-                        best_score = chunk_result['best_score']
-                        best_combination = chunk_result['best_combination']
-                    
-                    # 更新进度条
-                    pbar.update(len(chunk_result['chunk']))
-                    
-                    if verbose:
-                        pbar.set_postfix({'当前最高分': best_score})
+            # 显示进度
+            desc = "计算最优组合" if top_n == 1 else f"计算前{top_n}组合"
+            with self.instrumentation.progress(total=total_combinations, desc=desc, disable=not verbose) as pbar:
+                pbar.update(covered)
+                try:
+                    # 按完成顺序实时获取结果，每个进程同时只分到一个分片，取消后不再提交新分片
+                    chunk_results = _imap_until_cancelled(pool, chunk_function, chunk_data, cancel_token,
+                                                          num_processes)
+                    for chunk_result in chunk_results:
+                        chunk_top = chunk_result['top_n']
+                        for score, ids in chunk_top:
+                            top.push(score, ids)
+                        # 到达截止时刻而中途停止的分片不记入检查点
+                        shard_start, shard_end = chunk_result['shard']
+                        if checkpoint is not None and chunk_result['covered'] == shard_end - shard_start:
+                            checkpoint.record(chunk_result['shard'], chunk_top, chunk_result['count'])
+                        
+                        # 更新进度条 - 使用已枚举的序号数而不是结果数量
+                        pbar.update(chunk_result['covered'])
+                        covered += chunk_result['covered']
+                        self.instrumentation.count('evaluated', chunk_result['count'])
+                        evaluated += chunk_result['count']
+                        
+                        if verbose and top.heap:
+                            if top_n == 1:
+                                pbar.set_postfix({'当前最高分': top.heap[0][0][0]})
+                            else:
+                                # 显示当前最低入选分数
+                                bound = top.bound()
+                                pbar.set_postfix({'第{}名分数'.format(top_n): bound if bound is not None else '未满'})
+                finally:
+                    # 被取消或中断时保存检查点，全部分片完成后删除检查点
+                    if checkpoint is not None:
+                        if checkpoint.complete:
+                            checkpoint.remove()
+                        else:
+                            checkpoint.save()
+        
+        results = top.results()
+        coverage = covered / total_combinations if total_combinations else 1.0
+        self._record_search('brute_force', coverage, evaluated, start_time,
+                            results[0][0] if results else None)
+        return results
+
+    def _record_search(self, method: str, coverage: float, evaluated: int, start_time: float,
+                       best_score: int = None, upper_bound: int = None):
+        """
+        记录最近一次搜索的报告
+
+        upper_bound为最优分数的上界：启发式搜索由求解器给出；已证明最优时即为最优分数；
+        精确搜索中途取消时未知（None）。gap为上界与找到的最优分数之差。
+        """
+        self.search_report = _make_report(method, coverage, evaluated, time.perf_counter() - start_time,
+                                          best_score, upper_bound)
+
+    def _raise_no_result(self):
+        """没有任何结果时报错：搜索完成说明候选池无解，否则是在找到结果之前被取消"""
+        if self.search_report['proven_optimal']:
+            raise ValueError("候选池中没有合法的五马组合")
+        raise TimeoutError("搜索在找到任何组合之前已被取消或超时")
+
+    def _role_candidates(self, allowed=None, excluded: Iterable[str] = None) -> Optional[Dict[str, np.ndarray]]:
+        """
+        将候选池和排除列表转换为每个角色可选的马娘ID
+
+        Args:
+            allowed: {角色: 马娘列表}或所有角色共用的马娘列表，None表示不限制
+            excluded: 任何角色都不能使用的马娘
+
+        Returns:
+            {角色: 升序ID数组}；没有任何约束时为None
+        """
+        if allowed is None and not excluded:
+            return None
+        if allowed is None:
+            allowed = {}
+        elif not isinstance(allowed, dict):
+            allowed = {role: allowed for role in ROLES}
+        for role in allowed:
+            if role not in ROLES:
+                raise ValueError(f"未知的角色 '{role}'，可选: {', '.join(ROLES)}")
+
+        # 一次性检查所有马娘名称
+        names = {uma for umas in allowed.values() for uma in umas} | set(excluded or ())
+        unknown = sorted(names - set(self.all_umas))
+        if unknown:
+            raise ValueError(f"马娘 {', '.join(repr(uma) for uma in unknown)} 不存在于数据中")
+
+        excluded_ids = [self.compatibility_data.get_uma_id(uma) for uma in excluded or ()]
+        all_ids = np.arange(self.compatibility_data.num_umas, dtype=np.int64)
+        role_candidates = {}
+        for role in ROLES:
+            ids = all_ids if role not in allowed else np.unique(
+                np.array([self.compatibility_data.get_uma_id(uma) for uma in allowed[role]], dtype=np.int64))
+            role_candidates[role] = np.setdiff1d(ids, excluded_ids)
+        return role_candidates
+
+    def _other_umas(self, parent: str, role_candidates: Optional[Dict[str, np.ndarray]]) -> List[str]:
+        """除parent以外可担任任一角色的马娘（按ID排序）"""
+        if role_candidates is None:
+            return [uma for uma in self.compatibility_data.uma_list if uma != parent]
+        ids = np.unique(np.concatenate([role_candidates[role] for role in ROLES]))
+        return [self.compatibility_data.get_uma_name(uma_id) for uma_id in ids.tolist()
+                if self.compatibility_data.get_uma_name(uma_id) != parent]
+
+    def _worker_constraints(self, parent: str,
+                            role_candidates: Optional[Dict[str, np.ndarray]]) -> Optional[Tuple[Tuple[str, ...], ...]]:
+        """brute_force任务携带的各角色候选池（按ID排序、不含parent的马娘名称元组）；无约束时为None"""
+        if role_candidates is None:
+            return None
+        return tuple(tuple(uma for uma in map(self.compatibility_data.get_uma_name, role_candidates[role].tolist())
+                           if uma != parent)
+                     for role in ROLES)
+
+    def _engine_running(self) -> bool:
+        """是否有已启动的常驻引擎可用"""
+        return self.engine is not None and self.engine.running
+
+    def _resolve_num_processes(self, num_processes: int = None) -> int:
+        """确定实际使用的进程数"""
+        if self._engine_running():
+            return self.engine.num_processes
+        return num_processes or multiprocessing.cpu_count()
+
+    @contextmanager
+    def _worker_pool(self, num_processes: int):
+        """
+        获取挂载了共享相性表的进程池
+
+        引擎已启动时直接复用其常驻进程池；否则临时放置共享相性表并新建进程池，用完即释放
+
+        Args:
+            num_processes: 临时进程池的进程数
+        """
+        if self._engine_running():
+            yield self.engine.pool
+            return
+        # 相性表只放入共享内存一次，工作进程在初始化时按名称挂载
+        with SharedTables(self.compatibility_data) as shared_tables, \
+                Pool(processes=num_processes, initializer=init_worker, initargs=(shared_tables.spec,)) as pool:
+            yield pool
+
+    def _solve_exact(self, parent: str, top_n: int, method: str, verbose: bool,
+                     role_candidates: Dict[str, np.ndarray] = None,
+                     cancel_token: CancelToken = None, budget: int = None) -> List[IdResult]:
+        """
+        使用单进程精确求解器（或启发式求解器）计算前N优组合
+
+        Args:
+            parent: 指定的父辈马娘
+            top_n: 返回前N个结果
+            method: 搜索方式，见SEARCH_METHODS和HEURISTIC_SOLVERS
+            verbose: 是否显示详细信息
+            role_candidates: 每个角色可选的马娘ID，None表示不限制
+            cancel_token: 取消令牌，被取消时返回当时的前N名
+            budget: 启发式搜索的计算量预算
+
+        Returns:
+            按分数降序排列的(分数, ID元组)列表
+        """
+        if method not in SEARCH_METHODS and method not in HEURISTIC_SOLVERS:
+            methods = SEARCH_METHODS + tuple(HEURISTIC_SOLVERS)
+            raise ValueError(f"未知的搜索方式 '{method}'，可选: {', '.join(methods)}")
         
-        return best_combination, best_score
+        if verbose:
+            self.instrumentation.log(f"正在为马娘 '{parent}' 计算前{top_n}个最优组合（搜索方式: {method}）...")
+        
+        start_time = time.perf_counter()
+        parent_id = self.compatibility_data.get_uma_id(parent)
+        with self.instrumentation.phase('search', parent=parent, method=method, top_n=top_n):
+            tables = FiveHorsesTables(self.compatibility_data, parent_id, role_candidates=role_candidates)
+            if method == 'vectorized' and self._engine_running():
+                # 引擎已启动时，向量化枚举按序号区间分给常驻进程并行完成；
+                # 分片逐个提交，取消后不再提交新分片，常驻进程随即可以处理下一次查询
+                num_processes = self.engine.num_processes
+                total = tables.search_size()
+                shards = make_shards(total, num_processes * SHARDS_PER_PROCESS)
+                role_key = _role_key(role_candidates)
+                deadline = _deadline(cancel_token)
+                chunk_data = [(shard, parent_id, top_n, role_key, deadline) for shard in shards]
+                merged = []
+                stats = {'evaluated': 0, 'pruned': 0}
+                covered = 0
+                shard_results = _imap_until_cancelled(self.engine.pool, process_vectorized_chunk, chunk_data,
+                                                      cancel_token, num_processes)
+                for results, evaluated, shard_covered in shard_results:
+                    merged.extend(results)
+                    stats['evaluated'] += evaluated
+                    stats['pruned'] += shard_covered - evaluated
+                    covered += shard_covered
+                id_results = sort_results(merged)[:top_n]
+                progress = {'coverage': covered / total if total else 1.0}
+            else:
+                id_results, stats, progress = _solve_tables(tables, top_n, method, cancel_token, budget)
+            self._count(stats)
+        self._record_search(method, progress['coverage'], stats['evaluated'], start_time,
+                            id_results[0][0] if id_results else None, progress.get('upper_bound'))
+        return id_results
+
+    def sweep_all_parents(self, output_path: str, top_n: int = 10, parents: List[str] = None,
+                          method: str = 'branch_and_bound', verbose: bool = True, allowed=None,
+                          excluded: Iterable[str] = None) -> List[Dict]:
+        """
+        依次以每只马娘为parent计算最优组合和前N优组合，每完成一个parent即向文件写入一行结果
+
+        各parent共用同一份int64两两相性矩阵，最优组合直接取前N优的第一名，不再单独搜索。
+        引擎已启动时，各parent分给常驻进程并行计算，结果按完成顺序写入。
+        输出文件为JSON Lines格式，每行包含parent、best_score、best_combination和top_combinations。
+
+        Args:
+            output_path: 输出文件路径（覆盖已有文件）
+            top_n: 每个parent保留的前N个结果
+            parents: 要计算的parent列表，默认为全部马娘
+            method: 搜索方式，见EXACT_SOLVERS（不支持brute_force）
+            verbose: 是否显示进度
+            allowed: 候选池，见calculate_best_combination
+            excluded: 任何角色都不能使用的马娘
+
+        Returns:
+            与文件内容相同的结果行列表；没有合法组合的parent，best_score和best_combination为None
+        """
+        parent_ids, _, parent_results = self._sweep(top_n, parents, method, allowed, excluded)
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        rows = []
+        with self.instrumentation.phase('sweep', method=method, top_n=top_n, parents=len(parent_ids)), \
+                open(output_path, 'w', encoding='utf-8') as f, \
+                self.instrumentation.progress(total=len(parent_ids), desc="计算全部parent", disable=not verbose) as pbar:
+            for parent_id, id_results, stats in parent_results:
+                self._count(stats)
+                parent = self.compatibility_data.get_uma_name(parent_id)
+                top_combinations = [dict(self._to_combination(parent, ids), score=score) for score, ids in id_results]
+                row = {
+                    'parent': parent,
+                    'best_score': id_results[0][0] if id_results else None,
+                    'best_combination': self._to_combination(parent, id_results[0][1]) if id_results else None,
+                    'top_combinations': top_combinations
+                }
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                rows.append(row)
+                pbar.update(1)
+
+        if verbose:
+            self.instrumentation.log(f"已将 {len(rows)} 个parent的结果写入 {output_path}")
+        return rows
+
+    def materialize_leaderboards(self, top_n: int = 10, parents: List[str] = None,
+                                 method: str = 'branch_and_bound', verbose: bool = True, allowed=None,
+                                 excluded: Iterable[str] = None) -> int:
+        """
+        为每只马娘（或指定的parent）计算前N优组合，作为排行榜固定保存到结果缓存
+
+        之后相同候选池、要求数量不超过top_n的get_top_combinations和calculate_best_combination
+        直接读取排行榜，不再搜索。排行榜不参与LRU淘汰，CSV变化后随缓存一起失效。
+
+        Args:
+            top_n: 每个parent保留的前N个结果
+            parents: 要计算的parent列表，默认为全部马娘
+            method: 搜索方式，见EXACT_SOLVERS（不支持brute_force）
+            verbose: 是否显示进度
+            allowed: 候选池，见calculate_best_combination
+            excluded: 任何角色都不能使用的马娘
+
+        Returns:
+            写入的排行榜数
+        """
+        if self.result_cache is None:
+            raise ValueError("未设置结果缓存，无法保存排行榜")
+        parent_ids, role_candidates, parent_results = self._sweep(top_n, parents, method, allowed, excluded)
+        pool = pool_fingerprint(_role_key(role_candidates))
+
+        with self.instrumentation.phase('materialize_leaderboards', method=method, top_n=top_n,
+                                        parents=len(parent_ids)), \
+                self.instrumentation.progress(total=len(parent_ids), desc="生成排行榜", disable=not verbose) as pbar:
+            start_time = time.perf_counter()
+            for parent_id, id_results, stats in parent_results:
+                self._count(stats)
+                report = _make_report(method, 1.0, stats['evaluated'], time.perf_counter() - start_time,
+                                      id_results[0][0] if id_results else None)
+                self.result_cache.put(self.compatibility_data.get_uma_name(parent_id), 'exact', pool, top_n,
+                                      id_results, report, pinned=True)
+                start_time = time.perf_counter()
+                pbar.update(1)
+
+        if verbose:
+            self.instrumentation.log(f"已将 {len(parent_ids)} 个parent的前{top_n}名保存到结果缓存")
+        return len(parent_ids)
+
+    def _sweep(self, top_n: int, parents: Optional[List[str]], method: str, allowed, excluded):
+        """
+        校验批量计算的参数，并依次（引擎已启动时并行）求解各parent的前N优组合
+
+        Returns:
+            (parent的ID列表, 各角色可选ID, 按完成顺序产出(parent的ID, 结果, 计算量统计)的迭代器)
+        """
+        if method not in EXACT_SOLVERS:
+            raise ValueError(f"批量计算不支持搜索方式 '{method}'，可选: {', '.join(EXACT_SOLVERS)}")
+        if top_n < 1:
+            raise ValueError("top_n必须为正整数")
+        if parents is None:
+            parents = list(self.compatibility_data.uma_list)
+        for parent in parents:
+            if parent not in self.all_umas:
+                raise ValueError(f"马娘 '{parent}' 不存在于数据中")
+        if self.compatibility_data.num_umas < 5:
+            raise ValueError(f"可用马娘数量不足，需要至少4只其他马娘，当前只有{self.compatibility_data.num_umas - 1}只")
+
+        role_candidates = self._role_candidates(allowed, excluded)
+        parent_ids = [self.compatibility_data.get_uma_id(parent) for parent in parents]
+        if self._engine_running():
+            role_key = _role_key(role_candidates)
+            chunk_data = [(parent_id, top_n, method, role_key) for parent_id in parent_ids]
+            parent_results = self.engine.pool.imap_unordered(process_sweep_chunk, chunk_data)
+        else:
+            parent_results = _sweep_parents(self.compatibility_data, parent_ids, top_n, method, role_candidates)
+        return parent_ids, role_candidates, parent_results
+
+    def _count(self, stats: Dict[str, int]):
+        """将求解器的统计（已计算、已剪枝的组合数）累加到计数器"""
+        for name, value in stats.items():
+            self.instrumentation.count(name, value)
+
+    def _combination_ids(self, combination: Dict) -> Tuple[int, int, int, int]:
+        """将组合字典转换为(g1, g2, c1, c2)的ID元组"""
+        return tuple(self.compatibility_data.get_uma_id(combination[role]) for role in ROLES)
+
+    def _to_combination(self, parent: str, ids: Tuple[int, int, int, int]) -> Dict:
+        """将(g1, g2, c1, c2)的ID元组转换为组合字典"""
+        grandparent1, grandparent2, chromo1, chromo2 = (self.compatibility_data.get_uma_name(uma_id) for uma_id in ids)
+        return {
+            'parent': parent,
+            'grandparent1': grandparent1,
+            'grandparent2': grandparent2,
+            'chromo1': chromo1,
+            'chromo2': chromo2
+        }
 
     def display_result(self, combination: Dict, score: int):
         """
@@ -165,8 +657,30 @@ class FiveHorsesCalculator:
         
         return score
     
+    def explain_combinations(self, results: Iterable) -> List[Dict]:
+        """
+        解释五马组合的相性点数（按映射关系展开为七马血统后，给出每一项的分数和共同组）
+
+        Args:
+            results: 组合字典的列表，或get_top_combinations返回的(组合字典, 分数)列表
+
+        Returns:
+            与输入顺序一致的解释字典列表，格式见CompatibilityCalculator.explain_many
+        """
+        rows = []
+        for item in results:
+            combination = item[0] if isinstance(item, tuple) else item
+            parent = self.compatibility_data.get_uma_id(combination['parent'])
+            grandparent1, grandparent2, chromo1, chromo2 = self._combination_ids(combination)
+            rows.append((parent, grandparent1, grandparent2, chromo1, chromo2, chromo2, grandparent1))
+        return self.calculator.explain_many(np.array(rows, dtype=np.int64).reshape(-1, 7))
+
     def get_top_combinations(self, parent: str, top_n: int = 10, verbose: bool = True, 
-                           num_processes: int = None) -> List[Tuple[Dict, int]]:
+                           num_processes: int = None, method: str = 'brute_force', allowed=None,
+                           excluded: Iterable[str] = None, timeout: float = None,
+                           cancel_token: CancelToken = None, budget: int = None,
+                           checkpoint_path: str = None,
+                           checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL) -> List[Tuple[Dict, int]]:
         """
         获取指定parent下的前N个最优组合（多进程优化版本）
         
@@ -174,111 +688,157 @@ class FiveHorsesCalculator:
             parent: 指定的父辈马娘
             top_n: 返回前N个结果
             verbose: 是否显示详细进度信息
-            num_processes: 进程数，默认为CPU核心数
+            num_processes: 进程数，默认为CPU核心数（仅brute_force使用；引擎启动时使用引擎的进程数）
+            method: 搜索方式，见SEARCH_METHODS和HEURISTIC_SOLVERS
+            allowed: 候选池，见calculate_best_combination
+            excluded: 任何角色都不能使用的马娘
+            timeout: 最长搜索时间（秒），超时后返回当时找到的前N个组合
+            cancel_token: 取消令牌，被取消后返回当时找到的前N个组合
+            budget: 启发式搜索的计算量预算，见calculate_best_combination
+            checkpoint_path: 检查点文件路径（仅brute_force），见calculate_best_combination
+            checkpoint_interval: 两次写入检查点之间的最短间隔（秒）
             
         Returns:
-            按分数降序排列的组合列表
+            按分数降序排列的组合列表；结果是否已证明最优见search_report
         """
         if parent not in self.all_umas:
             raise ValueError(f"马娘 '{parent}' 不存在于数据中")
         
-        # 排除parent，获取其他可选马娘
-        other_umas = [uma for uma in self.all_umas if uma != parent]
+        role_candidates = self._role_candidates(allowed, excluded)
+        # 排除parent，获取其他可选马娘（按ID排序，保证排列序号可复现）
+        other_umas = self._other_umas(parent, role_candidates)
         
         if len(other_umas) < 4:
             raise ValueError(f"可用马娘数量不足，需要至少4只其他马娘，当前只有{len(other_umas)}只")
         
-        total_combinations = len(list(permutations(other_umas, 4)))
-        
-        if verbose:
-            print(f"正在为马娘 '{parent}' 计算前{top_n}个最优组合...")
-            print(f"总共需要计算 {total_combinations} 种组合")
-            print(f"使用多进程加速（进程数: {num_processes or multiprocessing.cpu_count()}）")
-        
-        if num_processes is None:
-            num_processes = multiprocessing.cpu_count()
-        
-        # 生成所有四马组合
-        all_combinations = list(permutations(other_umas, 4))
-        
-        # 将组合分块
-        chunk_size = math.ceil(len(all_combinations) / num_processes)
-        chunks = [all_combinations[i:i + chunk_size] for i in range(0, len(all_combinations), chunk_size)]
-        
-        # 准备兼容数据
-        compatibility_cache = {
-            'pair': self.compatibility_data.pair_compatibility,
-            'triple': self.compatibility_data.triple_compatibility,
-            'all_umas': self.compatibility_data.all_umas
-        }
-        
-        # 使用最小堆维护前N个结果
-        min_heap = []  # 存储 (score, index, combination)
-        index = 0
-        
-        # 使用进程池处理
-        with Pool(processes=num_processes) as pool:
-            # 准备任务数据
-            chunk_data = [(chunk, parent, compatibility_cache, top_n) for chunk in chunks]
-            
-            # 使用tqdm显示进度
-            with tqdm(total=total_combinations, desc=f"计算前{top_n}组合", disable=not verbose) as pbar:
-                # 使用imap_unordered实时获取结果
-                for chunk_result in pool.imap_unordered(process_top_n_combinations_chunk, chunk_data):
-                    # 处理这个chunk的结果
-                    for combination, score in chunk_result['top_n']:
-                        if len(min_heap) < top_n:
-                            # 堆未满，直接加入
-                            heapq.heappush(min_heap, (score, index, combination))
-                            index += 1
-                        elif score > min_heap[0][0]:
-                            # 当前分数比堆中最小分数大，替换
-                            heapq.heapreplace(min_heap, (score, index, combination))
-                            index += 1
-                    
-                    # 更新进度条 - 使用chunk的大小而不是结果数量
-                    pbar.update(len(chunk_result['chunk']))
-                    
-                    if verbose and min_heap:
-                        # 显示当前最低入选分数
-                        pbar.set_postfix({'第{}名分数'.format(top_n): min_heap[0][0] if len(min_heap) == top_n else '未满'})
-        
-        # 从最小堆中提取结果并按分数降序排列
-        results = [(combo, score) for score, _, combo in min_heap]
-        results.sort(key=lambda x: x[1], reverse=True)
+        cancel_token = make_cancel_token(timeout, cancel_token)
         
-        return results
+        return self._search(parent, top_n, method, verbose, other_umas, role_candidates, num_processes,
+                            cancel_token, budget, checkpoint_path, checkpoint_interval)
+
+def _make_report(method: str, coverage: float, evaluated: int, seconds: float, best_score: int = None,
+                 upper_bound: int = None) -> Dict:
+    """生成搜索报告（见FiveHorsesCalculator._record_search）"""
+    proven_optimal = coverage >= 1.0
+    if upper_bound is None and proven_optimal:
+        upper_bound = best_score
+    return {
+        'method': method,
+        'proven_optimal': proven_optimal,
+        'coverage': min(coverage, 1.0),
+        'evaluated': evaluated,
+        'seconds': seconds,
+        'best_score': best_score,
+        'upper_bound': upper_bound,
+        'gap': upper_bound - best_score if upper_bound is not None and best_score is not None else None,
+        'cache_hit': False
+    }
+
+def _deadline(cancel_token: Optional[CancelToken]) -> Optional[float]:
+    """工作进程无法共享令牌，只传递截止时刻（time.time()的取值），不限时为None"""
+    remaining = cancel_token.remaining if cancel_token is not None else None
+    return time.time() + remaining if remaining is not None else None
+
+def _imap_until_cancelled(pool, function, tasks: Iterable, cancel_token: Optional[CancelToken], max_pending: int):
+    """
+    按完成顺序逐个取出进程池的结果，同时在途的任务不超过max_pending个
+
+    任务在有空闲进程时才提交，令牌被取消后不再提交新任务并立即停止（已在途的任务结果被丢弃）。
+    因此取消或超时后常驻进程池中至多剩下max_pending个在途任务，它们按截止时刻自行结束，
+    不会让之后的查询排在整个搜索空间之后。
+
+    Args:
+        pool: 进程池
+        function: 工作进程执行的函数
+        tasks: 任务参数序列
+        cancel_token: 取消令牌，None表示取完全部结果
+        max_pending: 同时在途的任务数上限（通常为进程数）
+    """
+    tasks = iter(tasks)
+    finished = queue.Queue()
+    pending = 0
+
+    def submit():
+        nonlocal pending
+        for task in islice(tasks, 1):
+            pool.apply_async(function, (task,), callback=lambda result: finished.put((True, result)),
+                             error_callback=lambda error: finished.put((False, error)))
+            pending += 1
+
+    for _ in range(max_pending):
+        submit()
+    while pending:
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        try:
+            succeeded, result = finished.get(timeout=CANCEL_POLL_INTERVAL if cancel_token is not None else None)
+        except queue.Empty:
+            continue
+        pending -= 1
+        if not succeeded:
+            raise result
+        submit()
+        yield result
 
 def process_best_combination_chunk(chunk_data):
     """
     处理单个数据块并返回该块的最优五马组合（用于calculate_best_combination）
     
     Args:
-        chunk_data: 包含(数据块, parent, 兼容数据缓存)的元组
+        chunk_data: 包含((起始序号, 结束序号), parent, 各角色候选池, 截止时刻)的元组
         
     Returns:
-        包含最优组合、分数和原始数据块的字典
+        包含该块最优的(分数, ID元组)列表（至多一项）、计算了分数的组合数和已枚举的序号数的字典
     """
-    chunk, parent, compatibility_data_cache = chunk_data
-    
-    # 重建CompatibilityCalculator（在子进程中）
-    from .compatibility import CompatibilityData
-    from .calculator import CompatibilityCalculator
+    shard, parent, role_pools, deadline = chunk_data
+    return _brute_force_chunk(shard, parent, 1, role_pools, deadline)
+
+def process_top_n_combinations_chunk(chunk_data):
+    """
+    处理单个数据块并返回该块的前N优五马组合（用于get_top_combinations）
     
-    # 创建临时的compatibility data对象
-    temp_data = CompatibilityData.__new__(CompatibilityData)
-    temp_data.pair_compatibility = compatibility_data_cache['pair']
-    temp_data.triple_compatibility = compatibility_data_cache['triple']
-    temp_data.all_umas = compatibility_data_cache['all_umas']
+    Args:
+        chunk_data: 包含((起始序号, 结束序号), parent, top_n, 各角色候选池, 截止时刻)的元组
+        
+    Returns:
+        包含该块前N优的(分数, ID元组)列表、计算了分数的组合数和已枚举的序号数的字典
+    """
+    shard, parent, top_n, role_pools, deadline = chunk_data
+    return _brute_force_chunk(shard, parent, top_n, role_pools, deadline)
+
+def _brute_force_chunk(shard: Tuple[int, int], parent: str, top_n: int,
+                       role_pools: Optional[Tuple[Tuple[str, ...], ...]], deadline: float = None) -> Dict:
+    """
+    逐一枚举一个分片，按与精确求解器相同的(分数降序, ID升序)规则保留前N名，
+    因此同分时各搜索方式选出的组合相同，合并结果与分片的划分和完成顺序无关
+
+    没有候选池约束时分片是排列序号区间；否则是各角色候选池笛卡尔积的序号区间，
+    计算量与各候选池大小之积相当，其中有重复马娘的元素直接跳过，不计入计算了分数的组合数。
+    到达截止时刻（time.time()的取值，None表示不限时）时停止，返回已枚举部分的结果
+    """
+    start, end = shard
     
-    calculator = CompatibilityCalculator(temp_data)
+    # 使用进程初始化时挂载的共享相性表
+    data = get_worker_data()
+    calculator = CompatibilityCalculator(data)
+    if role_pools is None:
+        other_umas = [uma for uma in data.uma_list if uma != parent]
+        combinations = iter_permutation_range(other_umas, 4, start, end)
+    else:
+        combinations = iter_product_range(role_pools, start, end)
     
-    # 在子进程中维护最优结果
-    best_score = -1
-    best_combination = {}
+    top = _TopN(top_n)
+    count = 0
+    covered = end - start
     
-    # 处理这个chunk的所有组合
-    for four_horses in chunk:
+    # 就地生成并处理这个分片的所有组合
+    for position, four_horses in enumerate(combinations):
+        if deadline is not None and position % DEADLINE_CHECK_INTERVAL == 0 and time.time() >= deadline:
+            covered = position
+            break
+        # 跳过有重复马娘的组合（只在按候选池的笛卡尔积枚举时出现）
+        if role_pools is not None and len(set(four_horses)) < 4:
+            continue
         grandparent1, grandparent2, chromo1, chromo2 = four_horses
         
         # 计算相性分数
@@ -292,101 +852,107 @@ def process_best_combination_chunk(chunk_data):
             grandparent4=grandparent1,
             verbose=False
         )
-        
-        # 更新最优组合
-        if score > best_score:
-            best_score = score
-            best_combination = {
-                'parent': parent,
-                'grandparent1': grandparent1,
-                'grandparent2': grandparent2,
-                'chromo1': chromo1,
-                'chromo2': chromo2
-            }
+        top.push(score, tuple(data.get_uma_id(uma) for uma in four_horses))
+        count += 1
     
-    # 返回这个chunk的最优结果和原始chunk用于进度更新
+    # 返回这个分片的前N优结果和计算了分数的组合数
     return {
-        'best_combination': best_combination,
-        'best_score': best_score,
-        'chunk': chunk
+        'top_n': top.results(),
+        'count': count,
+        'covered': covered,
+        'shard': (start, end)
     }
 
-def process_top_n_combinations_chunk(chunk_data):
+# 工作进程中最近一次使用的((parent的ID, 候选池), 求解表)，连续处理同一查询的分片时无需重建
+_worker_tables = None
+
+def process_vectorized_chunk(chunk_data):
     """
-    处理单个数据块并返回该块的前N优五马组合（用于get_top_combinations）
+    在工作进程中对一个序号区间做向量化枚举（用于常驻引擎的vectorized搜索）
     
     Args:
-        chunk_data: 包含(数据块, parent, 兼容数据缓存, top_n)的元组
+        chunk_data: 包含((起始序号, 结束序号), parent的ID, top_n, 各角色可选ID元组, 截止时刻)的元组，
+                    截止时刻为time.time()的取值，None表示不限时
         
     Returns:
-        包含最优组合、前N优结果和原始数据块的字典
+        (该区间内按(分数降序, ID升序)排列的前N个(分数, ID元组), 实际计算了分数的组合数, 已枚举的序号数)
     """
-    chunk, parent, compatibility_data_cache, top_n = chunk_data
-    
-    # 重建CompatibilityCalculator（在子进程中）
-    from .compatibility import CompatibilityData
-    from .calculator import CompatibilityCalculator
-    
-    # 创建临时的compatibility data对象
-    temp_data = CompatibilityData.__new__(CompatibilityData)
-    temp_data.pair_compatibility = compatibility_data_cache['pair']
-    temp_data.triple_compatibility = compatibility_data_cache['triple']
-    temp_data.all_umas = compatibility_data_cache['all_umas']
+    global _worker_tables
+    (start, end), parent_id, top_n, role_key, deadline = chunk_data
     
-    calculator = CompatibilityCalculator(temp_data)
-    
-    # 在子进程中维护最优结果
-    best_score = -1
-    best_combination = {}
-    
-    # 使用最小堆维护前N个结果
-    min_heap = []  # 存储 (score, index, combination)
-    index = 0
+    if _worker_tables is None or _worker_tables[0] != (parent_id, role_key):
+        tables = FiveHorsesTables(get_worker_data(), parent_id, role_candidates=_role_candidates_from_key(role_key))
+        _worker_tables = ((parent_id, role_key), tables)
+    cancel_token = CancelToken(max(deadline - time.time(), 0.0)) if deadline is not None else None
+    stats = {'evaluated': 0}
+    results = vectorized_top_n(_worker_tables[1], top_n, start=start, end=end, stats=stats, cancel_token=cancel_token)
+    return results, stats['evaluated'], round((end - start) * stats['coverage'])
+
+def _role_key(role_candidates: Optional[Dict[str, np.ndarray]]):
+    """将各角色可选ID转换为可哈希、体积小的元组形式，用于传给工作进程"""
+    if role_candidates is None:
+        return None
+    return tuple(tuple(role_candidates[role].tolist()) for role in ROLES)
+
+def _role_candidates_from_key(role_key) -> Optional[Dict[str, np.ndarray]]:
+    """_role_key的逆变换"""
+    if role_key is None:
+        return None
+    return {role: np.array(ids, dtype=np.int64) for role, ids in zip(ROLES, role_key)}
+
+def _solve_tables(tables: FiveHorsesTables, top_n: int, method: str, cancel_token: CancelToken = None,
+                  budget: int = None):
+    """
+    用单进程精确求解器（或启发式求解器）求前N优组合，并统计计算量
+
+    Returns:
+        (按分数降序排列的(分数, ID元组)列表,
+         {'evaluated': 实际计算了分数的组合数, 'pruned': 已覆盖的空间中未计算即排除的排列数},
+         {'coverage': 已覆盖的搜索空间比例, 启发式求解时还有'upper_bound': 最优分数的上界})
+    """
+    stats = {'evaluated': 0}
+    if method in HEURISTIC_SOLVERS:
+        id_results = HEURISTIC_SOLVERS[method](tables, top_n, stats=stats, cancel_token=cancel_token, budget=budget)
+    else:
+        id_results = EXACT_SOLVERS[method](tables, top_n, stats=stats, cancel_token=cancel_token)
+    covered = round(tables.search_size() * stats['coverage'])
+    counters = {'evaluated': stats['evaluated'], 'pruned': max(covered - stats['evaluated'], 0)}
+    progress = {key: stats[key] for key in ('coverage', 'upper_bound') if key in stats}
+    return id_results, counters, progress
+
+def _sweep_parents(compatibility_data: CompatibilityData, parent_ids: List[int], top_n: int, method: str,
+                   role_candidates: Dict[str, np.ndarray] = None):
+    """
+    依次求解多个parent的前N优组合，共用同一份int64两两相性矩阵
+
+    Yields:
+        (parent的ID, 按分数降序排列的(分数, ID元组)列表, 计算量统计)
+    """
+    pair_matrix = np.asarray(compatibility_data.pair_matrix, dtype=np.int64)
+    for parent_id in parent_ids:
+        tables = FiveHorsesTables(compatibility_data, parent_id, pair_matrix=pair_matrix,
+                                  role_candidates=role_candidates)
+        yield (parent_id,) + _solve_tables(tables, top_n, method)[:2]
+
+# 工作进程中共用的int64两两相性矩阵（批量计算全部parent时使用）
+_worker_pair_matrix = None
+
+def process_sweep_chunk(chunk_data):
+    """
+    在工作进程中求解一个parent的前N优组合（用于sweep_all_parents）
     
-    # 处理这个chunk的所有组合
-    for four_horses in chunk:
-        grandparent1, grandparent2, chromo1, chromo2 = four_horses
-        
-        # 计算相性分数
-        score = calculator.calculate_compatibility_score(
-            target=parent,
-            parent1=grandparent1,
-            parent2=grandparent2,
-            grandparent1=chromo1,
-            grandparent2=chromo2,
-            grandparent3=chromo2,
-            grandparent4=grandparent1,
-            verbose=False
-        )
-        
-        combination = {
-            'parent': parent,
-            'grandparent1': grandparent1,
-            'grandparent2': grandparent2,
-            'chromo1': chromo1,
-            'chromo2': chromo2
-        }
-        
-        # 更新最优组合
-        if score > best_score:
-            best_score = score
-            best_combination = combination
+    Args:
+        chunk_data: 包含(parent的ID, top_n, 搜索方式, 各角色可选ID元组)的元组
         
-        # 更新前N优结果
-        if len(min_heap) < top_n:
-            heapq.heappush(min_heap, (score, index, combination))
-            index += 1
-        elif score > min_heap[0][0]:
-            heapq.heapreplace(min_heap, (score, index, combination))
-            index += 1
-    
-    # 从最小堆中提取前N优结果
-    top_results = [(combo, score) for score, _, combo in min_heap]
-    top_results.sort(key=lambda x: x[1], reverse=True)
+    Returns:
+        (parent的ID, 按分数降序排列的(分数, ID元组)列表, 计算量统计)
+    """
+    global _worker_pair_matrix
+    parent_id, top_n, method, role_key = chunk_data
     
-    # 返回这个chunk的最优结果和前N优结果，以及原始chunk用于进度更新
-    return {
-        'best': (best_combination, best_score),
-        'top_n': top_results,
-        'chunk': chunk
-    }
\ No newline at end of file
+    data = get_worker_data()
+    if _worker_pair_matrix is None:
+        _worker_pair_matrix = np.asarray(data.pair_matrix, dtype=np.int64)
+    tables = FiveHorsesTables(data, parent_id, pair_matrix=_worker_pair_matrix,
+                              role_candidates=_role_candidates_from_key(role_key))
+    return (parent_id,) + _solve_tables(tables, top_n, method)[:2]
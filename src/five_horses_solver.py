@@ -0,0 +1,437 @@
+"""
+五马循环的精确求解器
+
+固定parent（记为P）后，五马组合的相性点数可写成：
+
+    score = p[g1] + p[g2] + Q[g1, g2] + M[g1, g2] + M[g1, c1] + M[g1, c2] + M[g2, c2]
+
+其中 p = Q[P] 为parent的两两相性行，Q 为两两相性矩阵，M 为parent的三三相性切片
+（M[x, y] = 三三相性(P, x, y)，对应七马公式中的 (target, parent2, grandparent4)、
+(target, parent1, grandparent1) 等四项）。求解器只依赖这一分解，结果与逐一枚举完全一致。
+"""
+
+import heapq
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .cancellation import CancelToken
+from .compatibility import CompatibilityData
+from .permutation_shards import count_permutations, count_products, unrank_block, unrank_product_block
+
+# (分数, (grandparent1, grandparent2, chromo1, chromo2)) 形式的ID结果
+IdResult = Tuple[int, Tuple[int, int, int, int]]
+
+# 四个可选角色，顺序与ID元组一致
+ROLES = ('grandparent1', 'grandparent2', 'chromo1', 'chromo2')
+
+# 表示"不可选"的极小分数（取反后不会溢出）
+_NEG_INF = -(1 << 40)
+
+
+class FiveHorsesTables:
+    def __init__(self, compatibility_data: CompatibilityData, parent_id: int, pair_matrix: np.ndarray = None,
+                 role_candidates: Dict[str, np.ndarray] = None):
+        """
+        为指定parent准备求解所需的矩阵
+
+        Args:
+            compatibility_data: 相性数据处理器实例
+            parent_id: parent的马娘ID
+            pair_matrix: 已转换为int64的两两相性矩阵，依次处理多个parent时传入以免重复转换
+            role_candidates: 每个角色（见ROLES）可选的马娘ID，默认所有角色均可选除parent以外的全部马娘
+        """
+        self.parent_id = parent_id
+        if pair_matrix is None:
+            pair_matrix = np.asarray(compatibility_data.pair_matrix, dtype=np.int64)
+        self.pair_matrix = pair_matrix
+        self.pair_row = self.pair_matrix[parent_id]
+        self.triple_slice = compatibility_data.get_triple_slice(parent_id).astype(np.int64)
+        if role_candidates is None:
+            # 可选马娘：除parent以外的所有马娘
+            self.candidates = np.array([i for i in range(compatibility_data.num_umas) if i != parent_id], dtype=np.int64)
+            self.role_ids = None
+            self.role_masks = None
+        else:
+            # 可选马娘：各角色候选的并集（不含parent），搜索规模只与候选池大小有关
+            role_ids = {role: np.setdiff1d(np.asarray(role_candidates[role], dtype=np.int64), [parent_id])
+                        for role in ROLES}
+            self.candidates = np.unique(np.concatenate([role_ids[role] for role in ROLES]))
+            self.role_ids = role_ids
+            self.role_masks = {role: np.isin(self.candidates, role_ids[role]) for role in ROLES}
+
+        # A[g1, g2]：只由两位祖父马娘决定的部分
+        self.grandparent_scores = (self.pair_row[:, None] + self.pair_row[None, :]
+                                   + self.pair_matrix + self.triple_slice)
+
+    def allowed(self, role: str) -> np.ndarray:
+        """与candidates对应的布尔数组，表示各候选能否担任该角色"""
+        if self.role_masks is None:
+            return np.ones(len(self.candidates), dtype=bool)
+        return self.role_masks[role]
+
+    def pools(self) -> Tuple[np.ndarray, ...]:
+        """各角色（按ROLES顺序）可选的马娘ID，均按ID升序排列"""
+        if self.role_ids is None:
+            return (self.candidates,) * len(ROLES)
+        return tuple(self.role_ids[role] for role in ROLES)
+
+    def search_size(self) -> int:
+        """
+        搜索空间的大小：不限制候选池时为候选马娘的四马排列数，
+        否则为各角色候选池的笛卡尔积的元素数（其中含有重复马娘的元素不计分）
+        """
+        if self.role_ids is None:
+            return count_permutations(len(self.candidates), 4)
+        return count_products(self.pools())
+
+    def score(self, grandparent1: int, grandparent2: int, chromo1: int, chromo2: int) -> int:
+        """按分解式计算单个组合的相性点数"""
+        m = self.triple_slice
+        return int(self.grandparent_scores[grandparent1, grandparent2]
+                   + m[grandparent1, chromo1] + m[grandparent1, chromo2] + m[grandparent2, chromo2])
+
+
+def sort_results(results: List[IdResult]) -> List[IdResult]:
+    """按分数降序排列，同分时按ID升序，保证结果顺序确定"""
+    return sorted(results, key=lambda item: (-item[0], item[1]))
+
+
+class _TopN:
+    """维护前N个结果的最小堆"""
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+        self.heap = []
+
+    def push(self, score: int, combination: Tuple[int, int, int, int]):
+        # 同分时保留ID较小的组合（堆顶为分数最低、ID最大者）
+        key = (score, tuple(-x for x in combination))
+        if len(self.heap) < self.top_n:
+            heapq.heappush(self.heap, (key, combination))
+        elif key > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (key, combination))
+
+    def bound(self):
+        """剪枝阈值（第N名的分数，堆未满时为None）：上界低于该值的分支不可能进入前N"""
+        return self.heap[0][0][0] if len(self.heap) >= self.top_n else None
+
+    def results(self) -> List[IdResult]:
+        return sort_results([(key[0], combination) for key, combination in self.heap])
+
+
+def branch_and_bound_top_n(tables: FiveHorsesTables, top_n: int, stats: Dict = None,
+                           cancel_token: CancelToken = None) -> List[IdResult]:
+    """
+    分支定界求前N优组合
+
+    依次确定grandparent1、grandparent2、chromo1、chromo2，每一层按乐观上界从高到低展开，
+    上界低于当前第N名分数的分支整体剪去。同分时按ID升序取舍，因此结果与逐一枚举后
+    按(分数降序, ID升序)排序取前N完全相同。被取消时返回当时的前N名。
+
+    Args:
+        tables: parent对应的求解矩阵
+        top_n: 返回前N个结果
+        stats: 传入字典时，在其'evaluated'项上累加实际计算了分数的组合数，
+               并将'coverage'设为已搜索或已剪枝的空间比例（完成时为1.0）
+        cancel_token: 取消令牌，在每个grandparent2分支之前检查
+
+    Returns:
+        按分数降序排列的(分数, (g1, g2, c1, c2))列表
+    """
+    m = tables.triple_slice
+    a = tables.grandparent_scores
+    top = _TopN(top_n)
+    evaluated = 0
+    # 每一层只在该角色的候选池内展开，计算量与各候选池的大小有关，而与候选池的并集无关
+    g1_ids, g2_ids, c1_ids, c2_ids = tables.pools()
+
+    # 每个马娘作为chromo1、chromo2时能贡献的三三相性上界
+    c1_max = np.full(m.shape[0], _NEG_INF, dtype=np.int64)
+    c2_max = np.full(m.shape[0], _NEG_INF, dtype=np.int64)
+    c1_max[g1_ids] = m[np.ix_(g1_ids, c1_ids)].max(axis=1, initial=_NEG_INF)
+    c2_rows = np.union1d(g1_ids, g2_ids)
+    c2_max[c2_rows] = m[np.ix_(c2_rows, c2_ids)].max(axis=1, initial=_NEG_INF)
+
+    # grandparent1层的上界：最优grandparent2 + chromo1、chromo2的行最大值
+    g2_part = a[np.ix_(g1_ids, g2_ids)] + c2_max[g2_ids][None, :]
+    g2_part[g1_ids[:, None] == g2_ids[None, :]] = _NEG_INF
+    g1_bounds = g2_part.max(axis=1, initial=_NEG_INF) + c1_max[g1_ids] + c2_max[g1_ids]
+    g1_order = np.argsort(-g1_bounds, kind='stable')
+
+    coverage = 1.0
+    for g1_position, g1_index in enumerate(g1_order):
+        g1 = int(g1_ids[g1_index])
+        bound = top.bound()
+        if g1_bounds[g1_index] <= _NEG_INF or (bound is not None and g1_bounds[g1_index] < bound):
+            break
+
+        # grandparent2层的上界
+        g2_bounds = a[g1, g2_ids] + c1_max[g1] + c2_max[g1] + c2_max[g2_ids]
+        g2_bounds[g2_ids == g1] = _NEG_INF
+        for g2_position, g2_index in enumerate(np.argsort(-g2_bounds, kind='stable')):
+            g2 = int(g2_ids[g2_index])
+            bound = top.bound()
+            if g2_bounds[g2_index] <= _NEG_INF or (bound is not None and g2_bounds[g2_index] < bound):
+                break
+            if cancel_token is not None and cancel_token.cancelled:
+                # 已完成的grandparent1分支和当前分支中已完成的grandparent2分支计为已覆盖
+                coverage = (g1_position + g2_position / len(g2_ids)) / len(g1_ids)
+                break
+
+            # chromo层：u[c1] = M[g1, c1]，v[c2] = M[g1, c2] + M[g2, c2]
+            base = int(a[g1, g2])
+            chromo1s = c1_ids[(c1_ids != g1) & (c1_ids != g2)]
+            chromo2s = c2_ids[(c2_ids != g1) & (c2_ids != g2)]
+            if len(chromo1s) == 0 or len(chromo2s) == 0:
+                continue
+            u = m[g1, chromo1s]
+            v = m[g1, chromo2s] + m[g2, chromo2s]
+            v_order = np.argsort(-v, kind='stable')
+            v_max = int(v[v_order[0]])
+            for c1_index in np.argsort(-u, kind='stable'):
+                bound = top.bound()
+                c1_score = base + int(u[c1_index])
+                if bound is not None and c1_score + v_max < bound:
+                    break
+                c1 = int(chromo1s[c1_index])
+                for c2_index in v_order:
+                    c2 = int(chromo2s[c2_index])
+                    if c2 == c1:
+                        continue
+                    score = c1_score + int(v[c2_index])
+                    evaluated += 1
+                    bound = top.bound()
+                    if bound is not None and score < bound:
+                        break
+                    top.push(score, (g1, g2, c1, c2))
+        if coverage < 1.0:
+            break
+
+    if stats is not None:
+        stats['evaluated'] = stats.get('evaluated', 0) + evaluated
+        stats['coverage'] = coverage
+    return top.results()
+
+
+def _order_keys(values: np.ndarray) -> np.ndarray:
+    """
+    将分数转换为互不相同的排序键：分数高者在前，同分时位置（即马娘ID）小者在前
+
+    values的最后一维按候选位置排列，分数须为非负且不含_NEG_INF。
+    """
+    width = values.shape[-1]
+    return values * (width + 1) + (width - np.arange(width))
+
+
+def decomposition_top_n(tables: FiveHorsesTables, top_n: int, stats: Dict = None,
+                        cancel_token: CancelToken = None, block_size: int = 1 << 20) -> List[IdResult]:
+    """
+    分解求前N优组合
+
+    固定(g1, g2)后，剩余部分 M[g1, c1] + (M[g1, c2] + M[g2, c2]) 是两个向量 u、v
+    各取一个不同元素的指派问题。按(分数降序, ID升序)的全序，若(c1, c2)位于该(g1, g2)
+    的前N名，则c1必在u的前N+1名、c2必在v的前N+1名中（否则可换成更优的候选）。因此对每个g1，
+    只需取u的前N+2名（留出g2可能占用的一个位置）和每行v的前N+1名，按块批量计算全部
+    候选组合，总复杂度约为O(N²·k²)，k为前N的规模。g2按块处理，每块先用当前第N名的分数
+    剪去上界不足的行，再展开其余行的候选组合，内存占用不超过block_size个元素（k²更大时为一行）。
+
+    Args:
+        tables: parent对应的求解矩阵
+        top_n: 返回前N个结果
+        stats: 传入字典时，在其'evaluated'项上累加实际计算了分数的组合数，
+               并将'coverage'设为已处理的grandparent1比例（完成时为1.0）
+        cancel_token: 取消令牌，在每个grandparent1之前检查；被取消时返回已处理部分的前N名
+        block_size: 每块展开的候选组合数的上限
+
+    Returns:
+        按分数降序排列的(分数, (g1, g2, c1, c2))列表，与逐一枚举后排序取前N完全相同
+    """
+    candidates = tables.candidates
+    n = len(candidates)
+    m = tables.triple_slice[np.ix_(candidates, candidates)]
+    a = tables.grandparent_scores[np.ix_(candidates, candidates)]
+    g1_allowed, g2_allowed, c1_allowed, c2_allowed = (tables.allowed(role) for role in ROLES)
+    if n == 0:
+        return []
+
+    k1 = min(top_n + 2, n)
+    k2 = min(top_n + 1, n)
+    rows_per_block = max(1, block_size // (k1 * k2))
+    # 组合的全序键：分数优先，同分时(g1, g2, c1, c2)的ID元组小者在前
+    base = int(candidates.max()) + 1
+    base4 = base ** 4
+
+    best_keys = np.empty(0, dtype=np.int64)
+    evaluated = 0
+    coverage = 1.0
+    g1_list = np.flatnonzero(g1_allowed).tolist()
+    g2_list = np.flatnonzero(g2_allowed)
+    for g1_position, g1 in enumerate(g1_list):
+        if cancel_token is not None and cancel_token.cancelled:
+            coverage = g1_position / len(g1_list)
+            break
+
+        # chromo1候选：u的前k1名（排除g1和不能担任chromo1的马娘）
+        u_keys = _order_keys(m[g1])
+        u_keys[~c1_allowed] = _NEG_INF
+        u_keys[g1] = _NEG_INF
+        c1_sel = np.argpartition(-u_keys, k1 - 1)[:k1]
+        u_max = int(m[g1, c1_sel].max())
+
+        g2s = g2_list[g2_list != g1]
+        for block_start in range(0, len(g2s), rows_per_block):
+            g2_block = g2s[block_start:block_start + rows_per_block]
+            rows = np.arange(len(g2_block))
+
+            # chromo2候选：v的每行（对应g2）的前k2名（排除g1、g2）
+            v = m[g1][None, :] + m[g2_block]
+            v_keys = _order_keys(v)
+            v_keys[:, ~c2_allowed] = _NEG_INF
+            v_keys[:, g1] = _NEG_INF
+            v_keys[rows, g2_block] = _NEG_INF
+            c2_sel = np.argpartition(-v_keys, k2 - 1, axis=1)[:, :k2]
+            v_sel = np.take_along_axis(v, c2_sel, axis=1)
+
+            if len(best_keys) >= top_n:
+                # 上界低于当前第N名分数的g2不可能进入前N，不展开其候选组合
+                threshold = -((-int(best_keys.min())) // base4)
+                keep = a[g1, g2_block] + u_max + v_sel.max(axis=1) >= threshold
+                g2_block, c2_sel, v_sel = g2_block[keep], c2_sel[keep], v_sel[keep]
+                if len(g2_block) == 0:
+                    continue
+
+            # scores[g2, i, j]：g2、c1_sel[i]、c2_sel[g2, j] 组成的组合
+            shape = (len(g2_block), k1, k2)
+            c1 = np.broadcast_to(c1_sel[None, :, None], shape)
+            c2 = np.broadcast_to(c2_sel[:, None, :], shape)
+            g2 = np.broadcast_to(g2_block[:, None, None], shape)
+            scores = a[g1, g2_block][:, None, None] + m[g1, c1_sel][None, :, None] + v_sel[:, None, :]
+            valid = ((c1 != g1) & (c2 != g1) & (c1 != g2) & (c2 != g2) & (c1 != c2)
+                     & c1_allowed[c1] & c2_allowed[c2])
+
+            ids = (int(candidates[g1]) * base ** 3 + candidates[g2] * base ** 2 + candidates[c1] * base + candidates[c2])
+            keys = (scores * base4 - ids)[valid]
+            evaluated += len(keys)
+            if len(best_keys) >= top_n:
+                keys = keys[keys > best_keys.min()]
+            keys = np.concatenate([best_keys, keys])
+            if len(keys) > top_n:
+                keys = keys[np.argpartition(-keys, top_n - 1)[:top_n]]
+            best_keys = keys
+
+    if stats is not None:
+        stats['evaluated'] = stats.get('evaluated', 0) + evaluated
+        stats['coverage'] = coverage
+    return _decode_keys(best_keys, base, top_n)
+
+
+def evaluate_block(tables: FiveHorsesTables, grandparent1: np.ndarray, grandparent2: np.ndarray,
+                   chromo1: np.ndarray, chromo2: np.ndarray) -> np.ndarray:
+    """
+    批量计算一组五马组合的相性点数（按ID数组索引取值，不做重复检查）
+
+    Args:
+        tables: parent对应的求解矩阵
+        grandparent1, grandparent2, chromo1, chromo2: 等长的马娘ID数组
+
+    Returns:
+        相性点数数组
+    """
+    m = tables.triple_slice
+    return (tables.grandparent_scores[grandparent1, grandparent2]
+            + m[grandparent1, chromo1] + m[grandparent1, chromo2] + m[grandparent2, chromo2])
+
+
+def vectorized_top_n(tables: FiveHorsesTables, top_n: int, start: int = 0, end: int = None,
+                     block_size: int = 1 << 20, stats: Dict = None,
+                     cancel_token: CancelToken = None) -> List[IdResult]:
+    """
+    分块向量化地逐一枚举排列，求前N优组合
+
+    候选马娘的四马排列按序号寻址（顺序与itertools.permutations相同），每次解码一块序号，
+    一次性用数组取值算出分数，再用argpartition与当前前N名合并。限制了候选池时改为按
+    各角色候选池的笛卡尔积寻址（顺序与itertools.product相同），跳过含有重复马娘的元素。
+    默认枚举全部序号，也可只处理序号区间[start, end)，枚举范围与逐一枚举相同，可作为对照结果。
+
+    Args:
+        tables: parent对应的求解矩阵
+        top_n: 返回前N个结果
+        start: 起始序号（含）
+        end: 结束序号（不含），默认为tables.search_size()
+        block_size: 每块的序号数
+        stats: 传入字典时，在其'evaluated'项上累加实际计算了分数的组合数，
+               并将'coverage'设为区间内已枚举的比例（完成时为1.0）
+        cancel_token: 取消令牌，在每块之前检查；被取消时返回已枚举部分的前N名
+
+    Returns:
+        按分数降序排列的(分数, (g1, g2, c1, c2))列表，与逐一枚举后排序取前N完全相同
+    """
+    candidates = tables.candidates
+    n = len(candidates)
+    if end is None:
+        end = tables.search_size()
+    if tables.role_ids is None:
+        # 在候选位置空间内计算：candidates按ID升序排列，位置的大小顺序与ID一致
+        base = n
+        pair_part = tables.grandparent_scores[np.ix_(candidates, candidates)].ravel()
+        triple_part = tables.triple_slice[np.ix_(candidates, candidates)].ravel()
+    else:
+        # 直接在ID空间内计算
+        base = int(candidates.max()) + 1 if n else 1
+        pools = tables.pools()
+        sizes = [len(pool) for pool in pools]
+
+    best_keys = np.empty(0, dtype=np.int64)
+    evaluated = 0
+    coverage = 1.0
+    for block_start in range(start, end, block_size):
+        if cancel_token is not None and cancel_token.cancelled:
+            coverage = (block_start - start) / (end - start)
+            break
+        block_end = min(block_start + block_size, end)
+        if tables.role_ids is None:
+            positions = unrank_block(block_start, block_end, n, 4)
+            g1, g2, c1, c2 = positions.T
+            row1 = g1 * n
+            scores = (pair_part.take(row1 + g2) + triple_part.take(row1 + c1)
+                      + triple_part.take(row1 + c2) + triple_part.take(g2 * n + c2))
+        else:
+            digits = unrank_product_block(block_start, block_end, sizes)
+            g1, g2, c1, c2 = (pool[digit] for pool, digit in zip(pools, digits.T))
+            # 只保留四个角色互不相同的组合
+            distinct = (g1 != g2) & (g1 != c1) & (g1 != c2) & (g2 != c1) & (g2 != c2) & (c1 != c2)
+            g1, g2, c1, c2 = g1[distinct], g2[distinct], c1[distinct], c2[distinct]
+            scores = evaluate_block(tables, g1, g2, c1, c2)
+
+        # 唯一排序键：分数优先，同分时(g1, g2, c1, c2)小者在前
+        keys = scores * base ** 4 - (((g1 * base + g2) * base + c1) * base + c2)
+        evaluated += len(keys)
+        if len(best_keys) >= top_n:
+            # 只保留可能进入前N的组合
+            keys = keys[keys > best_keys.min()]
+        keys = np.concatenate([best_keys, keys])
+        if len(keys) > top_n:
+            keys = keys[np.argpartition(-keys, top_n - 1)[:top_n]]
+        best_keys = keys
+
+    if stats is not None:
+        stats['evaluated'] = stats.get('evaluated', 0) + evaluated
+        stats['coverage'] = coverage
+    results = _decode_keys(best_keys, base, top_n)
+    if tables.role_ids is not None:
+        return results
+    return [(score, tuple(int(candidates[position]) for position in combination))
+            for score, combination in results]
+
+
+def _decode_keys(keys: np.ndarray, base: int, top_n: int) -> List[IdResult]:
+    """将排序键还原为按分数降序排列的(分数, (g1, g2, c1, c2))列表"""
+    base4 = base ** 4
+    results = []
+    for key in np.sort(keys)[::-1][:top_n].tolist():
+        score = -((-key) // base4)
+        ids = score * base4 - key
+        combination = (ids // base ** 3, ids // base ** 2 % base, ids // base % base, ids % base)
+        results.append((int(score), tuple(int(x) for x in combination)))
+    return results
@@ -0,0 +1,160 @@
+from typing import List, Dict, Iterable, Tuple
+
+import numpy as np
+
+
+class GroupBitsets:
+    def __init__(self, group_ids: List[int], group_scores: List[int], group_members: List[List[int]], num_umas: int):
+        """
+        以位掩码形式保存每个马娘所属的组，用于即时计算任意k个马娘的相性分数
+
+        第i个组对应掩码的第i位。马娘的掩码是其所属组对应位的并集，
+        k个马娘的共同组即为各自掩码的按位与，相性分数为共同组分数之和。
+
+        Args:
+            group_ids: 组号列表
+            group_scores: 与组号一一对应的分数列表
+            group_members: 与组号一一对应的成员马娘ID列表
+            num_umas: 马娘总数
+        """
+        self.group_ids = list(group_ids)
+        self.group_scores = list(group_scores)
+        self.group_members = [sorted(set(members)) for members in group_members]
+        self.num_umas = num_umas
+
+        # 每个马娘的组掩码
+        self.masks: List[int] = [0] * num_umas
+        for bit, members in enumerate(self.group_members):
+            for uma_id in members:
+                self.masks[uma_id] |= 1 << bit
+
+        # 按分数分层的组掩码，加权求和时每层只需一次按位与和一次popcount
+        levels: Dict[int, int] = {}
+        for bit, score in enumerate(self.group_scores):
+            levels[score] = levels.get(score, 0) | (1 << bit)
+        self.score_levels: List[Tuple[int, int]] = sorted(levels.items())
+
+        # 稠密的成员矩阵（N×组数），批量计算整行/整片相性时使用，按需构建
+        self._membership = None
+
+    @classmethod
+    def from_arrays(cls, group_ids: np.ndarray, group_scores: np.ndarray, member_indptr: np.ndarray,
+                    member_indices: np.ndarray, num_umas: int) -> 'GroupBitsets':
+        """由to_arrays导出的CSR形式数组重建组掩码"""
+        group_members = [member_indices[member_indptr[i]:member_indptr[i + 1]].tolist()
+                         for i in range(len(group_ids))]
+        return cls(group_ids.tolist(), group_scores.tolist(), group_members, num_umas)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """将组信息导出为CSR形式的数组（组号、分数、成员下标指针、成员ID），用于二进制缓存"""
+        lengths = [len(members) for members in self.group_members]
+        member_indptr = np.zeros(len(lengths) + 1, dtype=np.int32)
+        member_indptr[1:] = np.cumsum(lengths)
+        member_indices = np.array([uma_id for members in self.group_members for uma_id in members], dtype=np.int32)
+        return {
+            'group_ids': np.array(self.group_ids, dtype=np.int64),
+            'group_scores': np.array(self.group_scores, dtype=np.int32),
+            'group_member_indptr': member_indptr,
+            'group_member_indices': member_indices
+        }
+
+    @property
+    def membership(self) -> np.ndarray:
+        """N×组数的0/1成员矩阵"""
+        if self._membership is None:
+            membership = np.zeros((self.num_umas, len(self.group_ids)), dtype=np.float64)
+            for bit, members in enumerate(self.group_members):
+                membership[members, bit] = 1.0
+            self._membership = membership
+        return self._membership
+
+    def __getstate__(self):
+        # 成员矩阵可由掩码重建，传给子进程时不必携带
+        state = self.__dict__.copy()
+        state['_membership'] = None
+        return state
+
+    def pair_matrix(self, uma_ids: np.ndarray = None) -> np.ndarray:
+        """
+        一次性计算两两相性矩阵（对角线为0）
+
+        相当于对每对马娘的掩码按位与后加权求和，用矩阵乘法批量完成
+
+        Args:
+            uma_ids: 只计算这些马娘之间的子矩阵，默认为全部马娘
+
+        Returns:
+            len(uma_ids)×len(uma_ids)的矩阵
+        """
+        membership = self.membership if uma_ids is None else self.membership[uma_ids]
+        weighted = membership * np.array(self.group_scores, dtype=np.float64)
+        matrix = np.rint(weighted @ membership.T).astype(np.int32)
+        np.fill_diagonal(matrix, 0)
+        return matrix
+
+    def triple_slice(self, uma_id: int, uma_ids: np.ndarray = None) -> np.ndarray:
+        """
+        计算指定马娘与其余马娘组成的三三相性切片
+
+        Args:
+            uma_id: 马娘ID
+            uma_ids: 只计算这些马娘构成的子切片，默认为全部马娘
+
+        Returns:
+            矩阵，第(j, k)个元素为三三相性(uma_id, uma_ids[j], uma_ids[k])；含重复马娘的位置为0
+        """
+        if uma_ids is None:
+            uma_ids = np.arange(self.num_umas)
+        uma_ids = np.asarray(uma_ids)
+        bits = np.flatnonzero(self.membership[uma_id])
+        sub = self.membership[np.ix_(uma_ids, bits)]
+        scores = np.array(self.group_scores, dtype=np.float64)[bits]
+        matrix = np.rint((sub * scores) @ sub.T).astype(np.int32)
+        np.fill_diagonal(matrix, 0)
+        same = uma_ids == uma_id
+        matrix[same, :] = 0
+        matrix[:, same] = 0
+        return matrix
+
+    def common_mask(self, uma_ids: Iterable[int]) -> int:
+        """获取若干马娘共同所在组的掩码"""
+        mask = -1
+        for uma_id in uma_ids:
+            mask &= self.masks[uma_id]
+        return mask if mask != -1 else 0
+
+    def mask_score(self, mask: int) -> int:
+        """计算掩码中所有组的分数之和"""
+        if not mask:
+            return 0
+        return sum(score * (mask & level).bit_count() for score, level in self.score_levels)
+
+    def score(self, uma_ids: Iterable[int]) -> int:
+        """
+        计算任意k个马娘（按ID）的相性分数，即其共同所在组的分数之和
+
+        Args:
+            uma_ids: 马娘ID序列
+
+        Returns:
+            相性分数
+        """
+        return self.mask_score(self.common_mask(uma_ids))
+
+    def pair_score(self, id1: int, id2: int) -> int:
+        """计算两个马娘之间的相性分数"""
+        return self.mask_score(self.masks[id1] & self.masks[id2])
+
+    def triple_score(self, id1: int, id2: int, id3: int) -> int:
+        """计算三个马娘之间的相性分数"""
+        return self.mask_score(self.masks[id1] & self.masks[id2] & self.masks[id3])
+
+    def common_groups(self, uma_ids: Iterable[int]) -> List[int]:
+        """获取若干马娘共同所在组在组列表中的下标"""
+        mask = self.common_mask(uma_ids)
+        bits = []
+        while mask:
+            low = mask & -mask
+            bits.append(low.bit_length() - 1)
+            mask ^= low
+        return bits
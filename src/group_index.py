@@ -0,0 +1,106 @@
+"""
+马娘集合到共同组的索引
+
+相性分数是若干马娘共同所在组的分数之和。索引预先按(较小ID, 较大ID)保存每对马娘的共同组
+（CSR形式，组按在组列表中的下标升序排列），三只马娘的共同组由这一对的共同组按第三只马娘的
+成员关系筛选得到，因此解释一项两两/三三相性只需一次切片和一次布尔取值，不经过pandas。
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .group_bitset import GroupBitsets
+
+
+class GroupIndex:
+    def __init__(self, uma_list: List[str], group_bitsets: GroupBitsets, categories: Optional[List[str]] = None,
+                 notes: Optional[List[str]] = None):
+        """
+        由组掩码构建共同组索引
+
+        Args:
+            uma_list: 按ID排列的马娘名称列表
+            group_bitsets: 组掩码
+            categories: 与组一一对应的分类（学年、寝室、血缘等），None表示未知
+            notes: 与组一一对应的补充说明，None表示未知
+        """
+        self.uma_list = uma_list
+        self.group_bitsets = group_bitsets
+        num_umas = group_bitsets.num_umas
+        num_groups = len(group_bitsets.group_ids)
+        categories = categories if categories is not None else [""] * num_groups
+        notes = notes if notes is not None else [""] * num_groups
+
+        # 每个组的信息，在各次解释之间共用
+        self.groups: List[Dict] = [
+            {'组号': group_id, '分数': score, '分类': category, '补充': note}
+            for group_id, score, category, note in zip(group_bitsets.group_ids, group_bitsets.group_scores,
+                                                       categories, notes)
+        ]
+
+        # N×组数的成员关系，第i行即马娘i所在的组
+        self.membership = np.zeros((num_umas, num_groups), dtype=bool)
+        for position, members in enumerate(group_bitsets.group_members):
+            self.membership[members, position] = True
+
+        # 每对马娘（键为较小ID×N+较大ID）的共同组，按组的下标升序
+        keys, positions = [], []
+        for position, members in enumerate(group_bitsets.group_members):
+            members = np.asarray(members, dtype=np.int64)
+            if len(members) < 2:
+                continue
+            first, second = np.triu_indices(len(members), k=1)
+            keys.append(members[first] * num_umas + members[second])
+            positions.append(np.full(len(first), position, dtype=np.int64))
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        positions = np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((positions, keys))
+        self.pair_groups = positions[order].astype(np.int32)
+        self.pair_indptr = np.searchsorted(keys[order], np.arange(num_umas * num_umas + 1)).astype(np.int64)
+
+    def _pair(self, id1: int, id2: int) -> np.ndarray:
+        """两只不同马娘的共同组下标"""
+        if id1 > id2:
+            id1, id2 = id2, id1
+        key = id1 * self.group_bitsets.num_umas + id2
+        return self.pair_groups[self.pair_indptr[key]:self.pair_indptr[key + 1]]
+
+    def shared_groups(self, uma_ids: Iterable[int]) -> np.ndarray:
+        """
+        获取若干马娘共同所在组在组列表中的下标
+
+        Args:
+            uma_ids: 马娘ID序列
+
+        Returns:
+            按下标升序排列的int32数组；有重复马娘或少于两只马娘时为空（与相性分数一致）
+        """
+        uma_ids = list(uma_ids)
+        if len(uma_ids) < 2 or len(set(uma_ids)) < len(uma_ids):
+            return np.zeros(0, dtype=np.int32)
+        positions = self._pair(uma_ids[0], uma_ids[1])
+        for uma_id in uma_ids[2:]:
+            positions = positions[self.membership[uma_id, positions]]
+        return positions
+
+    def uma_groups(self, uma_id: int) -> np.ndarray:
+        """获取马娘所在全部组的下标（升序）"""
+        return np.flatnonzero(self.membership[uma_id])
+
+    def group_members(self, position: int) -> List[str]:
+        """获取组的成员名称（按ID升序）"""
+        return [self.uma_list[uma_id] for uma_id in self.group_bitsets.group_members[position]]
+
+    def explain(self, uma_ids: Iterable[int]) -> List[Dict]:
+        """
+        获取若干马娘的共同组信息
+
+        Args:
+            uma_ids: 马娘ID序列
+
+        Returns:
+            组信息字典（组号、分数、分类、补充）的列表，分数之和即这些马娘的相性分数；
+            字典在各次调用之间共用，请勿修改
+        """
+        return [self.groups[position] for position in self.shared_groups(uma_ids).tolist()]
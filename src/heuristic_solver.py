@@ -0,0 +1,294 @@
+"""
+五马循环的启发式求解（大规模名单）
+
+名单很大时精确搜索的代价随马娘数的三至四次方增长。local_search_top_n在给定的计算量预算内
+做多起点局部搜索：从parent最佳搭档对（按上界排序的(g1, g2)）出发，交替对(chromo1, chromo2)
+和(grandparent1, grandparent2)两组角色整体取最优，直到不再提升；之后随机替换一位祖父马娘
+重新爬山，按模拟退火的规则决定是否接受。
+
+同时计算全局最优分数的上界（忽略chromo1与chromo2不能相同的约束，逐个grandparent1收紧），
+结果与上界之差即为可证明的最优性差距。
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .cancellation import CancelToken
+from .five_horses_solver import FiveHorsesTables, IdResult, ROLES, _NEG_INF, _TopN
+from .permutation_shards import count_permutations
+
+# 默认的计算量预算（计算了分数的组合数，含收紧上界时计算的部分）
+DEFAULT_BUDGET = 1 << 24
+
+# 从上界最高的若干个(g1, g2)分别出发爬山
+DEFAULT_NUM_STARTS = 16
+
+# 模拟退火的初始温度与上界差距之比
+INITIAL_TEMPERATURE_RATIO = 0.5
+
+
+class _Bounds:
+    """按grandparent1逐行收紧的全局上界"""
+
+    def __init__(self, a: np.ndarray, m: np.ndarray, allowed: List[np.ndarray]):
+        self.a = a
+        self.m = m
+        self.g1_allowed, self.g2_allowed, self.c1_allowed, self.c2_allowed = allowed
+        n = len(a)
+        self.positions = np.arange(n)
+
+        # 粗上界：chromo1、chromo2各取行最大值，与分支定界的grandparent1层上界相同
+        c1_max = np.where(self.c1_allowed[None, :], m, _NEG_INF).max(axis=1, initial=_NEG_INF)
+        c2_max = np.where(self.c2_allowed[None, :], m, _NEG_INF).max(axis=1, initial=_NEG_INF)
+        g2_part = a + c2_max[None, :]
+        g2_part[:, ~self.g2_allowed] = _NEG_INF
+        np.fill_diagonal(g2_part, _NEG_INF)
+        rough = g2_part.max(axis=1, initial=_NEG_INF) + c1_max + c2_max
+        rough[~self.g1_allowed] = _NEG_INF
+        self.rough = np.maximum(rough, _NEG_INF)
+        self.order = np.argsort(-self.rough, kind='stable')
+        # 已收紧的行数和这些行的最大值
+        self.tightened = 0
+        self.tight_max = _NEG_INF
+
+    @property
+    def value(self) -> int:
+        """当前的全局上界：已收紧行的最大值与其余行粗上界的较大者"""
+        rest = self.rough[self.order[self.tightened]] if self.tightened < len(self.order) else _NEG_INF
+        return int(max(self.tight_max, rest))
+
+    @property
+    def settled(self) -> bool:
+        """其余行的粗上界都不超过已收紧的最大值，继续收紧不会降低上界"""
+        return self.tightened >= len(self.order) or self.rough[self.order[self.tightened]] <= self.tight_max
+
+    def tighten(self) -> Tuple[int, int, int]:
+        """
+        收紧下一行：固定g1后，chromo1与chromo2只需避开g1、g2，分别取最大值
+
+        Returns:
+            (该行上界最高的g2位置, 该行的上界, 本次计算的单元数)
+        """
+        g1 = int(self.order[self.tightened])
+        self.tightened += 1
+        a, m, positions = self.a, self.m, self.positions
+        # chromo1：取u的前两名，g2占用第一名时用第二名
+        u = np.where(self.c1_allowed, m[g1], _NEG_INF)
+        u[g1] = _NEG_INF
+        first = int(np.argmax(u))
+        u_first = u[first]
+        u[first] = _NEG_INF
+        u_best = np.where(positions == first, u.max(), u_first)
+        # chromo2：v[g2, c2] = M[g1, c2] + M[g2, c2]
+        v = m[g1][None, :] + m
+        v[:, ~self.c2_allowed] = _NEG_INF
+        v[:, g1] = _NEG_INF
+        v[positions, positions] = _NEG_INF
+        row = a[g1] + u_best + v.max(axis=1)
+        row[~self.g2_allowed] = _NEG_INF
+        row[g1] = _NEG_INF
+        row = np.maximum(row, _NEG_INF)
+        best_g2 = int(np.argmax(row))
+        self.tight_max = max(self.tight_max, int(row[best_g2]))
+        return best_g2, int(row[best_g2]), len(positions) ** 2
+
+
+def local_search_top_n(tables: FiveHorsesTables, top_n: int, stats: Dict = None,
+                       cancel_token: CancelToken = None, budget: int = None,
+                       num_starts: int = DEFAULT_NUM_STARTS, seed: int = 0) -> List[IdResult]:
+    """
+    多起点局部搜索求前N优组合（启发式，不保证最优）
+
+    每次爬山交替执行两步，每步都在固定另外两个角色时取整组最优：固定(g1, g2)时(c1, c2)是
+    两个向量各取一个不同元素的指派问题，取前N+1名即可；固定(c1, c2)时对全部(g1, g2)计算分数。
+    两步中分数最高的前N个组合都计入结果，因此结果中的组合分数都是真实的。
+
+    Args:
+        tables: parent对应的求解矩阵
+        top_n: 返回前N个结果
+        stats: 传入字典时，在其'evaluated'项上累加计算了分数的组合数，将'upper_bound'设为
+               全局最优分数的上界，'coverage'在最优分数已达到上界且top_n为1时设为1.0
+               （分数已证明最优，同分时组合未必是ID最小者），否则为0.0
+        cancel_token: 取消令牌，在每次爬山之前检查
+        budget: 计算量预算（计算了分数的组合数），默认为DEFAULT_BUDGET；
+                不超过全部排列数（此时应改用精确搜索）
+        num_starts: 起点数
+        seed: 随机数种子，相同的输入和种子得到相同的结果
+
+    Returns:
+        按分数降序排列的(分数, (g1, g2, c1, c2))列表
+    """
+    if budget is None:
+        budget = DEFAULT_BUDGET
+    if budget <= 0:
+        raise ValueError("budget必须为正整数")
+    candidates = tables.candidates
+    n = len(candidates)
+    allowed = [tables.allowed(role) for role in ROLES]
+    g1_allowed, g2_allowed, c1_allowed, c2_allowed = allowed
+    top = _TopN(top_n)
+    evaluated = 0
+    if n < 4:
+        _record(stats, evaluated, _NEG_INF, top, top_n)
+        return []
+    budget = min(budget, count_permutations(n, 4))
+
+    m = tables.triple_slice[np.ix_(candidates, candidates)]
+    a = tables.grandparent_scores[np.ix_(candidates, candidates)]
+    positions = np.arange(n)
+    # grandparent层的固定部分：不合法的(g1, g2)预先置为不可选
+    a_masked = np.where(g1_allowed[:, None] & g2_allowed[None, :], a, _NEG_INF)
+    np.fill_diagonal(a_masked, _NEG_INF)
+    k = min(top_n + 1, n)
+
+    # 同一组合可能在多次爬山中重复出现，只计入一次
+    seen = set()
+
+    def push(scores: np.ndarray, combinations: np.ndarray):
+        for score, combination in zip(scores.tolist(), candidates[combinations].tolist()):
+            combination = tuple(combination)
+            if combination not in seen:
+                seen.add(combination)
+                top.push(score, combination)
+
+    def chromo_step(g1: int, g2: int) -> Optional[Tuple[int, Tuple[int, int, int, int]]]:
+        """固定(g1, g2)，取(c1, c2)的前N名，返回其中最优者"""
+        nonlocal evaluated
+        others = (positions != g1) & (positions != g2)
+        chromo1s = np.flatnonzero(others & c1_allowed)
+        chromo2s = np.flatnonzero(others & c2_allowed)
+        evaluated += len(chromo1s) + len(chromo2s)
+        if len(chromo1s) == 0 or len(chromo2s) == 0:
+            return None
+        u = m[g1, chromo1s]
+        v = m[g1, chromo2s] + m[g2, chromo2s]
+        chromo1s = chromo1s[np.argsort(-u, kind='stable')[:k]]
+        chromo2s = chromo2s[np.argsort(-v, kind='stable')[:k]]
+        c1 = np.repeat(chromo1s, len(chromo2s))
+        c2 = np.tile(chromo2s, len(chromo1s))
+        valid = c1 != c2
+        c1, c2 = c1[valid], c2[valid]
+        if len(c1) == 0:
+            return None
+        scores = a[g1, g2] + m[g1, c1] + m[g1, c2] + m[g2, c2]
+        evaluated += len(scores)
+        combinations = np.stack([np.full(len(c1), g1), np.full(len(c1), g2), c1, c2], axis=1)
+        order = np.lexsort((c2, c1, -scores))[:top_n]
+        push(scores[order], combinations[order])
+        best = order[0]
+        return int(scores[best]), (g1, g2, int(c1[best]), int(c2[best]))
+
+    def grandparent_step(c1: int, c2: int) -> Optional[Tuple[int, Tuple[int, int, int, int]]]:
+        """固定(c1, c2)，对全部(g1, g2)计算分数，返回最优者"""
+        nonlocal evaluated
+        scores = a_masked + (m[:, c1] + m[:, c2])[:, None] + m[:, c2][None, :]
+        scores[[c1, c2], :] = _NEG_INF
+        scores[:, [c1, c2]] = _NEG_INF
+        evaluated += n * n
+        flat = scores.ravel()
+        take = min(top_n, len(flat))
+        selected = np.argpartition(-flat, take - 1)[:take]
+        selected = selected[flat[selected] > _NEG_INF // 2]
+        if len(selected) == 0:
+            return None
+        # 同分时位置小者在前（位置顺序与ID一致）
+        selected = selected[np.lexsort((selected, -flat[selected]))]
+        g1, g2 = np.divmod(selected, n)
+        combinations = np.stack([g1, g2, np.full(len(g1), c1), np.full(len(g1), c2)], axis=1)
+        push(flat[selected], combinations)
+        return int(flat[selected[0]]), (int(g1[0]), int(g2[0]), c1, c2)
+
+    def climb(g1: int, g2: int) -> Optional[Tuple[int, Tuple[int, int, int, int]]]:
+        """从(g1, g2)出发交替优化两组角色，返回局部最优解"""
+        current = None
+        while True:
+            step = chromo_step(g1, g2)
+            if step is None or (current is not None and step[0] <= current[0]):
+                return current
+            current = step
+            step = grandparent_step(*current[1][2:])
+            if step is None or step[0] <= current[0]:
+                return current
+            current = step
+            g1, g2 = current[1][:2]
+
+    # 按粗上界从高到低收紧，收紧的行同时给出起点：该g1下上界最高的g2
+    bounds = _Bounds(a, m, allowed)
+    starts = []
+    while not bounds.settled and evaluated < budget // 2:
+        if cancel_token is not None and cancel_token.cancelled:
+            break
+        g1 = int(bounds.order[bounds.tightened])
+        g2, row_bound, cells = bounds.tighten()
+        evaluated += cells
+        if row_bound > _NEG_INF:
+            starts.append((row_bound, g1, g2))
+    if len(starts) < num_starts:
+        # 上界很快确定时，用粗上界最高但尚未收紧的g1补足起点
+        for g1 in bounds.order[bounds.tightened:bounds.tightened + num_starts - len(starts)].tolist():
+            if bounds.rough[g1] > _NEG_INF:
+                row = a_masked[g1]
+                if row.max() > _NEG_INF // 2:
+                    starts.append((int(bounds.rough[g1]), g1, int(np.argmax(row))))
+    starts.sort(key=lambda item: (-item[0], item[1], item[2]))
+    upper_bound = bounds.value
+
+    def proven() -> bool:
+        return top_n == 1 and bool(top.heap) and top.heap[0][0][0] >= upper_bound
+
+    rng = np.random.default_rng(seed)
+    current = None
+    for _, g1, g2 in starts[:num_starts]:
+        if evaluated >= budget or proven() or (cancel_token is not None and cancel_token.cancelled):
+            break
+        result = climb(g1, g2)
+        if result is not None and (current is None or result[0] > current[0]):
+            current = result
+
+    # 迭代局部搜索：随机替换一位或两位祖父马娘后重新爬山，按模拟退火规则接受
+    if current is not None:
+        g1_choices = np.flatnonzero(g1_allowed)
+        g2_choices = np.flatnonzero(g2_allowed)
+        temperature = max((upper_bound - current[0]) * INITIAL_TEMPERATURE_RATIO, 1.0)
+        start_evaluated = evaluated
+        while evaluated < budget and not proven():
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            g1, g2 = current[1][:2]
+            move = rng.random()
+            if move < 0.4:
+                g1 = int(rng.choice(g1_choices))
+            elif move < 0.8:
+                g2 = int(rng.choice(g2_choices))
+            else:
+                g1, g2 = int(rng.choice(g1_choices)), int(rng.choice(g2_choices))
+            if g1 == g2 or not g1_allowed[g1] or not g2_allowed[g2]:
+                continue
+            result = climb(g1, g2)
+            if result is None:
+                continue
+            # 温度随预算的消耗线性降到0
+            remaining = 1.0 - (evaluated - start_evaluated) / max(budget - start_evaluated, 1)
+            delta = result[0] - current[0]
+            if delta >= 0 or rng.random() < math.exp(delta / max(temperature * remaining, 1e-9)):
+                current = result
+
+    _record(stats, evaluated, upper_bound, top, top_n)
+    return top.results()
+
+
+def _record(stats: Optional[Dict], evaluated: int, upper_bound: int, top: _TopN, top_n: int):
+    """写入统计信息（见local_search_top_n）"""
+    if stats is None:
+        return
+    stats['evaluated'] = stats.get('evaluated', 0) + evaluated
+    best = max((key[0] for key, _ in top.heap), default=None)
+    if upper_bound <= _NEG_INF:
+        # 没有任何合法组合：搜索空间已全部排除
+        stats['upper_bound'] = None
+        stats['coverage'] = 1.0
+        return
+    stats['upper_bound'] = upper_bound
+    stats['coverage'] = 1.0 if top_n == 1 and best is not None and best >= upper_bound else 0.0
@@ -0,0 +1,192 @@
+"""
+阶段计时与指标
+
+Instrumentation统一接管相性数据处理器和各计算器的输出：按阶段计时（读取、映射、两两/三三相性构建、
+缓存读写、搜索等），累计计数器（已计算/已剪枝的组合数），可选记录每个阶段的内存峰值，
+并把每个完成的阶段作为一条事件交给回调函数（如JsonLinesExporter）。
+quiet模式下不打印任何信息，也不创建进度条。
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """当前进程的常驻内存峰值（字节），平台不支持时为None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _NullProgress:
+    """quiet模式下代替tqdm的空进度条"""
+
+    def __enter__(self) -> '_NullProgress':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def update(self, n: int = 1):
+        pass
+
+    def set_postfix(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class Instrumentation:
+    def __init__(self, callback: Callable[[Dict], None] = None, quiet: bool = False, track_memory: bool = False):
+        """
+        初始化计时与指标收集器
+
+        Args:
+            callback: 每个阶段结束时以事件字典调用的函数，如JsonLinesExporter实例
+            quiet: 是否静默（不打印信息、不显示进度条）
+            track_memory: 是否用tracemalloc记录每个阶段的内存分配峰值（有一定开销）
+        """
+        self.callback = callback
+        self.quiet = quiet
+        self.track_memory = track_memory
+        # {阶段名: {'seconds': 累计用时, 'calls': 次数}}
+        self.phases: Dict[str, Dict] = {}
+        # {计数器名: 累计值}
+        self.counters: Dict[str, int] = {}
+        # 嵌套阶段各自的内存峰值（外层阶段的峰值包含内层阶段）
+        self._memory_peaks: List[int] = []
+        self._started_tracing = False
+
+    def log(self, message: str = ""):
+        """打印信息（quiet模式下不输出）"""
+        if not self.quiet:
+            print(message)
+
+    def progress(self, total: int = None, desc: str = None, disable: bool = False):
+        """
+        创建进度条（quiet模式或disable时返回空进度条，不导入tqdm）
+
+        Args:
+            total: 总数
+            desc: 描述
+            disable: 是否不显示
+
+        Returns:
+            tqdm实例或空进度条，均可用作上下文管理器
+        """
+        if self.quiet or disable:
+            return _NullProgress()
+        from tqdm import tqdm
+        return tqdm(total=total, desc=desc)
+
+    def count(self, name: str, value: int = 1):
+        """累加计数器"""
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def emit(self, event: Dict):
+        """将事件交给回调函数"""
+        if self.callback is not None:
+            self.callback(event)
+
+    def _fold_memory_peak(self):
+        """将当前的tracemalloc峰值并入所有进行中的阶段，然后重置峰值"""
+        peak = tracemalloc.get_traced_memory()[1]
+        self._memory_peaks = [max(value, peak) for value in self._memory_peaks]
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str, **fields):
+        """
+        对一个阶段计时，结束时记录用时并发出事件
+
+        事件包含phase、seconds、该阶段内计数器的增量counters、进程常驻内存峰值peak_rss，
+        开启track_memory时还有该阶段的内存分配峰值peak_memory，以及调用时传入的其他字段。
+
+        Args:
+            name: 阶段名
+            **fields: 附加到事件中的字段（如parent、method）
+        """
+        counters_before = dict(self.counters)
+        if self.track_memory:
+            if not self._memory_peaks and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._fold_memory_peak()
+            self._memory_peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stats = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            stats['seconds'] += seconds
+            stats['calls'] += 1
+
+            event = {'event': 'phase', 'phase': name, 'seconds': seconds}
+            event.update(fields)
+            event['counters'] = {key: value - counters_before.get(key, 0) for key, value in self.counters.items()
+                                 if value != counters_before.get(key, 0)}
+            if self.track_memory:
+                self._fold_memory_peak()
+                event['peak_memory'] = self._memory_peaks.pop()
+                if not self._memory_peaks and self._started_tracing:
+                    tracemalloc.stop()
+                    self._started_tracing = False
+            event['peak_rss'] = peak_rss()
+            self.emit(event)
+
+    def summary(self) -> Dict:
+        """
+        汇总全部阶段和计数器
+
+        Returns:
+            {'phases': {阶段名: {'seconds', 'calls'}}, 'counters': {...}, 'peak_rss': 字节数}
+        """
+        return {
+            'phases': {name: dict(stats) for name, stats in self.phases.items()},
+            'counters': dict(self.counters),
+            'peak_rss': peak_rss()
+        }
+
+
+class JsonLinesExporter:
+    def __init__(self, output):
+        """
+        将事件逐行写为JSON（可直接作为Instrumentation的callback）
+
+        Args:
+            output: 输出文件路径（追加写入），或已打开的文本流
+        """
+        if isinstance(output, str):
+            self._stream = open(output, 'a', encoding='utf-8')
+            self._owns_stream = True
+        else:
+            self._stream = output
+            self._owns_stream = False
+
+    def __call__(self, event: Dict):
+        self._stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._stream.flush()
+
+    def close(self):
+        """关闭由本对象打开的文件"""
+        if self._owns_stream:
+            self._stream.close()
+
+    def __enter__(self) -> 'JsonLinesExporter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,138 @@
+"""
+按相性排序的搭档索引
+
+对每只马娘，按两两相性从高到低（同分时ID小者在前）保存其余全部马娘；对每一对马娘，
+保存三三相性最高的若干个第三成员。索引随二进制缓存一起保存，查询前k名搭档只需切片，
+代价为O(k)；搜索时也可直接用它作为候选马娘的展开顺序。
+"""
+
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+# 每对马娘保存的最佳第三成员数
+DEFAULT_NUM_THIRDS = 16
+
+
+def _ranked_positions(scores: np.ndarray, excluded: np.ndarray, k: int) -> np.ndarray:
+    """
+    每行按(分数降序, 列号升序)取前k列，excluded为True的列不参与排序
+
+    Args:
+        scores: 二维非负分数数组
+        excluded: 与scores同形状（或可广播）的布尔数组
+        k: 每行保留的列数
+
+    Returns:
+        形状为(行数, k)的列号数组
+    """
+    width = scores.shape[1]
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    keys = scores.astype(np.int64) * (width + 1) + (width - np.arange(width))
+    keys = np.where(excluded, -1, keys)
+    if k < width:
+        selected = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    else:
+        selected = np.broadcast_to(np.arange(width), keys.shape)
+    order = np.argsort(-np.take_along_axis(keys, selected, axis=1), axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(selected, order, axis=1)
+
+
+class PartnerIndex:
+    def __init__(self, partner_order: np.ndarray, partner_scores: np.ndarray,
+                 third_order: np.ndarray, third_scores: np.ndarray):
+        """
+        初始化搭档索引（通常由build或from_arrays创建）
+
+        Args:
+            partner_order: N×(N-1)数组，第i行为马娘i的搭档ID，按两两相性降序
+            partner_scores: 与partner_order对应的两两相性
+            third_order: N×N×T数组，第(i, j)行为马娘i、j的最佳第三成员ID，按三三相性降序
+            third_scores: 与third_order对应的三三相性
+        """
+        self.partner_order = partner_order
+        self.partner_scores = partner_scores
+        self.third_order = third_order
+        self.third_scores = third_scores
+
+    @property
+    def num_thirds(self) -> int:
+        """每对马娘保存的第三成员数"""
+        return self.third_order.shape[2]
+
+    @classmethod
+    def build(cls, pair_matrix: np.ndarray, triple_slice: Callable[[int], np.ndarray],
+              num_thirds: int = DEFAULT_NUM_THIRDS) -> 'PartnerIndex':
+        """
+        由两两相性矩阵和三三相性切片构建索引
+
+        Args:
+            pair_matrix: N×N两两相性矩阵
+            triple_slice: 按马娘ID返回其N×N三三相性切片的函数
+            num_thirds: 每对马娘保存的第三成员数（不超过N-2）
+
+        Returns:
+            搭档索引
+        """
+        pair_matrix = np.asarray(pair_matrix)
+        n = pair_matrix.shape[0]
+        ids = np.arange(n)
+
+        partner_order = _ranked_positions(pair_matrix, ids[:, None] == ids[None, :], max(n - 1, 0))
+        partner_scores = np.take_along_axis(pair_matrix, partner_order, axis=1)
+
+        num_thirds = max(min(num_thirds, n - 2), 0)
+        third_order = np.zeros((n, n, num_thirds), dtype=np.int32)
+        third_scores = np.zeros((n, n, num_thirds), dtype=np.int32)
+        if num_thirds:
+            for uma_id in range(n):
+                # 第(j, k)个元素为三三相性(uma_id, j, k)，第三成员不能是uma_id或j
+                scores = np.asarray(triple_slice(uma_id))
+                excluded = (ids[None, :] == uma_id) | (ids[:, None] == ids[None, :])
+                order = _ranked_positions(scores, excluded, num_thirds)
+                third_order[uma_id] = order
+                third_scores[uma_id] = np.take_along_axis(scores, order, axis=1)
+
+        return cls(partner_order.astype(np.int32), partner_scores.astype(np.int32), third_order, third_scores)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'PartnerIndex':
+        """由to_arrays导出的数组重建索引"""
+        return cls(arrays['partner_order'], arrays['partner_scores'], arrays['third_order'], arrays['third_scores'])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """导出为数组，用于二进制缓存"""
+        return {
+            'partner_order': self.partner_order,
+            'partner_scores': self.partner_scores,
+            'third_order': self.third_order,
+            'third_scores': self.third_scores
+        }
+
+    def top_partners(self, uma_id: int, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取两两相性最高的k个搭档
+
+        Args:
+            uma_id: 马娘ID
+            k: 搭档数，默认为全部
+
+        Returns:
+            (搭档ID数组, 两两相性数组)，按相性降序
+        """
+        return self.partner_order[uma_id, :k], self.partner_scores[uma_id, :k]
+
+    def best_thirds(self, id1: int, id2: int, k: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取与一对马娘三三相性最高的k个第三成员（k不超过num_thirds）
+
+        Args:
+            id1: 马娘1的ID
+            id2: 马娘2的ID
+            k: 第三成员数，默认为索引保存的全部
+
+        Returns:
+            (第三成员ID数组, 三三相性数组)，按相性降序
+        """
+        return self.third_order[id1, id2, :k], self.third_scores[id1, id2, :k]
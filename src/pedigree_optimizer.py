@@ -0,0 +1,281 @@
+"""
+七马血统的约束优化
+
+七马相性点数为：
+
+    score = Q(T, P1) + Q(T, P2) + Q(P1, P2)
+            + M_T[P1, G1] + M_T[P1, G2] + M_T[P2, G3] + M_T[P2, G4]
+
+其中 Q 为两两相性矩阵，M_T 为target的三三相性切片。固定(T, P1, P2)后，两个父辈分支
+(P1; G1, G2) 与 (P2; G3, G4) 互不影响，各自只需在 M_T 的一行中取值最高的两个祖辈，
+因此补全一个分支的代价与马娘数量成线性关系，无需枚举O(N⁴)的祖辈组合。
+
+合法的七马血统要求：T、P1、P2互不相同；同一分支的两个祖辈互不相同，且不能与target或
+该分支的父辈相同。不同分支之间允许重复（例如五马循环中G4与P1、G2与G3为同一马娘）。
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .calculator import SLOTS
+from .compatibility import CompatibilityData
+from .five_horses_solver import _NEG_INF, _TopN, _order_keys, sort_results
+from .instrumentation import Instrumentation
+from .partner_index import PartnerIndex
+
+# (分数, 七个位置的马娘ID) 形式的结果
+PedigreeResult = Tuple[int, Tuple[int, int, int, int, int, int, int]]
+
+
+def _top_positions(values: np.ndarray, k: int) -> np.ndarray:
+    """每行按(分数降序, 位置升序)取前k个位置，值为_NEG_INF的位置排在最后"""
+    keys = np.where(values > _NEG_INF, _order_keys(np.maximum(values, 0)), -1)
+    k = min(k, values.shape[1])
+    selected = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(keys, selected, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(selected, order, axis=1)
+
+
+class _Branch:
+    """固定target后，一个父辈分支（父辈及其两个祖辈）的补全表"""
+
+    def __init__(self, triple_slice: np.ndarray, target: int, parents: np.ndarray,
+                 first: np.ndarray, second: np.ndarray, top_n: int, partner_index: PartnerIndex = None):
+        """
+        Args:
+            triple_slice: target的三三相性切片（int64）
+            target: target的ID
+            parents: 该分支父辈的候选ID（升序）
+            first: 第一个祖辈的候选ID（升序）
+            second: 第二个祖辈的候选ID（升序）
+            top_n: 每个父辈保留的补全数
+            partner_index: 搭档索引，祖辈不受限制时直接读取(target, 父辈)的最佳第三成员
+        """
+        self.top_n = top_n
+        self.parents = parents
+        # 只需各祖辈位置的前top_n+1名：排在更后面的祖辈至少被top_n个补全压过
+        self.first, self.first_values = self._select(triple_slice, target, parents, first, top_n + 1, partner_index)
+        self.second, self.second_values = self._select(triple_slice, target, parents, second, top_n + 1, partner_index)
+
+        pair_values = self.first_values[:, :, None] + self.second_values[:, None, :]
+        valid = ((self.first[:, :, None] != self.second[:, None, :])
+                 & (self.first_values[:, :, None] > _NEG_INF) & (self.second_values[:, None, :] > _NEG_INF))
+        self.pair_values = np.where(valid, pair_values, _NEG_INF)
+        # 每个父辈的最优补全分数（无合法补全时为_NEG_INF）
+        self.best = self.pair_values.reshape(len(parents), -1).max(axis=1, initial=_NEG_INF)
+        self._lists = {}
+
+    @staticmethod
+    def _select(triple_slice: np.ndarray, target: int, parents: np.ndarray, grandparents: np.ndarray, k: int,
+                partner_index: PartnerIndex = None):
+        """取每个父辈对应的前k个祖辈候选及其三三相性，不合法的位置为_NEG_INF"""
+        if (partner_index is not None and k <= partner_index.num_thirds
+                and len(grandparents) == triple_slice.shape[0]):
+            # 祖辈可为任意马娘：索引中(target, 父辈)的第三成员已按相同顺序排好，且不含target和父辈
+            selected = np.asarray(partner_index.third_order[target, parents, :k], dtype=np.int64)
+            return selected, np.take_along_axis(triple_slice[parents], selected, axis=1)
+        values = triple_slice[np.ix_(parents, grandparents)].copy()
+        values[:, grandparents == target] = _NEG_INF
+        values[parents[:, None] == grandparents[None, :]] = _NEG_INF
+        if values.shape[1] == 0:
+            return np.zeros((len(parents), 0), dtype=np.int64), values
+        positions = _top_positions(values, k)
+        selected_values = np.take_along_axis(values, positions, axis=1)
+        return grandparents[positions], selected_values
+
+    def completions(self, index: int) -> List[Tuple[int, Tuple[int, int]]]:
+        """
+        第index个父辈的前top_n个祖辈补全
+
+        Returns:
+            按(分数降序, ID升序)排列的(分数, (祖辈1, 祖辈2))列表
+        """
+        if index not in self._lists:
+            values = self.pair_values[index]
+            rows, cols = np.nonzero(values > _NEG_INF)
+            completions = [(int(values[i, j]), (int(self.first[index, i]), int(self.second[index, j])))
+                           for i, j in zip(rows.tolist(), cols.tolist())]
+            self._lists[index] = sort_results(completions)[:self.top_n]
+        return self._lists[index]
+
+
+class PedigreeOptimizer:
+    def __init__(self, compatibility_data: CompatibilityData, instrumentation: Instrumentation = None):
+        """
+        初始化七马血统优化器
+
+        Args:
+            compatibility_data: 相性数据处理器实例
+            instrumentation: 阶段计时与指标收集器，默认与相性数据处理器共用
+        """
+        self.compatibility_data = compatibility_data
+        self.instrumentation = instrumentation or compatibility_data.instrumentation
+        self.pair_matrix = np.asarray(compatibility_data.pair_matrix, dtype=np.int64)
+
+    def _slot_candidates(self, fixed: Optional[Dict[str, str]], allowed=None,
+                         excluded: Iterable[str] = None) -> Dict[str, np.ndarray]:
+        """
+        将固定位置、候选池和排除列表转换为每个位置的候选ID数组（升序）
+
+        Args:
+            fixed: {位置: 马娘}
+            allowed: {位置: 马娘列表}或所有未固定位置共用的马娘列表，None表示不限制
+            excluded: 未固定的位置都不能使用的马娘
+
+        Returns:
+            {位置: 升序ID数组}
+        """
+        fixed = fixed or {}
+        if allowed is None:
+            allowed = {}
+        elif not isinstance(allowed, dict):
+            allowed = {slot: allowed for slot in SLOTS if slot not in fixed}
+        for slot in list(fixed) + list(allowed):
+            if slot not in SLOTS:
+                raise ValueError(f"未知的位置 '{slot}'，可选: {', '.join(SLOTS)}")
+
+        # 一次性检查所有马娘名称
+        names = set(fixed.values()) | {uma for umas in allowed.values() for uma in umas} | set(excluded or ())
+        unknown = sorted(names - set(self.compatibility_data.uma_list))
+        if unknown:
+            raise ValueError(f"马娘 {', '.join(repr(uma) for uma in unknown)} 不存在于数据中")
+
+        excluded_ids = self._to_ids(excluded or ())
+        all_ids = np.arange(self.compatibility_data.num_umas, dtype=np.int64)
+        candidates = {}
+        for slot in SLOTS:
+            if slot in fixed:
+                candidates[slot] = self._to_ids([fixed[slot]])
+            else:
+                ids = self._to_ids(allowed[slot]) if slot in allowed else all_ids
+                candidates[slot] = np.setdiff1d(ids, excluded_ids)
+        return candidates
+
+    def _to_ids(self, umas: Iterable[str]) -> np.ndarray:
+        """将马娘名称转换为去重后的升序ID数组"""
+        return np.unique(np.array([self.compatibility_data.get_uma_id(uma) for uma in umas], dtype=np.int64))
+
+    def _target_tables(self, target: int, candidates: Dict[str, np.ndarray], top_n: int):
+        """
+        固定target后计算两个分支的补全表和(P1, P2)的上界矩阵
+
+        Returns:
+            (分支1, 分支2, 上界矩阵)；上界为两两相性加两个分支各自的最优补全
+        """
+        triple_slice = self.compatibility_data.get_triple_slice(target).astype(np.int64)
+        partner_index = self.compatibility_data.partner_index
+        branch1 = _Branch(triple_slice, target, candidates['parent1'],
+                          candidates['grandparent1'], candidates['grandparent2'], top_n, partner_index)
+        branch2 = _Branch(triple_slice, target, candidates['parent2'],
+                          candidates['grandparent3'], candidates['grandparent4'], top_n, partner_index)
+
+        parents1, parents2 = candidates['parent1'], candidates['parent2']
+        pair_row = self.pair_matrix[target]
+        bounds = (pair_row[parents1][:, None] + pair_row[parents2][None, :]
+                  + self.pair_matrix[np.ix_(parents1, parents2)]
+                  + branch1.best[:, None] + branch2.best[None, :])
+        invalid = ((parents1[:, None] == parents2[None, :]) | (parents1 == target)[:, None]
+                   | (parents2 == target)[None, :]
+                   | (branch1.best == _NEG_INF)[:, None] | (branch2.best == _NEG_INF)[None, :])
+        bounds[invalid] = _NEG_INF
+        return branch1, branch2, bounds
+
+    def _search(self, candidates: Dict[str, np.ndarray], top_n: int) -> List[PedigreeResult]:
+        """
+        分支定界求前N优的七马血统
+
+        先算出每个target下(P1, P2)的上界，按上界从高到低依次补全两个分支，
+        上界低于当前第N名分数的target和(P1, P2)整体剪去。同分时按七个位置的ID元组升序取舍。
+        第一遍计算的补全表保留到该target处理完毕，不重复计算。
+        """
+        top = _TopN(top_n)
+
+        targets = candidates['target']
+        target_bounds = np.full(len(targets), _NEG_INF, dtype=np.int64)
+        tables = []
+        for index, target in enumerate(targets.tolist()):
+            tables.append(self._target_tables(target, candidates, top_n))
+            bounds = tables[-1][2]
+            if bounds.size:
+                target_bounds[index] = bounds.max()
+
+        for index in np.argsort(-target_bounds, kind='stable').tolist():
+            bound = top.bound()
+            if target_bounds[index] == _NEG_INF or (bound is not None and target_bounds[index] < bound):
+                break
+            target = int(targets[index])
+            branch1, branch2, bounds = tables[index]
+            tables[index] = None
+
+            flat_bounds = bounds.ravel()
+            for flat_index in np.argsort(-flat_bounds, kind='stable').tolist():
+                upper = int(flat_bounds[flat_index])
+                bound = top.bound()
+                if upper == _NEG_INF or (bound is not None and upper < bound):
+                    break
+                i, j = divmod(flat_index, bounds.shape[1])
+                parent1, parent2 = int(branch1.parents[i]), int(branch2.parents[j])
+                base = upper - int(branch1.best[i]) - int(branch2.best[j])
+                second_best = int(branch2.best[j])
+
+                for value1, (grandparent1, grandparent2) in branch1.completions(i):
+                    bound = top.bound()
+                    if bound is not None and base + value1 + second_best < bound:
+                        break
+                    for value2, (grandparent3, grandparent4) in branch2.completions(j):
+                        score = base + value1 + value2
+                        bound = top.bound()
+                        if bound is not None and score < bound:
+                            break
+                        top.push(score, (target, parent1, parent2,
+                                         grandparent1, grandparent2, grandparent3, grandparent4))
+
+        return top.results()
+
+    def get_top_pedigrees(self, fixed: Dict[str, str] = None, top_n: int = 10, allowed=None,
+                          excluded: Iterable[str] = None) -> List[Tuple[Dict, int]]:
+        """
+        在部分位置固定的情况下，求前N优的七马血统补全
+
+        搜索只在各位置的候选池内进行，耗时随候选池大小而非全部马娘数量增长。
+
+        Args:
+            fixed: 固定的位置，如 {'target': '特别周', 'parent1': '无声铃鹿'}，位置名见SLOTS；
+                   未固定的位置可从全部马娘中选择
+            top_n: 返回前N个结果
+            allowed: 未固定位置的候选池，可以是{位置: 马娘列表}，也可以是所有未固定位置共用的马娘列表
+                     （如玩家拥有的马娘）
+            excluded: 未固定的位置都不能使用的马娘
+
+        Returns:
+            按分数降序排列的(七马字典, 相性点数)列表，同分时按ID升序；没有合法补全时为空列表
+        """
+        if top_n < 1:
+            raise ValueError("top_n必须为正整数")
+        candidates = self._slot_candidates(fixed, allowed, excluded)
+        with self.instrumentation.phase('pedigree_search', fixed=sorted(fixed or {}), top_n=top_n):
+            results = self._search(candidates, top_n)
+        return [(self._to_pedigree(ids), score) for score, ids in results]
+
+    def calculate_best_pedigree(self, fixed: Dict[str, str] = None, allowed=None,
+                                excluded: Iterable[str] = None) -> Tuple[Dict, int]:
+        """
+        在部分位置固定的情况下，求最优的七马血统补全
+
+        Args:
+            fixed: 固定的位置，见get_top_pedigrees
+            allowed: 未固定位置的候选池，见get_top_pedigrees
+            excluded: 未固定的位置都不能使用的马娘
+
+        Returns:
+            七马字典和最大相性点数的元组
+        """
+        results = self.get_top_pedigrees(fixed, top_n=1, allowed=allowed, excluded=excluded)
+        if not results:
+            raise ValueError("固定的位置无法补全为合法的七马血统")
+        return results[0]
+
+    def _to_pedigree(self, ids: Iterable[int]) -> Dict:
+        """将七个位置的ID转换为七马字典"""
+        return {slot: self.compatibility_data.get_uma_name(uma_id) for slot, uma_id in zip(SLOTS, ids)}
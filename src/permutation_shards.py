@@ -0,0 +1,210 @@
+"""
+按序号寻址的排列分片
+
+把 permutations(items, k) 的第r个排列（与itertools.permutations的生成顺序相同，从0开始）
+称为序号为r的排列。搜索空间由序号区间[start, end)描述，工作进程按区间起点直接定位、
+就地逐个生成，无需事先展开排列列表，内存占用与马娘数量无关，同一区间总能复现相同的排列。
+各角色的候选池不同时，搜索空间改为各候选池的笛卡尔积，同样按序号（itertools.product的生成顺序）寻址。
+"""
+
+import math
+from functools import lru_cache
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+
+def count_permutations(n: int, k: int) -> int:
+    """从n个元素中取k个的排列数"""
+    return math.perm(n, k)
+
+
+def _radices(n: int, k: int) -> List[int]:
+    """序号的混合进制各位的基数：n, n-1, ..., n-k+1"""
+    return [n - i for i in range(k)]
+
+
+def _digits_to_positions(digits: Sequence[int]) -> List[int]:
+    """将混合进制各位（第i位表示"剩余元素中的第几个"）转换为元素下标"""
+    positions = []
+    for digit in digits:
+        position = digit
+        for used in sorted(positions):
+            if position >= used:
+                position += 1
+        positions.append(position)
+    return positions
+
+
+def unrank_permutation(rank: int, items: Sequence, k: int) -> Tuple:
+    """
+    获取序号为rank的排列
+
+    Args:
+        rank: 排列序号，0 <= rank < count_permutations(len(items), k)
+        items: 元素序列
+        k: 排列长度
+
+    Returns:
+        排列元组
+    """
+    radices = _radices(len(items), k)
+    digits = []
+    for radix in reversed(radices):
+        rank, digit = divmod(rank, radix)
+        digits.append(digit)
+    digits.reverse()
+    return tuple(items[position] for position in _digits_to_positions(digits))
+
+
+def iter_permutation_range(items: Sequence, k: int, start: int, end: int) -> Iterator[Tuple]:
+    """
+    惰性生成序号在[start, end)内的排列
+
+    Args:
+        items: 元素序列
+        k: 排列长度
+        start: 起始序号（含）
+        end: 结束序号（不含）
+
+    Yields:
+        排列元组
+    """
+    if start >= end:
+        return
+    radices = _radices(len(items), k)
+    # 将起始序号展开为混合进制各位，之后逐个进位
+    rank = start
+    digits = [0] * k
+    for i in reversed(range(k)):
+        rank, digits[i] = divmod(rank, radices[i])
+
+    for _ in range(end - start):
+        yield tuple(items[position] for position in _digits_to_positions(digits))
+        for i in reversed(range(k)):
+            digits[i] += 1
+            if digits[i] < radices[i]:
+                break
+            digits[i] = 0
+
+
+def count_products(pools: Sequence[Sequence]) -> int:
+    """各候选池的笛卡尔积的元素数"""
+    return math.prod(len(pool) for pool in pools)
+
+
+def iter_product_range(pools: Sequence[Sequence], start: int, end: int) -> Iterator[Tuple]:
+    """
+    惰性生成序号在[start, end)内的笛卡尔积元素（与itertools.product(*pools)的顺序相同）
+
+    Args:
+        pools: 各位置的候选序列
+        start: 起始序号（含）
+        end: 结束序号（不含）
+
+    Yields:
+        元组，第i项取自pools[i]
+    """
+    if start >= end:
+        return
+    radices = [len(pool) for pool in pools]
+    rank = start
+    digits = [0] * len(pools)
+    for i in reversed(range(len(pools))):
+        rank, digits[i] = divmod(rank, radices[i])
+
+    for _ in range(end - start):
+        yield tuple(pool[digit] for pool, digit in zip(pools, digits))
+        for i in reversed(range(len(pools))):
+            digits[i] += 1
+            if digits[i] < radices[i]:
+                break
+            digits[i] = 0
+
+
+@lru_cache(maxsize=8)
+def _pair_template(count: int) -> np.ndarray:
+    """range(count)中互不相同的有序二元组，按字典序排列，形状为(count*(count-1), 2)"""
+    grid = np.indices((count, count)).reshape(2, -1)
+    return grid[:, grid[0] != grid[1]].T.copy()
+
+
+def unrank_block(start: int, end: int, n: int, k: int) -> np.ndarray:
+    """
+    向量化地获取序号在[start, end)内的全部排列（以元素下标表示）
+
+    序号区间按前k-2位分段：同一段内前k-2位相同，后两位依次取剩余元素的全部有序二元组，
+    因此每段只需解码一次前缀，后两位直接从缓存的二元组模板中切片映射，额外内存为O(n²)。
+
+    Args:
+        start: 起始序号（含）
+        end: 结束序号（不含）
+        n: 元素个数
+        k: 排列长度（至少为2）
+
+    Returns:
+        形状为(end - start, k)的下标数组
+    """
+    remaining_count = n - k + 2
+    suffix_size = remaining_count * (remaining_count - 1)
+    template = _pair_template(remaining_count)
+    prefix_radices = _radices(n, k - 2)
+
+    positions = np.empty((max(end - start, 0), k), dtype=np.int64)
+    row = 0
+    rank = start
+    while rank < end:
+        prefix_rank, offset = divmod(rank, suffix_size)
+        length = min(end - rank, suffix_size - offset)
+
+        # 解码前缀
+        digits = []
+        for radix in reversed(prefix_radices):
+            prefix_rank, digit = divmod(prefix_rank, radix)
+            digits.append(digit)
+        digits.reverse()
+        prefix = _digits_to_positions(digits)
+
+        remaining = np.delete(np.arange(n), prefix)
+        positions[row:row + length, :k - 2] = prefix
+        positions[row:row + length, k - 2:] = remaining[template[offset:offset + length]]
+        row += length
+        rank += length
+    return positions
+
+
+def unrank_product_block(start: int, end: int, sizes: Sequence[int]) -> np.ndarray:
+    """
+    向量化地获取序号在[start, end)内的全部笛卡尔积元素（以各候选池内的下标表示）
+
+    Args:
+        start: 起始序号（含）
+        end: 结束序号（不含）
+        sizes: 各候选池的大小
+
+    Returns:
+        形状为(end - start, len(sizes))的下标数组，第i列为pools[i]中的下标
+    """
+    ranks = np.arange(start, max(start, end), dtype=np.int64)
+    digits = np.empty((len(ranks), len(sizes)), dtype=np.int64)
+    for i in reversed(range(len(sizes))):
+        ranks, digits[:, i] = np.divmod(ranks, sizes[i])
+    return digits
+
+
+def make_shards(total: int, num_shards: int) -> List[Tuple[int, int]]:
+    """
+    将序号区间[0, total)均分为若干分片
+
+    Args:
+        total: 排列总数
+        num_shards: 分片数
+
+    Returns:
+        (start, end)区间列表
+    """
+    if total <= 0:
+        return []
+    num_shards = max(1, min(num_shards, total))
+    shard_size = math.ceil(total / num_shards)
+    return [(start, min(start + shard_size, total)) for start in range(0, total, shard_size)]
@@ -0,0 +1,225 @@
+"""
+持久化的五马查询结果缓存
+
+已证明最优的前N优结果以(parent, 搜索方式类别, 候选池指纹, 数据版本)为键保存在SQLite数据库中：
+同一查询、或要求数量更少的查询直接读取，不再搜索。普通条目按最近使用顺序（LRU）淘汰，
+总条数和总字节数都有上限；materialize_leaderboards写入的全名单排行榜固定保存，不参与淘汰。
+数据版本由CSV内容摘要和计算口径版本组成，打开缓存时清除其他版本的全部条目，CSV变化后自动失效。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from .compatibility import SCHEMA_VERSION, CompatibilityData
+from .five_horses_solver import IdResult
+
+# 普通条目的数量上限和总字节数上限（固定的排行榜不计入）
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 64 << 20
+
+# 数据库文件名（位于相性数据的缓存目录下）
+RESULT_CACHE_NAME = "results.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    parent TEXT NOT NULL,
+    method TEXT NOT NULL,
+    pool TEXT NOT NULL,
+    version TEXT NOT NULL,
+    top_n INTEGER NOT NULL,
+    pinned INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    last_access INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (parent, method, pool, version, top_n)
+)
+"""
+
+
+def data_version(compatibility_data: CompatibilityData) -> str:
+    """相性数据的版本：CSV内容摘要与计算口径版本"""
+    if compatibility_data.source_hash is None:
+        raise ValueError("相性数据没有CSV来源摘要，无法使用结果缓存")
+    return f"{compatibility_data.source_hash}:{SCHEMA_VERSION}"
+
+
+def pool_fingerprint(role_key) -> str:
+    """
+    候选池的指纹
+
+    Args:
+        role_key: 各角色可选ID的元组（见five_horses_calculator._role_key），None表示不限制
+
+    Returns:
+        不限制时为'all'，否则为SHA-256摘要的前32位十六进制字符
+    """
+    if role_key is None:
+        return 'all'
+    return hashlib.sha256(json.dumps(role_key).encode('utf-8')).hexdigest()[:32]
+
+
+class ResultCache:
+    def __init__(self, path: str, version: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        打开（或创建）结果缓存，并清除其他数据版本的条目
+
+        Args:
+            path: SQLite数据库文件路径
+            version: 当前的数据版本（见data_version）
+            max_entries: 普通条目的数量上限
+            max_bytes: 普通条目的总字节数上限
+        """
+        if max_entries < 1 or max_bytes < 1:
+            raise ValueError("max_entries和max_bytes必须为正整数")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+            self._connection.execute("DELETE FROM results WHERE version != ?", (version,))
+        row = self._connection.execute("SELECT MAX(last_access) FROM results").fetchone()
+        self._clock = row[0] or 0
+
+    @classmethod
+    def for_data(cls, compatibility_data: CompatibilityData, path: str = None, **kwargs) -> 'ResultCache':
+        """
+        为相性数据打开结果缓存
+
+        Args:
+            compatibility_data: 相性数据处理器实例
+            path: 数据库文件路径，默认为缓存目录下的RESULT_CACHE_NAME
+            **kwargs: 传给构造函数的其他参数
+
+        Returns:
+            结果缓存
+        """
+        if path is None:
+            path = os.path.join(compatibility_data.cache_dir, RESULT_CACHE_NAME)
+        return cls(path, data_version(compatibility_data), **kwargs)
+
+    def close(self):
+        """关闭数据库连接"""
+        self._connection.close()
+
+    def __enter__(self) -> 'ResultCache':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def get(self, parent: str, method: str, pool: str, top_n: int) -> Optional[Tuple[List[IdResult], Dict]]:
+        """
+        查找前N优结果：保存的数量不少于top_n的条目（含排行榜）都可以回答
+
+        Args:
+            parent: parent名称
+            method: 搜索方式类别（结果相同的搜索方式共用一个类别）
+            pool: 候选池指纹
+            top_n: 要求的结果数
+
+        Returns:
+            (前top_n个(分数, ID元组), 保存时的搜索报告)；未命中时为None
+        """
+        row = self._connection.execute(
+            "SELECT top_n, value FROM results WHERE parent = ? AND method = ? AND pool = ? AND version = ? "
+            "AND top_n >= ? ORDER BY top_n LIMIT 1",
+            (parent, method, pool, self.version, top_n)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._connection:
+            self._connection.execute(
+                "UPDATE results SET last_access = ? WHERE parent = ? AND method = ? AND pool = ? AND version = ? "
+                "AND top_n = ?", (self._tick(), parent, method, pool, self.version, row[0]))
+        value = json.loads(row[1])
+        results = [(score, tuple(ids)) for score, ids in value['results'][:top_n]]
+        return results, value['report']
+
+    def put(self, parent: str, method: str, pool: str, top_n: int, results: List[IdResult], report: Dict,
+            pinned: bool = False):
+        """
+        保存前N优结果（须为已证明最优的结果），超过上限时淘汰最久未使用的普通条目
+
+        已有相同键的条目时覆盖其结果；已固定保存的排行榜不会因普通写入而变回普通条目
+
+        Args:
+            parent: parent名称
+            method: 搜索方式类别
+            pool: 候选池指纹
+            top_n: 结果数
+            results: 按分数降序排列的(分数, ID元组)列表
+            report: 搜索报告
+            pinned: 是否为固定保存的排行榜（不参与淘汰）
+        """
+        value = json.dumps({'results': [[score, list(ids)] for score, ids in results], 'report': report},
+                           ensure_ascii=False)
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (parent, method, pool, version, top_n) DO UPDATE SET "
+                "pinned = MAX(pinned, excluded.pinned), size = excluded.size, "
+                "last_access = excluded.last_access, value = excluded.value",
+                (parent, method, pool, self.version, top_n, int(pinned), len(value.encode('utf-8')),
+                 self._tick(), value))
+            if not pinned:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未使用的普通条目，直到数量和字节数都不超过上限"""
+        count, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results WHERE pinned = 0").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT rowid, size FROM results WHERE pinned = 0 ORDER BY last_access").fetchall()
+        evicted = []
+        for rowid, row_size in rows:
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            count -= 1
+            size -= row_size
+        self._connection.executemany("DELETE FROM results WHERE rowid = ?", evicted)
+
+    def clear(self, pinned: bool = True):
+        """
+        清空缓存
+
+        Args:
+            pinned: 是否同时清除固定保存的排行榜
+        """
+        with self._connection:
+            if pinned:
+                self._connection.execute("DELETE FROM results")
+            else:
+                self._connection.execute("DELETE FROM results WHERE pinned = 0")
+
+    def stats(self) -> Dict:
+        """
+        缓存统计
+
+        Returns:
+            {'entries': 普通条目数, 'bytes': 普通条目总字节数, 'leaderboards': 排行榜条目数,
+             'hits': 本次打开后的命中次数, 'misses': 未命中次数}
+        """
+        entries, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results WHERE pinned = 0").fetchone()
+        leaderboards = self._connection.execute("SELECT COUNT(*) FROM results WHERE pinned = 1").fetchone()[0]
+        return {'entries': entries, 'bytes': size, 'leaderboards': leaderboards,
+                'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,496 @@
+"""
+本地查询服务
+
+相性表只在服务启动时加载一次，之后通过HTTP/JSON（TCP或Unix套接字）提供查询：
+
+- /pair、/triple、/seven：两两、三三相性和七马相性点数，直接在事件循环中计算
+- /best、/top：五马最优组合和前N优组合，交给常驻工作进程计算（共享同一份相性表）
+- /stats：各端点的请求数和延迟分位数，以及合并的重复查询数
+- /health：服务状态
+
+参数可放在查询字符串中（名单用逗号分隔），也可用POST提交JSON对象。
+参数完全相同的搜索正在进行时，新的请求直接等待同一个结果，不重复计算。
+
+用法：python -m src.server --csv data/相性数据表.csv --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .calculator import CompatibilityCalculator, SLOTS
+from .compatibility import CompatibilityData
+from .five_horses_calculator import EXACT_SOLVERS, HEURISTIC_SOLVERS, FiveHorsesCalculator
+from .five_horses_solver import ROLES
+from .instrumentation import Instrumentation
+from .shared_tables import SharedTables, get_worker_data, init_worker
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 五马搜索的默认方式（brute_force需要自己的进程池，服务中不可用）
+DEFAULT_SEARCH_METHOD = 'branch_and_bound'
+SERVICE_METHODS = tuple(EXACT_SOLVERS) + tuple(HEURISTIC_SOLVERS)
+
+# 每个端点保留最近多少次请求的延迟用于计算分位数
+LATENCY_WINDOW = 10000
+# 报告的延迟分位数
+PERCENTILES = (50, 90, 99)
+
+# 请求体的大小上限（字节）
+MAX_BODY_SIZE = 1 << 20
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    504: 'Gateway Timeout'
+}
+
+# 工作进程中的五马计算器（首次搜索时创建）
+_worker_calculator: Optional[FiveHorsesCalculator] = None
+
+
+def _warm_worker() -> int:
+    """预热工作进程：确认相性表已挂载"""
+    return get_worker_data().num_umas
+
+
+def _search_worker(kind: str, params: Dict) -> Dict:
+    """
+    在工作进程中执行五马搜索
+
+    Args:
+        kind: 'best'或'top'
+        params: 已规范化的搜索参数（见QueryService._search_params）
+
+    Returns:
+        可直接序列化为JSON的结果
+    """
+    global _worker_calculator
+    if _worker_calculator is None:
+        _worker_calculator = FiveHorsesCalculator(get_worker_data())
+    calculator = _worker_calculator
+    options = {key: params[key] for key in ('method', 'allowed', 'excluded', 'timeout', 'budget')}
+    if kind == 'best':
+        combination, score = calculator.calculate_best_combination(params['parent'], verbose=False, **options)
+        return {'combination': combination, 'score': score, 'report': calculator.search_report}
+    results = calculator.get_top_combinations(params['parent'], top_n=params['top_n'], verbose=False, **options)
+    return {
+        'results': [{'combination': combination, 'score': score} for combination, score in results],
+        'report': calculator.search_report
+    }
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法分位数（sorted_values须已升序排列且非空）"""
+    rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """
+        初始化延迟统计
+
+        Args:
+            window: 每个端点保留的最近请求数
+        """
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float):
+        """记录一次请求的延迟"""
+        self.samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        各端点的请求数和延迟分位数
+
+        Returns:
+            {端点: {'count': 请求总数, 'p50_ms': ..., 'p90_ms': ..., 'p99_ms': ..., 'max_ms': ...}}
+        """
+        summary = {}
+        for endpoint, samples in self.samples.items():
+            values = sorted(samples)
+            stats = {'count': self.counts[endpoint]}
+            for q in PERCENTILES:
+                stats[f'p{q}_ms'] = _percentile(values, q) * 1000
+            stats['max_ms'] = values[-1] * 1000
+            summary[endpoint] = stats
+        return summary
+
+
+def _name_list(value, name: str) -> Optional[List[str]]:
+    """将逗号分隔的字符串或JSON数组转换为马娘名称列表"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return list(value)
+    raise ValueError(f"参数 '{name}' 应为马娘名称列表")
+
+
+def _number(params: Dict, name: str, kind: type, default=None):
+    """读取数值参数"""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 '{name}' 应为{'整数' if kind is int else '数值'}") from None
+
+
+def _required(params: Dict, name: str) -> str:
+    """读取必需的字符串参数"""
+    value = params.get(name)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"缺少参数 '{name}'")
+    return value
+
+
+class QueryService:
+    def __init__(self, compatibility_data: CompatibilityData, num_workers: int = None,
+                 instrumentation: Instrumentation = None):
+        """
+        初始化查询服务（需调用start或使用with语句启动工作进程）
+
+        Args:
+            compatibility_data: 已加载的相性数据处理器实例
+            num_workers: 执行五马搜索的工作进程数，默认为CPU核心数
+            instrumentation: 阶段计时与指标收集器，默认与相性数据处理器共用
+        """
+        self.compatibility_data = compatibility_data
+        self.calculator = CompatibilityCalculator(compatibility_data)
+        self.instrumentation = instrumentation or compatibility_data.instrumentation
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.latency = LatencyTracker()
+        # 合并到正在进行的相同查询的请求数
+        self.coalesced = 0
+        # {(端点, 规范化参数): 正在进行的查询}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._shared_tables: Optional[SharedTables] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._handlers = {
+            'pair': self._pair,
+            'triple': self._triple,
+            'seven': self._seven,
+            'explain': self._explain,
+            'best': self._best,
+            'top': self._top,
+            'stats': self._stats,
+            'health': self._health
+        }
+
+    @property
+    def running(self) -> bool:
+        """工作进程是否已启动"""
+        return self._executor is not None
+
+    def start(self) -> 'QueryService':
+        """
+        放置共享相性表并启动、预热工作进程（重复调用无副作用）
+
+        Returns:
+            服务自身
+        """
+        if self.running:
+            return self
+        with self.instrumentation.phase('service_start', workers=self.num_workers):
+            self._shared_tables = SharedTables(self.compatibility_data)
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker,
+                                                     initargs=(self._shared_tables.spec,))
+                for future in [self._executor.submit(_warm_worker) for _ in range(self.num_workers)]:
+                    future.result()
+            except Exception:
+                self.close()
+                raise
+        return self
+
+    def close(self):
+        """关闭工作进程并释放共享相性表（重复调用无副作用）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._shared_tables is not None:
+            self._shared_tables.close()
+            self._shared_tables = None
+
+    def __enter__(self) -> 'QueryService':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def query(self, endpoint: str, params: Dict) -> Dict:
+        """
+        执行一次查询并记录延迟
+
+        Args:
+            endpoint: 端点名（不含斜杠），如'pair'、'top'
+            params: 查询参数
+
+        Returns:
+            可直接序列化为JSON的结果
+
+        Raises:
+            ValueError: 端点不存在或参数错误
+            TimeoutError: 搜索在找到任何组合之前超时
+        """
+        handler = self._handlers.get(endpoint)
+        if handler is None:
+            raise ValueError(f"未知的端点 '/{endpoint}'")
+        start = time.perf_counter()
+        try:
+            return await handler(params)
+        finally:
+            self.latency.record(endpoint, time.perf_counter() - start)
+
+    def _check_umas(self, umas: List[str]):
+        """检查马娘名称（不存在时抛出ValueError）"""
+        for uma in umas:
+            self.compatibility_data.get_uma_id(uma)
+
+    async def _pair(self, params: Dict) -> Dict:
+        umas = [_required(params, 'uma1'), _required(params, 'uma2')]
+        self._check_umas(umas)
+        return {'umas': umas, 'score': self.compatibility_data.get_pair_compatibility(*umas)}
+
+    async def _triple(self, params: Dict) -> Dict:
+        umas = [_required(params, 'uma1'), _required(params, 'uma2'), _required(params, 'uma3')]
+        self._check_umas(umas)
+        return {'umas': umas, 'score': self.compatibility_data.get_triple_compatibility(*umas)}
+
+    async def _seven(self, params: Dict) -> Dict:
+        pedigree = {slot: _required(params, slot) for slot in SLOTS}
+        self._check_umas(list(pedigree.values()))
+        return {'pedigree': pedigree, 'score': self.calculator.calculate_compatibility_score(**pedigree)}
+
+    async def _explain(self, params: Dict) -> Dict:
+        pedigree = {slot: _required(params, slot) for slot in SLOTS}
+        self._check_umas(list(pedigree.values()))
+        return dict(self.calculator.explain(**pedigree), pedigree=pedigree)
+
+    async def _best(self, params: Dict) -> Dict:
+        return await self._search('best', self._search_params(params, top_n=False))
+
+    async def _top(self, params: Dict) -> Dict:
+        return await self._search('top', self._search_params(params, top_n=True))
+
+    async def _stats(self, params: Dict) -> Dict:
+        return {
+            'latency': self.latency.summary(),
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+            'workers': self.num_workers
+        }
+
+    async def _health(self, params: Dict) -> Dict:
+        return {'status': 'ok' if self.running else 'stopped', 'num_umas': self.compatibility_data.num_umas}
+
+    def _search_params(self, params: Dict, top_n: bool) -> Dict:
+        """规范化五马搜索参数，使等价的请求得到相同的合并键"""
+        parent = _required(params, 'parent')
+        self._check_umas([parent])
+        method = params.get('method') or DEFAULT_SEARCH_METHOD
+        if method not in SERVICE_METHODS:
+            raise ValueError(f"服务不支持搜索方式 '{method}'，可选: {', '.join(SERVICE_METHODS)}")
+
+        allowed = params.get('allowed')
+        if isinstance(allowed, dict):
+            unknown = sorted(set(allowed) - set(ROLES))
+            if unknown:
+                raise ValueError(f"未知的角色: {', '.join(unknown)}")
+            allowed = {role: sorted(_name_list(allowed[role], 'allowed')) for role in ROLES if role in allowed}
+        elif allowed is not None:
+            allowed = sorted(_name_list(allowed, 'allowed'))
+        excluded = _name_list(params.get('excluded'), 'excluded')
+
+        normalized = {
+            'parent': parent,
+            'method': method,
+            'allowed': allowed,
+            'excluded': sorted(excluded) if excluded is not None else None,
+            'timeout': _number(params, 'timeout', float),
+            'budget': _number(params, 'budget', int)
+        }
+        if top_n:
+            normalized['top_n'] = _number(params, 'top_n', int, 10)
+            if normalized['top_n'] <= 0:
+                raise ValueError("top_n必须为正整数")
+        return normalized
+
+    async def _search(self, kind: str, params: Dict) -> Dict:
+        """在工作进程中搜索；相同参数的搜索正在进行时等待同一个结果"""
+        if not self.running:
+            raise RuntimeError("服务尚未启动，请先调用start()")
+        key = (kind, json.dumps(params, sort_keys=True, ensure_ascii=False))
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            self.instrumentation.count('coalesced')
+            # shield：一个等待者断开时不影响其他等待者
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _search_worker, kind, params)
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个HTTP连接（支持keep-alive）"""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError as e:
+                    await _write_response(writer, 400, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self._dispatch(method, target, body)
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict]:
+        """解析参数并执行查询，返回(状态码, 响应内容)"""
+        url = urlsplit(target)
+        endpoint = url.path.strip('/')
+        if endpoint not in self._handlers:
+            return 404, {'error': f"未知的端点 '{url.path}'"}
+        params = dict(parse_qsl(url.query))
+        try:
+            if method == 'POST' and body:
+                payload = json.loads(body.decode('utf-8'))
+                if not isinstance(payload, dict):
+                    raise ValueError("请求体应为JSON对象")
+                params.update(payload)
+            elif method not in ('GET', 'POST'):
+                raise ValueError(f"不支持的请求方法 '{method}'")
+            return 200, await self.query(endpoint, params)
+        except TimeoutError as e:
+            return 504, {'error': str(e)}
+        except ValueError as e:
+            # 包括JSON解析错误（json.JSONDecodeError是ValueError的子类）
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                    unix_path: str = None) -> asyncio.AbstractServer:
+        """
+        开始监听（须在事件循环中调用，服务须已启动）
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            unix_path: Unix套接字路径，指定时不监听TCP端口
+
+        Returns:
+            asyncio服务器对象
+        """
+        self.start()
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """
+    读取一个HTTP请求
+
+    Returns:
+        (方法, 请求目标, 小写名称的请求头, 请求体)，连接已关闭时为None
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("请求行格式错误")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError("Content-Length格式错误") from None
+    if length > MAX_BODY_SIZE:
+        raise ValueError(f"请求体超过{MAX_BODY_SIZE}字节")
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method.upper(), target, headers, body
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool):
+    """写出JSON响应"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def _serve_forever(service: QueryService, host: str, port: int, unix_path: str = None):
+    """启动服务并一直运行"""
+    server = await service.serve(host, port, unix_path)
+    address = unix_path if unix_path is not None else "http://{}:{}".format(*server.sockets[0].getsockname()[:2])
+    service.instrumentation.log(f"查询服务已启动: {address}（工作进程数: {service.num_workers}）")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: List[str] = None):
+    """命令行入口：加载相性表后启动查询服务"""
+    parser = argparse.ArgumentParser(description="赛马娘相性本地查询服务")
+    parser.add_argument("--csv", default="data/相性数据表.csv", help="相性数据CSV路径")
+    parser.add_argument("--cache-dir", default="data/cache", help="二进制缓存目录")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--unix-socket", default=None, help="改为监听Unix套接字")
+    parser.add_argument("--workers", type=int, default=None, help="五马搜索的工作进程数，默认为CPU核心数")
+    parser.add_argument("--quiet", action="store_true", help="不打印任何信息")
+    args = parser.parse_args(argv)
+
+    instrumentation = Instrumentation(quiet=args.quiet)
+    data = CompatibilityData(args.csv, cache_dir=args.cache_dir, instrumentation=instrumentation)
+    with QueryService(data, num_workers=args.workers) as service:
+        try:
+            asyncio.run(_serve_forever(service, args.host, args.port, args.unix_socket))
+        except KeyboardInterrupt:
+            instrumentation.log("查询服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+进程池共享的相性表
+
+相性表只在主进程中放置一次：普通数组复制到共享内存，已经内存映射的缓存数组直接共享映射文件。
+进程池的初始化函数按名称挂载这些表，之后每个任务只需携带分片序号等少量参数，
+进程数增加时不会复制出多份相性表。
+"""
+
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+from .compatibility import CompatibilityData
+from .group_bitset import GroupBitsets
+from .triple_store import TripleStore
+
+# 当前工作进程挂载的相性数据（由init_worker设置）
+_worker_data: Optional[CompatibilityData] = None
+# 工作进程持有的共享内存句柄，须与数组视图同生命周期
+_worker_handles = []
+
+
+class SharedTables:
+    def __init__(self, compatibility_data: CompatibilityData):
+        """
+        将相性表放入共享内存（或共享其映射文件）
+
+        Args:
+            compatibility_data: 相性数据处理器实例
+        """
+        self._blocks = []
+        arrays = {'pair_matrix': compatibility_data.pair_matrix}
+        if compatibility_data.triple_store is not None:
+            arrays.update(compatibility_data.triple_store.to_arrays())
+        arrays.update(compatibility_data.group_bitsets.to_arrays())
+
+        array_specs = {}
+        for name, array in arrays.items():
+            if isinstance(array, np.memmap) and array.filename is not None:
+                # 已映射的缓存文件：工作进程直接映射同一文件，共享页缓存
+                array_specs[name] = ('file', array.filename, array.offset, array.dtype.str, array.shape)
+                continue
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self._blocks.append(block)
+            array_specs[name] = ('shm', block.name, 0, array.dtype.str, array.shape)
+
+        # 规格只包含名称、类型和形状，体积与相性表大小无关
+        self.spec = {
+            'uma_list': list(compatibility_data.uma_list),
+            'arrays': array_specs
+        }
+
+    def close(self):
+        """释放共享内存（须在进程池关闭后调用）"""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self) -> 'SharedTables':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """按名称挂载共享内存，且不让资源跟踪器因本进程退出而回收它（由创建者负责释放）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13以前没有track参数，挂载时总会登记到资源跟踪器。进程池的工作进程（fork、spawn、
+        # forkserver均如此）沿用创建者的资源跟踪器，重复登记没有影响，创建者unlink时注销一次即可；
+        # 在这里注销会删掉创建者自己的登记，使其unlink时资源跟踪器报KeyError
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_shared_tables(spec: Dict) -> CompatibilityData:
+    """
+    按规格挂载共享的相性表，返回只读的相性数据
+
+    Args:
+        spec: SharedTables.spec
+
+    Returns:
+        CompatibilityData实例，其数组直接引用共享内存或映射文件
+    """
+    arrays = {}
+    for name, (kind, location, offset, dtype, shape) in spec['arrays'].items():
+        if kind == 'file':
+            arrays[name] = np.memmap(location, dtype=np.dtype(dtype), mode='r', offset=offset, shape=tuple(shape))
+        else:
+            block = _attach_shared_memory(location)
+            _worker_handles.append(block)
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            arrays[name] = array
+
+    uma_list = spec['uma_list']
+    group_bitsets = GroupBitsets.from_arrays(
+        arrays['group_ids'],
+        arrays['group_scores'],
+        arrays['group_member_indptr'],
+        arrays['group_member_indices'],
+        len(uma_list)
+    )
+    triple_store = TripleStore.from_arrays(arrays, len(uma_list)) if 'triple_values' in arrays else None
+    return CompatibilityData.from_tables(uma_list, arrays['pair_matrix'], triple_store, group_bitsets)
+
+
+def init_worker(spec: Dict):
+    """进程池初始化函数：挂载共享的相性表"""
+    global _worker_data
+    _worker_data = attach_shared_tables(spec)
+
+
+def get_worker_data() -> CompatibilityData:
+    """获取当前工作进程挂载的相性数据"""
+    if _worker_data is None:
+        raise RuntimeError("当前进程尚未挂载共享相性表，请使用init_worker作为进程池的初始化函数")
+    return _worker_data
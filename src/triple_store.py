@@ -0,0 +1,264 @@
+"""
+规范化的三三相性表
+
+三三相性与三只马娘的顺序无关，因此每个三元组只按升序ID(i < j < k)保存一次，
+键为组合数系统中的序号 C(k, 3) + C(j, 2) + i（0 ~ C(N, 3) - 1），含重复马娘的三元组不保存。
+非零项较少时只保存按键排序的(键, 分数)，查询用二分查找；非零项占大多数时（真实数据中
+几乎所有三元组都共享"性别"、"马场组"等大组）键比分数更占空间，此时按序号直接保存全部分数，
+序号即下标。两种布局由from_entries按体积自动选择，分数使用能容纳最大值的最小整数类型。
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .group_bitset import GroupBitsets
+
+
+def _comb3(x):
+    """C(x, 3)，x可以是整数或int64数组"""
+    return x * (x - 1) * (x - 2) // 6
+
+
+def _comb2(x):
+    """C(x, 2)，x可以是整数或int64数组"""
+    return x * (x - 1) // 2
+
+
+def canonical_keys(id1, id2, id3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量计算三元组的规范键（参数可广播）
+
+    Args:
+        id1, id2, id3: 马娘ID（整数或数组）
+
+    Returns:
+        (int64键数组, 是否为三只不同马娘的布尔数组)；含重复马娘的位置键无意义
+    """
+    id1, id2, id3 = (np.asarray(ids, dtype=np.int64) for ids in (id1, id2, id3))
+    low = np.minimum(np.minimum(id1, id2), id3)
+    high = np.maximum(np.maximum(id1, id2), id3)
+    mid = id1 + id2 + id3 - low - high
+    return _comb3(high) + _comb2(mid) + low, (low < mid) & (mid < high)
+
+
+def triple_entries(group_bitsets: GroupBitsets, uma_id: int,
+                   uma_ids: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算以uma_id为最小ID的全部非零三三相性
+
+    Args:
+        group_bitsets: 组掩码
+        uma_id: 马娘ID
+        uma_ids: 另外两只马娘的候选ID（升序），默认为全部马娘
+
+    Returns:
+        (int64规范键数组, int32分数数组)
+    """
+    if uma_ids is None:
+        uma_ids = np.arange(group_bitsets.num_umas)
+    higher = np.asarray(uma_ids, dtype=np.int64)
+    higher = higher[higher > uma_id]
+    matrix = np.triu(group_bitsets.triple_slice(uma_id, higher), k=1)
+    rows, columns = np.nonzero(matrix)
+    keys = _comb3(higher[columns]) + _comb2(higher[rows]) + uma_id
+    return keys, matrix[rows, columns].astype(np.int32)
+
+
+def _value_dtype(max_value: int) -> np.dtype:
+    """能容纳0 ~ max_value的最小整数类型"""
+    for dtype in (np.uint8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class TripleStore:
+    def __init__(self, num_umas: int, values: np.ndarray, keys: Optional[np.ndarray] = None):
+        """
+        初始化三三相性表（通常由from_entries或from_arrays创建）
+
+        Args:
+            num_umas: 马娘总数
+            values: keys为None时为按规范键排列的全部分数（长度C(N, 3)），否则为与keys对应的非零分数
+            keys: 升序排列的非零项规范键，None表示按序号保存全部分数
+        """
+        self.num_umas = num_umas
+        self.values = values
+        self.keys = keys
+        # C(x, 3)和C(x, 2)的查找表（x = 0 ~ N），逐个查询时使用Python列表
+        bounds = np.arange(num_umas + 1, dtype=np.int64)
+        self._comb3 = _comb3(bounds)
+        self._comb2 = _comb2(bounds)
+        self._comb3_list = self._comb3.tolist()
+        self._comb2_list = self._comb2.tolist()
+
+    @classmethod
+    def from_entries(cls, num_umas: int, keys: np.ndarray, values: np.ndarray) -> 'TripleStore':
+        """
+        由非零项构建，选择体积更小的布局
+
+        Args:
+            num_umas: 马娘总数
+            keys: 规范键（不要求有序，不能重复）
+            values: 与keys对应的分数（零分项会被丢弃）
+
+        Returns:
+            三三相性表
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        values = np.asarray(values)
+        nonzero = values != 0
+        keys, values = keys[nonzero], values[nonzero]
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+
+        total = _comb3(num_umas)
+        value_dtype = _value_dtype(int(values.max()) if len(values) else 0)
+        key_dtype = np.dtype(np.int32) if total <= np.iinfo(np.int32).max else np.dtype(np.int64)
+        if total * value_dtype.itemsize <= len(keys) * (key_dtype.itemsize + value_dtype.itemsize):
+            packed = np.zeros(total, dtype=value_dtype)
+            packed[keys] = values
+            return cls(num_umas, packed)
+        return cls(num_umas, values.astype(value_dtype), keys.astype(key_dtype))
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], num_umas: int) -> 'TripleStore':
+        """由to_arrays导出的数组重建"""
+        return cls(num_umas, arrays['triple_values'], arrays.get('triple_keys'))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """导出为数组（分数，以及稀疏布局时的键），用于二进制缓存和共享内存"""
+        arrays = {'triple_values': self.values}
+        if self.keys is not None:
+            arrays['triple_keys'] = self.keys
+        return arrays
+
+    @property
+    def nbytes(self) -> int:
+        """占用的字节数"""
+        return self.values.nbytes + (self.keys.nbytes if self.keys is not None else 0)
+
+    def __len__(self) -> int:
+        """非零项数"""
+        if self.keys is not None:
+            return len(self.keys)
+        return int(np.count_nonzero(self.values))
+
+    def score(self, id1: int, id2: int, id3: int) -> int:
+        """
+        查询单个三元组（与顺序无关），含重复马娘时为0
+
+        逐个查询时走纯Python路径，避免为三个整数构造数组
+        """
+        if id1 > id2:
+            id1, id2 = id2, id1
+        if id2 > id3:
+            id2, id3 = id3, id2
+        if id1 > id2:
+            id1, id2 = id2, id1
+        if id1 == id2 or id2 == id3:
+            return 0
+        key = self._comb3_list[id3] + self._comb2_list[id2] + id1
+        if self.keys is None:
+            return self.values.item(key)
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys.item(position) == key:
+            return self.values.item(position)
+        return 0
+
+    def lookup(self, id1, id2, id3) -> np.ndarray:
+        """
+        批量查询三三相性（参数可广播，与顺序无关）
+
+        Args:
+            id1, id2, id3: 马娘ID数组
+
+        Returns:
+            广播后形状的int32分数数组，含重复马娘的位置为0
+        """
+        id1, id2, id3 = (np.asarray(ids, dtype=np.int64) for ids in (id1, id2, id3))
+        low = np.minimum(np.minimum(id1, id2), id3)
+        high = np.maximum(np.maximum(id1, id2), id3)
+        mid = id1 + id2 + id3 - low - high
+        keys = self._comb3.take(high) + self._comb2.take(mid) + low
+        valid = (low < mid) & (mid < high)
+        return self._gather(keys, valid)
+
+    def _gather(self, keys: np.ndarray, valid: np.ndarray = None) -> np.ndarray:
+        """
+        按规范键取分数
+
+        Args:
+            keys: 规范键数组（valid为False的位置可以越界）
+            valid: 有效位置，None表示全部有效
+
+        Returns:
+            int32分数数组，无效位置和不存在的键为0
+        """
+        if len(self.values) == 0:
+            return np.zeros(keys.shape, dtype=np.int32)
+        if self.keys is None:
+            if valid is not None:
+                keys = np.minimum(keys, len(self.values) - 1)
+            values = self.values.take(keys).astype(np.int32)
+        else:
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            values = np.where(self.keys[positions] == keys, self.values[positions], 0).astype(np.int32)
+        if valid is not None:
+            values *= valid
+        return values
+
+    def slice(self, uma_id: int, uma_ids: np.ndarray = None) -> np.ndarray:
+        """
+        指定马娘参与的三三相性切片
+
+        Args:
+            uma_id: 马娘ID
+            uma_ids: 只取这些马娘构成的子切片，默认为全部马娘
+
+        Returns:
+            矩阵，第(j, k)个元素为三三相性(uma_id, uma_ids[j], uma_ids[k])；含重复马娘的位置为0
+        """
+        if uma_ids is not None:
+            uma_ids = np.asarray(uma_ids, dtype=np.int64)
+            return self.lookup(uma_id, uma_ids[:, None], uma_ids[None, :])
+
+        # 整个切片按(j, k)与uma_id的大小关系分块，每块的键是一行向量与一列向量之和，只计算j < k的部分
+        n = self.num_umas
+        low = np.arange(uma_id, dtype=np.int64)
+        high = np.arange(uma_id + 1, n, dtype=np.int64)
+        keys = np.zeros((n, n), dtype=np.int64)
+        # j < k < uma_id
+        keys[:uma_id, :uma_id] = (self._comb3[uma_id] + low)[:, None] + self._comb2[low][None, :]
+        # j < uma_id < k
+        keys[:uma_id, uma_id + 1:] = (self._comb2[uma_id] + low)[:, None] + self._comb3[high][None, :]
+        # uma_id < j < k
+        keys[uma_id + 1:, uma_id + 1:] = (self._comb2[high] + uma_id)[:, None] + self._comb3[high][None, :]
+        # j >= k的部分随后被丢弃，其键可能越界，取值前截断
+        np.minimum(keys, max(self._comb3[n] - 1, 0), out=keys)
+        matrix = np.triu(self._gather(keys), k=1)
+        matrix[uma_id, :] = 0
+        matrix[:, uma_id] = 0
+        return matrix + matrix.T
+
+    def entries(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全部非零项
+
+        Returns:
+            (形状为(项数, 3)的升序ID数组, 分数数组)
+        """
+        if self.keys is None:
+            keys = np.flatnonzero(self.values)
+            values = np.asarray(self.values)[keys]
+        else:
+            keys = np.asarray(self.keys, dtype=np.int64)
+            values = np.asarray(self.values)
+        # 组合数系统的逆变换：依次取最大的k、j使C(k, 3)、C(j, 2)不超过剩余的序号
+        bounds = np.arange(self.num_umas + 1, dtype=np.int64)
+        high = np.searchsorted(_comb3(bounds), keys, side='right') - 1
+        rest = keys - _comb3(high)
+        mid = np.searchsorted(_comb2(bounds), rest, side='right') - 1
+        low = rest - _comb2(mid)
+        return np.stack([low, mid, high], axis=1), values
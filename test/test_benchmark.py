@@ -0,0 +1,70 @@
+"""
+性能基准测试脚本的测试（使用很小的合成数据，只检查流程和结果格式）
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.benchmark import generate_dataset, run_benchmarks, compare_results, COLD_START_PHASES
+from src.compatibility import CompatibilityData
+
+
+def test_generate_dataset():
+    """测试合成数据可复现，且能被相性数据处理器读取"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path1 = os.path.join(tmp, "a", "相性数据表.csv")
+        path2 = os.path.join(tmp, "b", "相性数据表.csv")
+        umas = generate_dataset(path1, num_umas=20, num_groups=60, size_weights={2: 3, 5: 1, 40: 1},
+                                score_weights={1: 1, 3: 1}, seed=7)
+        generate_dataset(path2, num_umas=20, num_groups=60, size_weights={2: 3, 5: 1, 40: 1},
+                         score_weights={1: 1, 3: 1}, seed=7)
+        with open(path1, "rb") as f1, open(path2, "rb") as f2:
+            assert f1.read() == f2.read()
+
+        data = CompatibilityData(path1, cache_dir=os.path.join(tmp, "cache"), num_processes=1)
+        assert set(data.uma_list) <= set(umas)
+        assert len(data.df) == 60
+        assert set(data.df['分数']) <= {1, 3}
+        # 超过马娘数的组大小按马娘数计
+        assert max(len(members) for members in data.df['成员']) <= 20
+
+        try:
+            generate_dataset(path1, num_umas=1)
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+
+def test_run_benchmarks():
+    """测试各阶段都有计时结果，且结果可保存为JSON并互相对比"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "相性数据表.csv")
+        generate_dataset(csv_path, num_umas=16, num_groups=50, seed=1)
+        report = run_benchmarks(csv_path, os.path.join(tmp, "work"), repeat=1, num_parents=2, top_n=3,
+                                num_queries=50, num_bulk_rows=1000, verbose=False)
+
+        for name in ("csv_ingest", "pair_triple_build", "cache_save", "cache_load", "seven_score", "score_many",
+                     "five_best[branch_and_bound]", "five_top3[decomposition]", "pedigree_top3[target]"):
+            assert report['results'][name]['seconds'] >= 0, name
+        assert report['results']['score_many']['ops'] == 1000
+        # 冷启动各阶段来自公开构造函数记录的阶段，不超过整个构造过程的用时
+        for name in COLD_START_PHASES:
+            assert 0 <= report['results'][name]['seconds'] <= report['results']['cold_start_total']['seconds'], name
+        assert report['results']['pair_triple_build']['seconds'] > 0
+        assert report['dataset']['num_groups'] == 50
+
+        report = json.loads(json.dumps(report))
+        ratios = compare_results(report, report)
+        assert set(ratios) == set(report['results'])
+        assert all(ratio is None or abs(ratio - 1) < 1e-9 for ratio in ratios.values())
+
+
+if __name__ == "__main__":
+    test_generate_dataset()
+    test_run_benchmarks()
+    print("性能基准测试脚本测试完成！")
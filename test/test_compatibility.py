@@ -0,0 +1,417 @@
+"""
+相性数据处理器测试脚本（使用小规模的合成数据，运行速度快）
+"""
+
+import sys
+import os
+import subprocess
+import tempfile
+from itertools import combinations
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.compatibility import CompatibilityData
+from src.calculator import CompatibilityCalculator
+from src.shared_tables import SharedTables, attach_shared_tables
+from src.group_bitset import GroupBitsets
+from src.triple_store import TripleStore, canonical_keys, triple_entries
+
+# 小规模合成数据：组号, 分数, 分类, 补充, 成员
+SAMPLE_GROUPS = [
+    (101, 2, "学年", "1年级", "甲, 乙, 丙, 丁"),
+    (102, 2, "学年", "2年级", "戊, 己, 庚"),
+    (201, 3, "寝室", "", "甲, 乙"),
+    (202, 1, "寝室", "", "丙, 戊, 无"),
+    (301, 5, "血缘", "", "乙, 丙, 己"),
+    (401, 1, "同生日", "", "甲, 丁, 庚, 辛"),
+    (501, 4, "组合", "", "辛, 壬, 癸, 甲"),
+    (601, 1, "", "", "癸"),
+]
+
+
+def write_sample_csv(directory: str, groups=SAMPLE_GROUPS) -> str:
+    """将合成数据写成与相性数据表.csv相同格式的文件，返回文件路径"""
+    csv_path = os.path.join(directory, "相性数据表.csv")
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_id, score, category, extra, members in groups:
+            f.write(f'{group_id},{score},{category},{extra},"{members}"\n')
+    return csv_path
+
+
+def naive_score(groups, umas) -> int:
+    """直接按定义计算若干马娘的共同组分数和，作为对照"""
+    total = 0
+    for _, score, _, _, members in groups:
+        names = {name.strip() for name in members.split(",")}
+        if all(uma in names for uma in umas):
+            total += score
+    return total
+
+
+def dense_triples(data: CompatibilityData) -> np.ndarray:
+    """展开为N×N×N的三三相性数组，用于比较"""
+    return np.stack([data.get_triple_slice(uma_id) for uma_id in range(data.num_umas)])
+
+
+def test_uma_ids_and_pair_matrix():
+    """测试马娘ID驻留与两两相性矩阵"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1)
+
+        # ID连续且与名称一一对应，"无"不属于马娘
+        assert data.num_umas == 10
+        assert "无" not in data.uma_to_id
+        for uma_id, uma in enumerate(data.uma_list):
+            assert data.get_uma_id(uma) == uma_id
+            assert data.get_uma_name(uma_id) == uma
+
+        # 矩阵对称、对角线为0，且与字符串接口、原始定义一致
+        assert (data.pair_matrix == data.pair_matrix.T).all()
+        assert (data.pair_matrix.diagonal() == 0).all()
+        for uma1, uma2 in combinations(data.uma_list, 2):
+            expected = naive_score(SAMPLE_GROUPS, (uma1, uma2))
+            assert data.get_pair_compatibility(uma1, uma2) == expected
+            assert data.get_pair_compatibility_by_id(data.get_uma_id(uma1), data.get_uma_id(uma2)) == expected
+
+        assert data.get_pair_compatibility("甲", "甲") == 0
+        assert data.get_pair_compatibility("甲", "不存在的马娘") == 0
+        try:
+            data.get_uma_id("不存在的马娘")
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+        # 从缓存重新加载后结果一致，且数组以只读内存映射方式打开
+        data2 = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1)
+        assert isinstance(data2.triple_store.values, np.memmap) and not data2.triple_store.values.flags.writeable
+        assert data2.uma_list == data.uma_list
+        assert (data2.pair_matrix == data.pair_matrix).all()
+        for uma1, uma2, uma3 in combinations(data.uma_list, 3):
+            assert data2.get_triple_compatibility(uma3, uma1, uma2) == naive_score(SAMPLE_GROUPS, (uma1, uma2, uma3))
+
+
+def test_group_bitsets_on_the_fly():
+    """测试组掩码即时计算（不预计算三三相性表）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1,
+                                 precompute_triples=False)
+        assert data.triple_store is None
+
+        for umas in combinations(data.uma_list, 3):
+            assert data.get_triple_compatibility(*umas) == naive_score(SAMPLE_GROUPS, umas)
+        for umas in combinations(data.uma_list, 4):
+            assert data.get_group_compatibility(list(umas)) == naive_score(SAMPLE_GROUPS, umas)
+        assert data.get_triple_compatibility("甲", "乙", "甲") == 0
+        assert data.get_group_compatibility(["甲", "乙", "甲"]) == 0
+
+        # 共同组下标与组号对应
+        bitsets = data.group_bitsets
+        common = bitsets.common_groups([data.get_uma_id("甲"), data.get_uma_id("乙")])
+        assert sorted(bitsets.group_ids[bit] for bit in common) == [101, 201]
+
+        # 从缓存加载后组掩码可用
+        data2 = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1,
+                                  precompute_triples=False)
+        assert data2.get_triple_compatibility("乙", "丙", "己") == 5
+        assert data2.triple_store is None
+
+
+def test_binary_cache_version_mismatch():
+    """测试缓存格式版本不符时重新计算，以及重写缓存时清理旧的数组文件"""
+    import json
+    from src.binary_cache import MANIFEST_NAME, save_binary_cache, load_binary_cache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        cache_dir = os.path.join(tmp, "cache")
+        CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+
+        manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest['format_version'] = -1
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert not isinstance(data.triple_store.values, np.memmap)
+        assert data.get_triple_compatibility("乙", "丙", "己") == 5
+
+        # 重新写入缓存时删除旧清单中不再使用的数组文件，不属于缓存的文件保留
+        for file_name in ("notes.npy", "results.sqlite"):
+            with open(os.path.join(cache_dir, file_name), "wb") as f:
+                f.write(b"user")
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            stale = [info['file'] for name, info in json.load(f)['arrays'].items() if name != 'pair_matrix']
+        assert stale and all(os.path.exists(os.path.join(cache_dir, file_name)) for file_name in stale)
+        save_binary_cache(cache_dir, {}, {'pair_matrix': np.asarray(data.pair_matrix)})
+        assert not any(os.path.exists(os.path.join(cache_dir, file_name)) for file_name in stale)
+        for file_name in ("pair_matrix.npy", "notes.npy", "results.sqlite"):
+            assert os.path.exists(os.path.join(cache_dir, file_name))
+        metadata, arrays = load_binary_cache(cache_dir)
+        assert list(arrays) == ['pair_matrix']
+
+
+def test_incremental_cache_update():
+    """测试CSV改动后的增量更新与变更报告"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, "cache")
+        csv_path = write_sample_csv(tmp)
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert data.cache_update_report is None
+
+        # 内容未变时直接使用缓存
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert isinstance(data.pair_matrix, np.memmap)
+
+        # 分数变化、成员变化（含新马娘）、新增组、删除组
+        new_groups = [group for group in SAMPLE_GROUPS if group[0] != 102]
+        new_groups = [(g, 4, c, e, m) if g == 201 else (g, sc, c, e, m) for g, sc, c, e, m in new_groups]
+        new_groups = [(g, sc, c, e, m + ", 子") if g == 401 else (g, sc, c, e, m) for g, sc, c, e, m in new_groups]
+        new_groups.append((701, 2, "对手", "", "丑, 乙"))
+        write_sample_csv(tmp, new_groups)
+
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        report = data.cache_update_report
+        assert report['added_groups'] == [701]
+        assert report['removed_groups'] == [102]
+        assert report['rescored_groups'] == [201]
+        assert report['member_changed_groups'] == [401]
+        assert report['added_umas'] == sorted(["子", "丑"])
+        assert report['removed_umas'] == []
+        assert set(report['affected_umas']) == {"甲", "乙", "丁", "戊", "己", "庚", "辛", "子", "丑"}
+        # 只重算受影响马娘之间的组合（各自只算一次）
+        assert report['recomputed_pairs'] == 9 * 8 // 2
+        assert report['recomputed_triples'] == 9 * 8 * 7 // 6
+
+        # 增量结果与完整重算一致
+        fresh = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "fresh"), num_processes=1)
+        assert data.uma_list == fresh.uma_list
+        assert (np.asarray(data.pair_matrix) == np.asarray(fresh.pair_matrix)).all()
+        assert (dense_triples(data) == dense_triples(fresh)).all()
+
+        # 更新后的缓存可直接加载
+        reloaded = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert reloaded.cache_update_report is None
+        assert (dense_triples(reloaded) == dense_triples(fresh)).all()
+
+
+def test_shared_tables():
+    """测试通过共享内存（及映射文件）挂载的相性表与原表一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        cache_dir = os.path.join(tmp, "cache")
+        built = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        loaded = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+
+        # 新建的表复制到共享内存，从缓存加载的表直接共享映射文件
+        for data in (built, loaded):
+            with SharedTables(data) as shared:
+                attached = attach_shared_tables(shared.spec)
+                assert attached.uma_list == data.uma_list
+                assert (np.asarray(attached.pair_matrix) == np.asarray(data.pair_matrix)).all()
+                assert (dense_triples(attached) == dense_triples(data)).all()
+                assert attached.get_group_compatibility(["甲", "乙", "丙"]) == data.get_group_compatibility(["甲", "乙", "丙"])
+
+
+def test_score_many():
+    """测试批量计算七马血统（名称或ID、分块、各项分数）与逐行计算一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1)
+        calculator = CompatibilityCalculator(data)
+
+        rng = np.random.default_rng(0)
+        ids = rng.integers(0, data.num_umas, size=(500, 7))
+        names = [tuple(data.get_uma_name(uma_id) for uma_id in row) for row in ids.tolist()]
+        expected = np.array([calculator.calculate_compatibility_score(*row) for row in names])
+
+        assert (calculator.score_many(ids) == expected).all()
+        assert (calculator.score_many(np.array(names), chunk_size=64) == expected).all()
+        scores, terms = calculator.score_many(iter(names), return_terms=True, chunk_size=77)
+        assert (scores == expected).all() and (terms.sum(axis=1) == expected).all()
+        assert terms[0, 0] == data.get_pair_compatibility(names[0][0], names[0][1])
+        assert terms[0, 6] == data.get_triple_compatibility(names[0][0], names[0][2], names[0][6])
+
+        # 未预计算三三相性表时结果相同
+        data.triple_store = None
+        assert (calculator.score_many(ids) == expected).all()
+        assert len(calculator.score_many([])) == 0
+
+        for bad_rows in ([("甲", "乙", "丙")], [("甲", "乙", "丙", "丁", "戊", "己", "不存在的马娘")], [[0, 1, 2, 3, 4, 5, 99]]):
+            try:
+                calculator.score_many(bad_rows)
+                assert False, "应该抛出异常"
+            except ValueError:
+                pass
+
+
+def test_partner_index():
+    """测试搭档索引的排序、持久化和增量更新"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        cache_dir = os.path.join(tmp, "cache")
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+
+        for uma in data.uma_list:
+            expected = sorted(((other, naive_score(SAMPLE_GROUPS, (uma, other))) for other in data.uma_list if other != uma),
+                              key=lambda item: (-item[1], data.get_uma_id(item[0])))
+            assert data.get_top_partners(uma, k=None) == expected
+            assert data.get_top_partners(uma, k=3) == expected[:3]
+            assert data.get_uma_compatibility(uma) == {other: score for other, score in expected if score > 0}
+
+        for uma1, uma2 in [("甲", "乙"), ("乙", "丙"), ("辛", "壬")]:
+            expected = sorted(((other, naive_score(SAMPLE_GROUPS, (uma1, uma2, other)))
+                               for other in data.uma_list if other not in (uma1, uma2)),
+                              key=lambda item: (-item[1], data.get_uma_id(item[0])))
+            assert data.get_best_thirds(uma1, uma2, k=4) == expected[:4]
+            # 超过索引保存的数量时现算
+            assert data.get_best_thirds(uma1, uma2, k=100) == expected
+
+        # 索引随缓存保存，加载时直接读取
+        reloaded = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert reloaded._partner_index is not None
+        assert (np.asarray(reloaded.partner_index.third_order) == data.partner_index.third_order).all()
+
+        # CSV改动后增量更新的缓存中，索引与完整重建一致
+        write_sample_csv(tmp, SAMPLE_GROUPS[:-2] + [(701, 6, "新组", "", "癸, 丙, 庚")])
+        updated = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        fresh = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "fresh"), num_processes=1)
+        for name in ('partner_order', 'partner_scores', 'third_order', 'third_scores'):
+            assert (np.asarray(getattr(updated.partner_index, name)) == getattr(fresh.partner_index, name)).all()
+
+
+def test_explain():
+    """测试相性点数的解释：每一项的共同组与按定义筛选的结果一致，重新加载缓存后也不需要pandas"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        cache_dir = os.path.join(tmp, "cache")
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        calculator = CompatibilityCalculator(data)
+
+        for umas in [("甲", "乙"), ("乙", "丙", "己"), ("甲", "丁", "庚", "辛"), ("甲", "甲"), ("癸",)]:
+            expected = [(group_id, score, category, extra) for group_id, score, category, extra, members in SAMPLE_GROUPS
+                        if len(set(umas)) == len(umas) > 1
+                        and set(umas) <= {name.strip() for name in members.split(",")}]
+            groups = data.group_index.explain(data.get_uma_ids(list(umas)).tolist())
+            assert [(g['组号'], g['分数'], g['分类'], g['补充']) for g in groups] == expected, umas
+
+        rng = np.random.default_rng(1)
+        ids = rng.integers(0, data.num_umas, size=(200, 7))
+        explanations = calculator.explain_many(ids, chunk_size=33)
+        assert [item['score'] for item in explanations] == calculator.score_many(ids).tolist()
+        for row, explanation in zip(ids.tolist(), explanations):
+            for item in explanation['terms']:
+                assert item['score'] == sum(group['分数'] for group in item['groups'])
+                assert item['score'] == naive_score(SAMPLE_GROUPS, item['umas']) * (len(set(item['umas'])) == len(item['umas']))
+            assert explanation['terms'][3]['umas'] == [data.get_uma_name(row[i]) for i in (0, 1, 3)]
+
+        pedigree = ("甲", "乙", "丁", "丙", "辛", "庚", "戊")
+        explanation = calculator.explain(*pedigree)
+        assert explanation['score'] == calculator.calculate_compatibility_score(*pedigree)
+        assert explanation['terms'][0]['slots'] == ('target', 'parent1')
+        assert [g['组号'] for g in explanation['terms'][0]['groups']] == [101, 201]
+
+        # 从缓存加载后，组的分类和补充仍然可用
+        reloaded = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+        assert not hasattr(reloaded, 'df')
+        assert CompatibilityCalculator(reloaded).explain(*pedigree) == explanation
+        assert reloaded.get_uma_groups("丙") == data.get_uma_groups("丙")
+        assert [(g['组号'], g['分类'], g['成员']) for g in reloaded.get_uma_groups("己")] == \
+            [(102, "学年", ["己", "庚", "戊"]), (301, "血缘", ["丙", "乙", "己"])]
+
+
+def test_triple_store():
+    """测试三三相性表的两种布局：与顺序无关、与组掩码一致，稀疏数据的体积远小于N×N×N稠密表"""
+    rng = np.random.default_rng(2)
+    num_umas = 60
+    for max_size in (3, 40):
+        members = [rng.choice(num_umas, rng.integers(2, max_size + 1), replace=False).tolist() for _ in range(50)]
+        bitsets = GroupBitsets(list(range(50)), rng.integers(1, 5, 50).tolist(), members, num_umas)
+        entries = [triple_entries(bitsets, uma_id) for uma_id in range(num_umas)]
+        keys = np.concatenate([uma_keys for uma_keys, _ in entries])
+        values = np.concatenate([uma_values for _, uma_values in entries])
+        store = TripleStore.from_entries(num_umas, keys, values)
+        # 小组为主时只保存非零项，大组为主时按序号保存全部分数
+        assert (store.keys is not None) == (max_size == 3)
+        if max_size == 3:
+            assert store.nbytes * 10 < num_umas ** 3 * 2
+
+        packed = np.zeros(num_umas * (num_umas - 1) * (num_umas - 2) // 6, dtype=np.int32)
+        packed[keys] = values
+        order = np.argsort(keys)
+        layouts = [store, TripleStore(num_umas, packed), TripleStore(num_umas, values[order], keys[order])]
+        ids = rng.integers(0, num_umas, size=(3, 2000))
+        expected = np.array([bitsets.score(set(row)) if len(set(row)) == 3 else 0 for row in ids.T.tolist()])
+        for layout in layouts:
+            assert (layout.lookup(*ids) == expected).all()
+            assert (layout.lookup(ids[2], ids[0], ids[1]) == expected).all()
+            assert [layout.score(*row) for row in ids.T[:200].tolist()] == expected[:200].tolist()
+            assert (layout.slice(7) == bitsets.triple_slice(7)).all()
+            assert len(layout) == np.count_nonzero(values)
+
+        # 非零项还原为升序ID三元组
+        triples, triple_values = store.entries()
+        assert (triples[:, 0] < triples[:, 1]).all() and (triples[:, 1] < triples[:, 2]).all()
+        assert (canonical_keys(*triples.T)[0] == np.sort(keys[values != 0])).all()
+        assert (triple_values == store.lookup(*triples.T)).all()
+
+
+def test_csv_ingest_and_lazy_imports():
+    """测试向量化读取CSV的结果，以及导入包和读取缓存时不加载pandas、tqdm"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_sample_csv(tmp)
+        cache_dir = os.path.join(tmp, "cache")
+        data = CompatibilityData(csv_path, cache_dir=cache_dir, num_processes=1)
+
+        # 成员列保留原始名单（含"无"），映射中只有真正的马娘
+        assert data.df['成员'][3] == ["丙", "戊", "无"]
+        for uma in data.uma_list:
+            expected = {group_id for group_id, _, _, _, members in SAMPLE_GROUPS
+                        if uma in {name.strip() for name in members.split(",")}}
+            assert data.uma_to_groups[uma] == expected
+
+        # 成员为空白的行不产生名为"nan"的马娘，多余的逗号不产生空名称
+        blank_dir = os.path.join(tmp, "blank")
+        os.makedirs(blank_dir)
+        blank_path = write_sample_csv(blank_dir)
+        with open(blank_path, "a", encoding="utf-8") as f:
+            f.write("901,3,对手,,\n")
+            f.write('902,2,对手,,"甲, 乙,"\n')
+        blank = CompatibilityData(blank_path, cache_dir=os.path.join(blank_dir, "cache"), num_processes=1)
+        assert blank.uma_list == data.uma_list
+        assert blank.df['成员'].tolist()[-2:] == [[], ["甲", "乙"]]
+        assert blank.get_pair_compatibility("甲", "乙") == data.get_pair_compatibility("甲", "乙") + 2
+        assert blank.uma_to_groups["甲"] == data.uma_to_groups["甲"] | {902}
+
+        script = (
+            "import sys\n"
+            "import src\n"
+            "assert 'pandas' not in sys.modules and 'numpy' not in sys.modules\n"
+            f"data = src.CompatibilityData({csv_path!r}, cache_dir={cache_dir!r}, num_processes=1)\n"
+            "assert data.get_pair_compatibility('甲', '乙') == 5\n"
+            "assert src.CompatibilityCalculator(data).explain('甲', '乙', '丙', '丁', '戊', '己', '庚')['score'] > 0\n"
+            "assert 'pandas' not in sys.modules and 'tqdm' not in sys.modules\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, "-c", script], cwd=root, check=True, capture_output=True)
+
+
+if __name__ == "__main__":
+    test_uma_ids_and_pair_matrix()
+    test_group_bitsets_on_the_fly()
+    test_binary_cache_version_mismatch()
+    test_incremental_cache_update()
+    test_shared_tables()
+    test_score_many()
+    test_partner_index()
+    test_explain()
+    test_triple_store()
+    test_csv_ingest_and_lazy_imports()
+    print("相性数据处理器测试完成！")
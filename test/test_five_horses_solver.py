@@ -0,0 +1,663 @@
+"""
+五马循环精确求解器测试脚本（与逐一枚举的结果对照）
+"""
+
+import sys
+import os
+import json
+import random
+import subprocess
+import tempfile
+import threading
+from itertools import permutations, product, islice
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.compatibility import CompatibilityData
+from src.calculator import CompatibilityCalculator
+from src.five_horses_calculator import FiveHorsesCalculator, SEARCH_METHODS
+from src.engine import FiveHorsesEngine
+from src.cancellation import CancelToken
+from src.five_horses_solver import (FiveHorsesTables, vectorized_top_n, branch_and_bound_top_n,
+                                   decomposition_top_n, sort_results)
+from src.heuristic_solver import local_search_top_n
+from src.result_cache import ResultCache, pool_fingerprint
+from src.permutation_shards import (count_permutations, unrank_permutation, iter_permutation_range,
+                                    unrank_block, make_shards, count_products, iter_product_range,
+                                    unrank_product_block)
+
+UMAS = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸", "子", "丑"]
+
+
+def build_random_data(directory: str, seed: int = 0, num_groups: int = 40) -> CompatibilityData:
+    """生成随机的小规模相性数据（12只马娘）"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    csv_path = os.path.join(directory, "相性数据表.csv")
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_id in range(num_groups):
+            members = rng.sample(UMAS, rng.randint(2, 6))
+            f.write(f'{group_id},{rng.randint(1, 4)},随机,,"{", ".join(members)}"\n')
+    return CompatibilityData(csv_path, cache_dir=os.path.join(directory, "cache"), num_processes=1)
+
+
+def reference_top(data: CompatibilityData, parent: str, top_n: int, allowed=None, excluded=()):
+    """逐一枚举并按(分数降序, ID升序)排序，作为对照结果（allowed为{角色: 马娘列表}）"""
+    calculator = CompatibilityCalculator(data)
+    roles = ('grandparent1', 'grandparent2', 'chromo1', 'chromo2')
+    pools = [set((allowed or {}).get(role, data.uma_list)) - set(excluded) for role in roles]
+    results = []
+    for g1, g2, c1, c2 in permutations([uma for uma in data.uma_list if uma != parent], 4):
+        if not all(uma in pool for uma, pool in zip((g1, g2, c1, c2), pools)):
+            continue
+        score = calculator.calculate_compatibility_score(parent, g1, g2, c1, c2, c2, g1)
+        results.append((score, tuple(data.get_uma_id(uma) for uma in (g1, g2, c1, c2))))
+    results.sort(key=lambda item: (-item[0], item[1]))
+    return results[:top_n]
+
+
+def as_id_results(data: CompatibilityData, results):
+    """将组合字典列表转换为(分数, ID元组)列表"""
+    return [(score, tuple(data.get_uma_id(combination[role])
+                          for role in ('grandparent1', 'grandparent2', 'chromo1', 'chromo2')))
+            for combination, score in results]
+
+
+def test_exact_methods_match_brute_force():
+    """测试分支定界、分解求解、向量化枚举与逐一枚举结果一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(3):
+            data = build_random_data(os.path.join(tmp, str(seed)), seed=seed)
+            calculator = FiveHorsesCalculator(data)
+            for parent in ["甲", "丑"]:
+                expected = reference_top(data, parent, 15)
+                for method in ('branch_and_bound', 'decomposition', 'vectorized'):
+                    results = calculator.get_top_combinations(parent, top_n=15, verbose=False, method=method)
+                    assert as_id_results(data, results) == expected, method
+
+                    # 每个结果的分数与七马计算器一致
+                    for combination, score in results:
+                        assert score == calculator.calculate_specific_combination(**combination)
+
+                    best_combination, best_score = calculator.calculate_best_combination(
+                        parent, verbose=False, method=method)
+                    assert as_id_results(data, [(best_combination, best_score)]) == expected[:1], method
+
+                # 要求的数量超过全部组合数时返回全部组合
+                everything = calculator.get_top_combinations(parent, top_n=10 ** 5, verbose=False, method='decomposition')
+                assert len(everything) == 11 * 10 * 9 * 8
+
+                # 多进程逐一枚举同分时的取舍也一致
+                brute = calculator.get_top_combinations(parent, top_n=15, verbose=False, num_processes=1)
+                assert as_id_results(data, brute) == expected
+
+
+def test_decomposition_blocks():
+    """测试分解求解按块处理grandparent2、按第N名分数剪枝时结果不变，包括top_n大于马娘数的情况"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=5)
+        parent_id = data.get_uma_id("甲")
+        tables = FiveHorsesTables(data, parent_id)
+        n = len(tables.candidates)
+        for top_n in (1, 7, n + 9, 500):
+            expected = reference_top(data, "甲", top_n)
+            for block_size in (1, 50, 1 << 20):
+                stats = {}
+                assert decomposition_top_n(tables, top_n, stats=stats, block_size=block_size) == expected
+                assert stats['coverage'] == 1.0
+            if top_n == 1:
+                # 剪枝后实际计算的组合数远小于全部排列数
+                assert stats['evaluated'] < count_permutations(n, 4)
+
+
+def test_brute_force_ties():
+    """测试组数很少、同分很多时，逐一枚举与精确求解器选出相同的组合"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(6):
+            data = build_random_data(os.path.join(tmp, str(seed)), seed=seed, num_groups=8)
+            calculator = FiveHorsesCalculator(data)
+            for parent in ["乙", "壬"]:
+                expected = reference_top(data, parent, 5)
+                for num_processes in (1, 3):
+                    for method in SEARCH_METHODS:
+                        results = calculator.get_top_combinations(parent, top_n=5, verbose=False, method=method,
+                                                                  num_processes=num_processes)
+                        assert as_id_results(data, results) == expected, (seed, parent, method)
+                    best = calculator.calculate_best_combination(parent, verbose=False, num_processes=num_processes)
+                    assert as_id_results(data, [best]) == expected[:1]
+
+
+def test_permutation_shards():
+    """测试排列序号寻址与itertools.permutations的顺序一致"""
+    items = list("abcdefg")
+    expected = list(permutations(items, 4))
+    assert count_permutations(len(items), 4) == len(expected)
+
+    for rank in (0, 1, 119, 500, len(expected) - 1):
+        assert unrank_permutation(rank, items, 4) == expected[rank]
+
+    shards = make_shards(len(expected), 6)
+    assert shards[0][0] == 0 and shards[-1][1] == len(expected)
+    generated = [perm for start, end in shards for perm in iter_permutation_range(items, 4, start, end)]
+    assert generated == expected
+    assert list(iter_permutation_range(items, 4, 37, 211)) == expected[37:211]
+
+    positions = unrank_block(37, 211, len(items), 4)
+    assert [tuple(items[i] for i in row) for row in positions] == expected[37:211]
+
+    # 各角色候选池的笛卡尔积按itertools.product的顺序寻址
+    pools = [("a", "b", "c"), ("b",), ("a", "c", "d", "e"), ("c", "d")]
+    expected = list(product(*pools))
+    assert count_products(pools) == len(expected) == 24
+    shards = make_shards(len(expected), 5)
+    assert [item for start, end in shards for item in iter_product_range(pools, start, end)] == expected
+    assert list(iter_product_range(pools, 7, 19)) == expected[7:19]
+    assert count_products([("a",), ()]) == 0
+    digits = unrank_product_block(7, 19, [len(pool) for pool in pools])
+    assert [tuple(pool[i] for pool, i in zip(pools, row)) for row in digits] == expected[7:19]
+
+
+def test_vectorized_rank_range():
+    """测试向量化枚举只处理指定的序号区间"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=5)
+        parent = "丙"
+        tables = FiveHorsesTables(data, data.get_uma_id(parent))
+        others = [uma for uma in data.uma_list if uma != parent]
+        calculator = CompatibilityCalculator(data)
+
+        expected = []
+        for g1, g2, c1, c2 in islice(permutations(others, 4), 1000, 3000):
+            score = calculator.calculate_compatibility_score(parent, g1, g2, c1, c2, c2, g1)
+            expected.append((score, tuple(data.get_uma_id(uma) for uma in (g1, g2, c1, c2))))
+        expected.sort(key=lambda item: (-item[0], item[1]))
+
+        assert vectorized_top_n(tables, 7, start=1000, end=3000, block_size=300) == expected[:7]
+
+
+def test_unknown_method():
+    """测试未知的搜索方式"""
+    with tempfile.TemporaryDirectory() as tmp:
+        calculator = FiveHorsesCalculator(build_random_data(tmp))
+        try:
+            calculator.get_top_combinations("甲", verbose=False, method='不存在的方式')
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+
+def test_engine_reuse():
+    """测试常驻引擎在多次查询间复用同一进程池，结果与逐一枚举一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=7)
+        engine = FiveHorsesEngine(data, num_processes=2)
+        try:
+            engine.get_top_combinations("甲", verbose=False)
+            assert False, "应该抛出异常"
+        except RuntimeError:
+            pass
+
+        with engine:
+            pool = engine.pool
+            for parent in ["甲", "戊", "丑"]:
+                expected = reference_top(data, parent, 12)
+                for method in ('vectorized', 'decomposition'):
+                    results = engine.get_top_combinations(parent, top_n=12, method=method)
+                    assert as_id_results(data, results) == expected, method
+                best = engine.calculate_best_combination(parent)
+                assert as_id_results(data, [best]) == expected[:1]
+
+                # 逐一枚举同样使用引擎的常驻进程
+                brute = engine.calculator.get_top_combinations(parent, top_n=12, verbose=False)
+                assert as_id_results(data, brute) == expected
+            assert engine.pool is pool
+        assert not engine.running
+
+
+# 在子进程中分别用临时进程池和常驻引擎查询一次（各start method下工作进程都沿用创建者的资源跟踪器）
+SHARED_MEMORY_SCRIPT = """
+import multiprocessing, sys
+sys.path.insert(0, {root!r})
+from src.compatibility import CompatibilityData
+from src.five_horses_calculator import FiveHorsesCalculator
+from src.engine import FiveHorsesEngine
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method({start_method!r})
+    data = CompatibilityData({csv_path!r}, cache_dir={cache_dir!r}, num_processes=1)
+    FiveHorsesCalculator(data).get_top_combinations("甲", top_n=3, verbose=False, num_processes=2)
+    with FiveHorsesEngine(data, num_processes=2) as engine:
+        engine.get_top_combinations("甲", top_n=3)
+        engine.calculator.get_top_combinations("甲", top_n=3, verbose=False)
+"""
+
+
+def test_shared_memory_cleanup():
+    """测试查询结束释放共享内存时，资源跟踪器不在stderr输出任何错误"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=1)
+        for start_method in ('fork', 'spawn'):
+            script_path = os.path.join(tmp, f"query_{start_method}.py")
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(SHARED_MEMORY_SCRIPT.format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                    start_method=start_method, csv_path=os.path.join(tmp, "相性数据表.csv"),
+                                                    cache_dir=data.cache_dir))
+            completed = subprocess.run([sys.executable, script_path], capture_output=True, text=True, timeout=300)
+            assert completed.returncode == 0, completed.stderr
+            assert completed.stderr == "", completed.stderr
+
+
+def test_sweep_all_parents():
+    """测试批量计算全部parent：逐行写入文件，结果与逐一枚举一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=11)
+        expected = {parent: reference_top(data, parent, 5) for parent in data.uma_list}
+
+        output_path = os.path.join(tmp, "sweep", "all_parents.jsonl")
+        rows = FiveHorsesCalculator(data).sweep_all_parents(output_path, top_n=5, verbose=False)
+        with open(output_path, encoding="utf-8") as f:
+            assert [json.loads(line) for line in f] == rows
+        assert [row['parent'] for row in rows] == data.uma_list
+        for row in rows:
+            top = [(combination, combination.pop('score')) for combination in row['top_combinations']]
+            assert as_id_results(data, top) == expected[row['parent']]
+            assert row['best_score'] == expected[row['parent']][0][0]
+
+        # 使用常驻引擎并行计算（按完成顺序写入）
+        with FiveHorsesEngine(data, num_processes=2) as engine:
+            rows = engine.calculator.sweep_all_parents(output_path, top_n=5, parents=["甲", "丑"],
+                                                       method='decomposition', verbose=False)
+        assert sorted(row['parent'] for row in rows) == ["丑", "甲"]
+        for row in rows:
+            assert row['best_score'] == expected[row['parent']][0][0]
+
+
+def test_role_pools():
+    """测试按角色限制候选池和排除列表时，各搜索方式与逐一枚举一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=3)
+        calculator = FiveHorsesCalculator(data)
+        owned = ["甲", "丙", "丁", "戊", "庚", "壬", "子"]
+        cases = [
+            ({role: owned for role in ('grandparent1', 'grandparent2', 'chromo1', 'chromo2')}, owned, ["庚"]),
+            ({'grandparent1': ["乙", "丙", "丁"], 'chromo2': ["戊", "己", "丑", "乙"]},
+             {'grandparent1': ["乙", "丙", "丁"], 'chromo2': ["戊", "己", "丑", "乙"]}, ["丑"]),
+        ]
+        for reference_pools, allowed, excluded in cases:
+            for parent in ["甲", "癸"]:
+                expected = reference_top(data, parent, 10, reference_pools, excluded)
+                for method in SEARCH_METHODS:
+                    results = calculator.get_top_combinations(parent, top_n=10, verbose=False, num_processes=1,
+                                                              method=method, allowed=allowed, excluded=excluded)
+                    assert as_id_results(data, results) == expected, method
+                    # 逐一枚举只计算各角色候选池中不重复的组合，分支定界的计算量也不超过这一规模
+                    valid = len(reference_top(data, parent, 10 ** 6, reference_pools, excluded))
+                    if method in ('brute_force', 'vectorized'):
+                        assert calculator.search_report['evaluated'] == valid, method
+                    elif method == 'branch_and_bound':
+                        assert calculator.search_report['evaluated'] <= valid
+                    assert calculator.search_report['coverage'] == 1.0, method
+                    best = calculator.calculate_best_combination(parent, verbose=False, num_processes=1, method=method,
+                                                                 allowed=allowed, excluded=excluded)
+                    assert as_id_results(data, [best]) == expected[:1], method
+
+        with FiveHorsesEngine(data, num_processes=2) as engine:
+            results = engine.get_top_combinations("甲", top_n=10, allowed=owned, excluded=["庚"])
+            assert as_id_results(data, results) == reference_top(data, "甲", 10, cases[0][0], ["庚"])
+            assert engine.search_report['evaluated'] == len(reference_top(data, "甲", 10 ** 6, cases[0][0], ["庚"]))
+            assert engine.search_report['coverage'] == 1.0
+
+        # 搜索空间为各角色候选池的笛卡尔积，与候选池的并集大小无关
+        pools = {'grandparent1': [1], 'grandparent2': [2, 3], 'chromo1': [4], 'chromo2': [3, 5, 6]}
+        tables = FiveHorsesTables(data, 0, role_candidates={role: np.array(ids) for role, ids in pools.items()})
+        assert tables.search_size() == 6
+        stats = {}
+        results = vectorized_top_n(tables, 10, block_size=4, stats=stats)
+        assert stats == {'evaluated': 5, 'coverage': 1.0}
+        assert results == branch_and_bound_top_n(tables, 10) == sort_results(
+            [(tables.score(*ids), ids) for ids in product(*pools.values()) if len(set(ids)) == 4])
+
+        # 名称检查与无解的情况
+        for allowed, excluded in [(["不存在的马娘"], None), (None, ["不存在的马娘"]), ({'parent': ["甲"]}, None)]:
+            try:
+                calculator.get_top_combinations("甲", verbose=False, method='decomposition', allowed=allowed, excluded=excluded)
+                assert False, "应该抛出异常"
+            except ValueError:
+                pass
+        try:
+            calculator.calculate_best_combination("甲", verbose=False, method='branch_and_bound',
+                                                  allowed={'grandparent1': ["乙"], 'grandparent2': ["乙"]})
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+
+class CountdownToken(CancelToken):
+    """被检查指定次数后自动取消的令牌，用于构造确定的中途取消"""
+
+    def __init__(self, checks: int):
+        super().__init__()
+        self.checks = checks
+
+    @property
+    def cancelled(self) -> bool:
+        self.checks -= 1
+        return self.checks < 0
+
+
+def test_anytime_search():
+    """测试取消和超时：返回当时的合法前N名，并报告是否已证明最优和覆盖比例"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=5)
+        calculator = FiveHorsesCalculator(data)
+        parent = "甲"
+        expected = reference_top(data, parent, 5)
+
+        for method in ('branch_and_bound', 'decomposition', 'vectorized', 'brute_force'):
+            # 不限时：结果已证明最优
+            results = calculator.get_top_combinations(parent, top_n=5, verbose=False, method=method,
+                                                      num_processes=1, timeout=60)
+            assert calculator.search_report['proven_optimal'] and calculator.search_report['coverage'] == 1.0
+            assert as_id_results(data, results) == expected
+
+            # 搜索开始前已取消：没有结果，最优组合报超时
+            token = CancelToken()
+            token.cancel()
+            assert calculator.get_top_combinations(parent, top_n=5, verbose=False, method=method,
+                                                   num_processes=1, cancel_token=token) == []
+            assert not calculator.search_report['proven_optimal'] and calculator.search_report['coverage'] == 0.0
+            try:
+                calculator.calculate_best_combination(parent, verbose=False, method=method, num_processes=1, timeout=0)
+                assert False, "应该抛出异常"
+            except TimeoutError:
+                pass
+
+        # 中途取消：返回的是真实组合（分数正确），覆盖比例介于0和1之间
+        tables = FiveHorsesTables(data, data.get_uma_id(parent))
+        for solver, kwargs in ((branch_and_bound_top_n, {}), (decomposition_top_n, {}),
+                               (vectorized_top_n, {'block_size': 500})):
+            stats = {}
+            results = solver(tables, 5, stats=stats, cancel_token=CountdownToken(3), **kwargs)
+            assert 0 < stats['coverage'] < 1, solver.__name__
+            assert results and results == sorted(results, key=lambda item: (-item[0], item[1]))
+            for score, ids in results:
+                assert score == tables.score(*ids)
+            assert results[0][0] <= expected[0][0]
+
+        # 向量化枚举按块取消时，结果等于已枚举部分的前N名
+        stats = {}
+        partial = vectorized_top_n(tables, 5, block_size=500, stats=stats, cancel_token=CountdownToken(2))
+        assert partial == vectorized_top_n(tables, 5, end=1000)
+        assert stats['coverage'] == 1000 / count_permutations(len(tables.candidates), 4)
+
+        # 常驻引擎：超时为0时立即返回
+        with FiveHorsesEngine(data, num_processes=1) as engine:
+            assert engine.get_top_combinations(parent, top_n=3, timeout=0) == []
+            assert engine.search_report['coverage'] == 0.0
+            assert as_id_results(data, engine.get_top_combinations(parent, top_n=3, timeout=60)) == expected[:3]
+            assert engine.search_report['proven_optimal']
+
+
+def test_engine_timeout_frees_pool():
+    """测试超时或取消后常驻进程池不再继续计算已放弃的分片，之后的查询无需排队"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # 28只马娘：逐一枚举约42万种组合，在两个进程上需要数秒
+        rng = random.Random(0)
+        umas = [f"马娘{i}" for i in range(28)]
+        csv_path = os.path.join(tmp, "相性数据表.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("组号,分数,分类,补充,成员\n")
+            for group_id in range(60):
+                f.write(f'{group_id},{rng.randint(1, 4)},随机,,"{", ".join(rng.sample(umas, rng.randint(2, 8)))}"\n')
+        data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1)
+
+        with FiveHorsesEngine(data, num_processes=2) as engine:
+            for method, timeout in (('brute_force', 0.2), ('vectorized', 0.0)):
+                results = engine.calculator.get_top_combinations(umas[0], top_n=3, verbose=False, method=method,
+                                                                 timeout=timeout)
+                assert not engine.search_report['proven_optimal'] and engine.search_report['coverage'] < 1
+                for score, combination in as_id_results(data, results):
+                    assert score == engine.calculator.calculate_specific_combination(
+                        umas[0], *(data.get_uma_name(uma_id) for uma_id in combination))
+                # 进程池随即空闲（未修复时要等全部分片算完）
+                engine.pool.apply_async(os.getpid).get(timeout=2)
+
+            # 从其他线程取消：不再提交新分片
+            token = CancelToken()
+            timer = threading.Timer(0.2, token.cancel)
+            timer.start()
+            engine.calculator.get_top_combinations(umas[0], top_n=3, verbose=False, cancel_token=token)
+            timer.join()
+            assert not engine.search_report['proven_optimal']
+            engine.pool.apply_async(os.getpid).get(timeout=2)
+
+
+def test_local_search():
+    """测试启发式局部搜索：结果都是真实组合，上界不低于最优分数，差距与报告一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=7)
+        calculator = FiveHorsesCalculator(data)
+        for parent in ["甲", "戊", "丑"]:
+            expected = reference_top(data, parent, 10)
+            tables = FiveHorsesTables(data, data.get_uma_id(parent))
+            for budget in (200, 5000, None):
+                stats = {}
+                results = local_search_top_n(tables, 10, stats=stats, budget=budget)
+                assert results and results == sorted(results, key=lambda item: (-item[0], item[1]))
+                assert len({ids for _, ids in results}) == len(results)
+                for score, ids in results:
+                    assert len(set(ids)) == 4 and score == tables.score(*ids)
+                assert stats['upper_bound'] >= expected[0][0] >= results[0][0]
+                # 前N名的每一位都不高于精确结果的对应名次
+                assert all(found <= best for (found, _), (best, _) in zip(results, expected))
+
+            # 小规模数据上默认预算即可找到最优分数，报告给出上界和差距
+            results = calculator.get_top_combinations(parent, top_n=10, verbose=False, method='local_search')
+            report = calculator.search_report
+            assert results[0][1] == expected[0][0] == report['best_score']
+            assert report['gap'] == report['upper_bound'] - report['best_score'] >= 0
+            combination, score = calculator.calculate_best_combination(parent, verbose=False, method='local_search')
+            assert score == expected[0][0]
+            assert calculator.search_report['proven_optimal'] == (calculator.search_report['gap'] == 0)
+
+            # 精确搜索完成时上界即最优分数
+            calculator.get_top_combinations(parent, top_n=10, verbose=False, method='decomposition')
+            assert calculator.search_report['upper_bound'] == expected[0][0] and calculator.search_report['gap'] == 0
+
+        # 按角色限制候选池
+        owned = ["甲", "丙", "丁", "戊", "庚", "壬", "子"]
+        results = calculator.get_top_combinations("甲", top_n=5, verbose=False, method='local_search', allowed=owned)
+        assert all(uma in owned for combination, _ in results for role, uma in combination.items() if role != 'parent')
+
+        # 预算非法、搜索开始前已取消
+        try:
+            calculator.get_top_combinations("甲", verbose=False, method='local_search', budget=0)
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+        token = CancelToken()
+        token.cancel()
+        try:
+            calculator.calculate_best_combination("甲", verbose=False, method='local_search', cancel_token=token)
+            assert False, "应该抛出异常"
+        except TimeoutError:
+            pass
+
+
+def test_checkpoint_resume():
+    """测试brute_force中途取消后从检查点继续，最终结果与一次完成的搜索及其他精确搜索方式相同，完成后删除检查点"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=2)
+        calculator = FiveHorsesCalculator(data)
+        parent = "乙"
+        expected = calculator.get_top_combinations(parent, top_n=8, verbose=False, num_processes=1)
+        expected_best = calculator.calculate_best_combination(parent, verbose=False, num_processes=1)
+        assert as_id_results(data, expected) == reference_top(data, parent, 8)
+
+        for top_n in (8, 1):
+            path = os.path.join(tmp, f"checkpoint_{top_n}.json")
+            # 第一次运行中途取消：检查点只包含部分分片
+            calculator.get_top_combinations(parent, top_n=top_n, verbose=False, num_processes=1,
+                                            checkpoint_path=path, cancel_token=CountdownToken(6))
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            assert len(state['completed']) < len(state['shards'])
+            assert state['evaluated'] == sum(end - start for start, end in state['completed'])
+
+            # 用不同的进程数继续：沿用检查点中的分片划分，结果与一次完成的搜索相同
+            if top_n == 1:
+                assert calculator.calculate_best_combination(parent, verbose=False, num_processes=2,
+                                                             checkpoint_path=path) == expected_best
+            else:
+                assert calculator.get_top_combinations(parent, top_n=top_n, verbose=False, num_processes=2,
+                                                       checkpoint_path=path) == expected
+            assert calculator.search_report['proven_optimal']
+            assert calculator.search_report['evaluated'] == count_permutations(11, 4)
+            # 搜索完成后删除检查点，结果与其他精确搜索方式相同
+            assert not os.path.exists(path)
+            exact = calculator.get_top_combinations(parent, top_n=top_n, verbose=False, method='vectorized')
+            assert exact == expected[:top_n]
+
+        # 限制了候选池时同样可以继续
+        path = os.path.join(tmp, "checkpoint_owned.json")
+        owned = ["甲", "丙", "丁", "戊", "庚", "壬", "子"]
+        calculator.get_top_combinations(parent, top_n=5, verbose=False, num_processes=1, allowed=owned,
+                                        checkpoint_path=path, cancel_token=CountdownToken(4))
+        assert os.path.exists(path)
+        resumed = calculator.get_top_combinations(parent, top_n=5, verbose=False, num_processes=1, allowed=owned,
+                                                  checkpoint_path=path)
+        assert resumed == calculator.get_top_combinations(parent, top_n=5, verbose=False, method='decomposition',
+                                                          allowed=owned)
+        assert not os.path.exists(path)
+
+        # 参数不同的检查点、非brute_force搜索
+        path = os.path.join(tmp, "checkpoint_8.json")
+        calculator.get_top_combinations(parent, top_n=8, verbose=False, num_processes=1,
+                                        checkpoint_path=path, cancel_token=CountdownToken(2))
+        for kwargs in ({'top_n': 5}, {'top_n': 8, 'excluded': ["甲"]}):
+            try:
+                calculator.get_top_combinations(parent, verbose=False, num_processes=1, checkpoint_path=path, **kwargs)
+                assert False, "应该抛出异常"
+            except ValueError:
+                pass
+        try:
+            calculator.get_top_combinations(parent, verbose=False, method='decomposition',
+                                            checkpoint_path=os.path.join(tmp, "other.json"))
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+
+def test_result_cache():
+    """测试结果缓存的命中、LRU淘汰、排行榜，以及CSV变化后自动失效"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=3)
+        cache = ResultCache.for_data(data, max_entries=3)
+        calculator = FiveHorsesCalculator(data, result_cache=cache)
+        expected = reference_top(data, "甲", 6)
+
+        # 无论哪种精确搜索方式先写入缓存，各方式读到的结果都与各自搜索的结果相同
+        with ResultCache.for_data(data, path=os.path.join(tmp, "brute_first.sqlite")) as brute_cache:
+            brute_first = FiveHorsesCalculator(data, result_cache=brute_cache)
+            brute_first.get_top_combinations("甲", top_n=6, verbose=False, num_processes=1, method='brute_force')
+            for method in SEARCH_METHODS:
+                results = brute_first.get_top_combinations("甲", top_n=6, verbose=False, method=method)
+                assert as_id_results(data, results) == expected and brute_first.search_report['cache_hit']
+
+        results = calculator.get_top_combinations("甲", top_n=6, verbose=False, method='branch_and_bound')
+        assert as_id_results(data, results) == expected and not calculator.search_report['cache_hit']
+        # 精确搜索方式共用缓存，要求数量更少的查询也能命中
+        for method in SEARCH_METHODS:
+            results = calculator.get_top_combinations("甲", top_n=4, verbose=False, method=method)
+            assert as_id_results(data, results) == expected[:4] and calculator.search_report['cache_hit']
+        best = calculator.calculate_best_combination("甲", verbose=False, method='decomposition')
+        assert as_id_results(data, [best]) == expected[:1] and calculator.search_report['proven_optimal']
+        assert cache.stats()['hits'] == len(SEARCH_METHODS) + 1
+
+        # 启发式搜索和不同的候选池不会命中
+        calculator.get_top_combinations("甲", top_n=4, verbose=False, method='local_search')
+        assert not calculator.search_report['cache_hit']
+        calculator.get_top_combinations("甲", top_n=4, verbose=False, excluded=["乙"], method='vectorized')
+        assert not calculator.search_report['cache_hit']
+
+        # 超过条数上限时淘汰最久未使用的条目（"甲"的结果刚被读取，先淘汰排除"乙"的结果）
+        calculator.get_top_combinations("丁", top_n=1, verbose=False, method='vectorized')
+        calculator.get_top_combinations("甲", top_n=2, verbose=False, method='vectorized')
+        assert calculator.search_report['cache_hit']
+        calculator.get_top_combinations("丙", top_n=2, verbose=False, method='vectorized')
+        assert cache.stats()['entries'] == 3
+        calculator.get_top_combinations("甲", top_n=4, verbose=False, excluded=["乙"], method='vectorized')
+        assert not calculator.search_report['cache_hit']
+
+        # 排行榜固定保存，不参与淘汰
+        assert calculator.materialize_leaderboards(top_n=8, verbose=False) == len(UMAS)
+        for parent in UMAS:
+            calculator.get_top_combinations(parent, top_n=5, verbose=False, excluded=[], method='vectorized')
+            assert calculator.search_report['cache_hit'], parent
+        assert cache.stats()['leaderboards'] == len(UMAS) and cache.stats()['entries'] <= 3
+        # 与排行榜键相同的普通写入不会取消固定，之后的淘汰也不会删除排行榜
+        pool = pool_fingerprint(None)
+        leaderboard, report = cache.get("甲", 'exact', pool, 8)
+        cache.put("甲", 'exact', pool, 8, leaderboard, report)
+        for parent in ("乙", "丙", "丁", "戊"):
+            cache.put(parent, 'exact', pool, 9, leaderboard, report)
+        assert cache.stats()['leaderboards'] == len(UMAS) and cache.get("甲", 'exact', pool, 8)[0] == leaderboard
+        results = calculator.get_top_combinations("丑", top_n=8, verbose=False, method='decomposition')
+        assert as_id_results(data, results) == reference_top(data, "丑", 8)
+        cache.close()
+
+        # CSV变化后，旧版本的缓存不能再使用，重新打开时清除旧条目
+        changed = build_random_data(tmp, seed=4)
+        try:
+            FiveHorsesCalculator(changed, result_cache=cache)
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+        with ResultCache.for_data(changed) as cache:
+            assert cache.stats()['entries'] == cache.stats()['leaderboards'] == 0
+            calculator = FiveHorsesCalculator(changed, result_cache=cache)
+            results = calculator.get_top_combinations("甲", top_n=6, verbose=False, method='branch_and_bound')
+            assert as_id_results(changed, results) == reference_top(changed, "甲", 6)
+            assert not calculator.search_report['cache_hit']
+
+
+def test_explain_combinations():
+    """测试前N优结果的解释：七项分数之和等于组合分数，映射关系与calculate_specific_combination一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=5)
+        calculator = FiveHorsesCalculator(data)
+        results = calculator.get_top_combinations("丙", top_n=20, verbose=False, method='branch_and_bound')
+        explanations = calculator.explain_combinations(results)
+        assert [item['score'] for item in explanations] == [score for _, score in results]
+        for (combination, _), explanation in zip(results, explanations):
+            for item in explanation['terms']:
+                assert item['score'] == sum(group['分数'] for group in item['groups'])
+            # 第三、四项为(parent, grandparent1, chromo1)和(parent, grandparent1, chromo2)
+            assert explanation['terms'][3]['umas'] == [combination[role] for role in ('parent', 'grandparent1', 'chromo1')]
+            assert explanation['terms'][4]['umas'] == [combination[role] for role in ('parent', 'grandparent1', 'chromo2')]
+        assert calculator.explain_combinations([results[0][0]]) == explanations[:1]
+        assert calculator.explain_combinations([]) == []
+
+
+if __name__ == "__main__":
+    test_exact_methods_match_brute_force()
+    test_decomposition_blocks()
+    test_brute_force_ties()
+    test_permutation_shards()
+    test_vectorized_rank_range()
+    test_unknown_method()
+    test_engine_reuse()
+    test_shared_memory_cleanup()
+    test_sweep_all_parents()
+    test_role_pools()
+    test_anytime_search()
+    test_engine_timeout_frees_pool()
+    test_local_search()
+    test_checkpoint_resume()
+    test_result_cache()
+    test_explain_combinations()
+    print("五马循环精确求解器测试完成！")
@@ -0,0 +1,112 @@
+"""
+阶段计时与指标测试脚本
+"""
+
+import sys
+import os
+import io
+import json
+import random
+import tempfile
+import contextlib
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.compatibility import CompatibilityData
+from src.five_horses_calculator import FiveHorsesCalculator
+from src.instrumentation import Instrumentation, JsonLinesExporter
+from src.permutation_shards import count_permutations
+
+UMAS = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
+
+
+def write_random_csv(directory: str, seed: int = 0, num_groups: int = 30) -> str:
+    """生成随机的小规模相性数据，返回CSV路径"""
+    rng = random.Random(seed)
+    csv_path = os.path.join(directory, "相性数据表.csv")
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_id in range(num_groups):
+            members = rng.sample(UMAS, rng.randint(2, 5))
+            f.write(f'{group_id},{rng.randint(1, 4)},随机,,"{", ".join(members)}"\n')
+    return csv_path
+
+
+def test_quiet_phases_and_exporter():
+    """测试quiet模式完全静默，且各阶段事件写入JSON Lines"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_random_csv(tmp)
+        events_path = os.path.join(tmp, "events.jsonl")
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with JsonLinesExporter(events_path) as exporter, \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            instrumentation = Instrumentation(callback=exporter, quiet=True)
+            data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1,
+                                     instrumentation=instrumentation)
+            calculator = FiveHorsesCalculator(data)
+            calculator.get_top_combinations("甲", top_n=3, method='brute_force', num_processes=1)
+            calculator.get_top_combinations("乙", top_n=3, method='branch_and_bound')
+            CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1,
+                              instrumentation=instrumentation)
+        assert stdout.getvalue() == "" and stderr.getvalue() == ""
+
+        with open(events_path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f]
+        phases = [event['phase'] for event in events]
+        for name in ('source_hash', 'csv_read', 'map', 'pair_build', 'triple_build', 'partner_index_build',
+                     'cache_save', 'search', 'cache_load'):
+            assert name in phases, name
+        searches = [event for event in events if event['phase'] == 'search']
+        assert [(event['parent'], event['method']) for event in searches] == [("甲", 'brute_force'),
+                                                                               ("乙", 'branch_and_bound')]
+        assert all(event['seconds'] >= 0 for event in events)
+        assert instrumentation.summary()['phases']['cache_load']['calls'] == 2
+
+
+def test_search_counters():
+    """测试已计算与已剪枝的组合数之和等于排列总数"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = write_random_csv(tmp, seed=3)
+        data = CompatibilityData(csv_path, cache_dir=os.path.join(tmp, "cache"), num_processes=1,
+                                 instrumentation=Instrumentation(quiet=True))
+        total = count_permutations(len(data.uma_list) - 1, 4)
+        for method in ('branch_and_bound', 'decomposition', 'vectorized'):
+            events = []
+            calculator = FiveHorsesCalculator(data, instrumentation=Instrumentation(callback=events.append, quiet=True))
+            calculator.get_top_combinations("丙", top_n=2, method=method)
+            counters = events[-1]['counters']
+            assert counters['evaluated'] + counters.get('pruned', 0) == total, method
+            assert counters['evaluated'] > 0
+            if method == 'vectorized':
+                assert counters.get('pruned', 0) == 0
+
+        # 分支定界的剪枝使计算量少于逐一枚举
+        instrumentation = Instrumentation(quiet=True)
+        calculator = FiveHorsesCalculator(data, instrumentation=instrumentation)
+        calculator.sweep_all_parents(os.path.join(tmp, "sweep.jsonl"), top_n=1)
+        assert instrumentation.counters['pruned'] > 0
+        assert instrumentation.counters['evaluated'] + instrumentation.counters['pruned'] == total * data.num_umas
+
+
+def test_nested_phase_memory():
+    """测试嵌套阶段的内存峰值：外层阶段包含内层阶段的峰值"""
+    events = []
+    instrumentation = Instrumentation(callback=events.append, quiet=True, track_memory=True)
+    with instrumentation.phase('outer'):
+        with instrumentation.phase('inner'):
+            buffer = bytearray(4 << 20)
+            del buffer
+        instrumentation.count('items', 5)
+    inner, outer = events
+    assert inner['phase'] == 'inner' and outer['phase'] == 'outer'
+    assert inner['peak_memory'] >= 4 << 20
+    assert outer['peak_memory'] >= inner['peak_memory']
+    assert outer['counters'] == {'items': 5} and inner['counters'] == {}
+
+
+if __name__ == "__main__":
+    test_quiet_phases_and_exporter()
+    test_search_counters()
+    test_nested_phase_memory()
+    print("阶段计时与指标测试完成！")
@@ -0,0 +1,142 @@
+"""
+七马血统优化器测试脚本（与逐一枚举的结果对照）
+"""
+
+import sys
+import os
+import random
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.compatibility import CompatibilityData
+from src.calculator import CompatibilityCalculator
+from src.pedigree_optimizer import PedigreeOptimizer, SLOTS
+
+UMAS = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
+
+
+def build_random_data(directory: str, umas, seed: int = 0, num_groups: int = 15) -> CompatibilityData:
+    """生成随机的小规模相性数据"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    csv_path = os.path.join(directory, "相性数据表.csv")
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_id in range(num_groups):
+            members = rng.sample(umas, rng.randint(2, min(5, len(umas))))
+            f.write(f'{group_id},{rng.randint(1, 4)},随机,,"{", ".join(members)}"\n')
+    return CompatibilityData(csv_path, cache_dir=os.path.join(directory, "cache"), num_processes=1)
+
+
+def reference_top(data: CompatibilityData, fixed, top_n: int, allowed=None, excluded=()):
+    """逐一枚举全部合法的七马血统，按(分数降序, ID升序)排序取前N（allowed为{位置: 马娘列表}）"""
+    calculator = CompatibilityCalculator(data)
+    pools = {slot: [fixed[slot]] if slot in fixed else
+             [uma for uma in (allowed or {}).get(slot, data.uma_list) if uma not in excluded] for slot in SLOTS}
+    results = []
+    for target in pools['target']:
+        for parent1 in pools['parent1']:
+            for parent2 in pools['parent2']:
+                if len({target, parent1, parent2}) < 3:
+                    continue
+                branch1 = [(a, b) for a in pools['grandparent1'] for b in pools['grandparent2']
+                           if a != b and a not in (target, parent1) and b not in (target, parent1)]
+                branch2 = [(a, b) for a in pools['grandparent3'] for b in pools['grandparent4']
+                           if a != b and a not in (target, parent2) and b not in (target, parent2)]
+                for grandparent1, grandparent2 in branch1:
+                    for grandparent3, grandparent4 in branch2:
+                        umas = (target, parent1, parent2, grandparent1, grandparent2, grandparent3, grandparent4)
+                        score = calculator.calculate_compatibility_score(*umas)
+                        results.append((score, tuple(data.get_uma_id(uma) for uma in umas)))
+    results.sort(key=lambda item: (-item[0], item[1]))
+    return results[:top_n]
+
+
+def as_id_results(data: CompatibilityData, results):
+    """将七马字典列表转换为(分数, ID元组)列表"""
+    return [(score, tuple(data.get_uma_id(pedigree[slot]) for slot in SLOTS)) for pedigree, score in results]
+
+
+def test_partial_slots_match_brute_force():
+    """测试任意位置固定时的前N优补全与逐一枚举一致"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(3):
+            data = build_random_data(os.path.join(tmp, str(seed)), UMAS, seed=seed)
+            optimizer = PedigreeOptimizer(data)
+            for fixed in [{'target': "甲", 'parent1': "乙", 'parent2': "丙"},
+                          {'target': "丁", 'parent1': "乙", 'grandparent3': "甲"},
+                          {'target': "戊", 'parent1': "甲", 'parent2': "乙", 'grandparent1': "丙", 'grandparent4': "丁"}]:
+                for top_n in (1, 7, 30):
+                    results = optimizer.get_top_pedigrees(fixed, top_n=top_n)
+                    assert as_id_results(data, results) == reference_top(data, fixed, top_n), (seed, fixed, top_n)
+
+                    # 每个结果的分数与七马计算器一致
+                    calculator = CompatibilityCalculator(data)
+                    for pedigree, score in results:
+                        assert score == calculator.calculate_compatibility_score(*(pedigree[slot] for slot in SLOTS))
+
+
+def test_open_slots_match_brute_force():
+    """测试target也未固定时的搜索（7只马娘，可完整枚举）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(2):
+            data = build_random_data(os.path.join(tmp, str(seed)), UMAS[:7], seed=seed, num_groups=12)
+            optimizer = PedigreeOptimizer(data)
+            for fixed in [{}, {'target': "甲"}, {'grandparent2': "乙"}]:
+                expected = reference_top(data, fixed, 9)
+                assert as_id_results(data, optimizer.get_top_pedigrees(fixed, top_n=9)) == expected
+                best_pedigree, best_score = optimizer.calculate_best_pedigree(fixed)
+                assert as_id_results(data, [(best_pedigree, best_score)]) == expected[:1]
+
+            # 每个target的补全表只计算一次（第一遍计算上界时的结果直接复用）
+            calls = []
+            target_tables = optimizer._target_tables
+            optimizer._target_tables = lambda target, *args: calls.append(target) or target_tables(target, *args)
+            assert as_id_results(data, optimizer.get_top_pedigrees(top_n=9)) == reference_top(data, {}, 9)
+            assert sorted(calls) == list(range(len(data.uma_list)))
+
+
+def test_invalid_constraints():
+    """测试非法的固定位置"""
+    with tempfile.TemporaryDirectory() as tmp:
+        optimizer = PedigreeOptimizer(build_random_data(tmp, UMAS))
+        for fixed in [{'parent3': "甲"}, {'target': "不存在的马娘"}]:
+            try:
+                optimizer.get_top_pedigrees(fixed)
+                assert False, "应该抛出异常"
+            except ValueError:
+                pass
+
+        # target与父辈相同时没有合法补全
+        assert optimizer.get_top_pedigrees({'target': "甲", 'parent1': "甲"}) == []
+        try:
+            optimizer.calculate_best_pedigree({'target': "甲", 'parent1': "甲"})
+            assert False, "应该抛出异常"
+        except ValueError:
+            pass
+
+
+def test_slot_pools():
+    """测试按位置限制候选池和排除列表"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, UMAS, seed=4)
+        optimizer = PedigreeOptimizer(data)
+        owned = ["甲", "乙", "丙", "丁", "戊", "己"]
+        fixed = {'target': "庚"}
+        expected = reference_top(data, fixed, 12, {slot: owned for slot in SLOTS}, ["乙"])
+        assert as_id_results(data, optimizer.get_top_pedigrees(fixed, top_n=12, allowed=owned, excluded=["乙"])) == expected
+
+        allowed = {'parent1': ["甲", "乙"], 'grandparent1': ["丙", "丁", "戊"], 'grandparent4': ["辛"]}
+        fixed = {'target': "癸", 'parent2': "壬"}
+        expected = reference_top(data, fixed, 12, allowed, ["丁"])
+        assert as_id_results(data, optimizer.get_top_pedigrees(fixed, top_n=12, allowed=allowed, excluded=["丁"])) == expected
+
+
+if __name__ == "__main__":
+    test_partial_slots_match_brute_force()
+    test_open_slots_match_brute_force()
+    test_invalid_constraints()
+    test_slot_pools()
+    print("七马血统优化器测试完成！")
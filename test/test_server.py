@@ -0,0 +1,145 @@
+"""
+本地查询服务测试脚本
+"""
+
+import sys
+import os
+import json
+import random
+import asyncio
+import tempfile
+from urllib.parse import quote
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.compatibility import CompatibilityData
+from src.calculator import CompatibilityCalculator
+from src.five_horses_calculator import FiveHorsesCalculator
+from src.instrumentation import Instrumentation
+from src.server import QueryService, LatencyTracker
+
+UMAS = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
+
+
+def build_random_data(directory: str, seed: int = 0, num_groups: int = 30) -> CompatibilityData:
+    """生成随机的小规模相性数据"""
+    rng = random.Random(seed)
+    csv_path = os.path.join(directory, "相性数据表.csv")
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("组号,分数,分类,补充,成员\n")
+        for group_id in range(num_groups):
+            members = rng.sample(UMAS, rng.randint(2, 5))
+            f.write(f'{group_id},{rng.randint(1, 4)},随机,,"{", ".join(members)}"\n')
+    return CompatibilityData(csv_path, cache_dir=os.path.join(directory, "cache"), num_processes=1,
+                             instrumentation=Instrumentation(quiet=True))
+
+
+async def http_request(port: int, path: str, payload=None):
+    """发送一个HTTP请求，返回(状态码, JSON内容)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+    method = "POST" if payload is not None else "GET"
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(content.decode("utf-8"))
+
+
+def test_query_service():
+    """测试各端点的结果与直接计算一致，错误请求返回对应的状态码"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp)
+        calculator = CompatibilityCalculator(data)
+        five_horses = FiveHorsesCalculator(data)
+
+        async def scenario(service: QueryService):
+            server = await service.serve(port=0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                status, result = await http_request(port, f"/pair?uma1={quote('甲')}&uma2={quote('乙')}")
+                assert status == 200 and result['score'] == data.get_pair_compatibility("甲", "乙")
+
+                status, result = await http_request(port, "/triple", {'uma1': "甲", 'uma2': "乙", 'uma3': "丙"})
+                assert status == 200 and result['score'] == data.get_triple_compatibility("甲", "乙", "丙")
+
+                pedigree = dict(zip(('target', 'parent1', 'parent2', 'grandparent1', 'grandparent2',
+                                     'grandparent3', 'grandparent4'), UMAS[:7]))
+                status, result = await http_request(port, "/seven", pedigree)
+                assert status == 200 and result['score'] == calculator.calculate_compatibility_score(**pedigree)
+
+                status, result = await http_request(port, "/explain", pedigree)
+                assert status == 200 and result['score'] == sum(item['score'] for item in result['terms'])
+                assert result['terms'][0]['umas'] == UMAS[:2] and result['pedigree'] == pedigree
+
+                expected = five_horses.get_top_combinations("丙", top_n=5, verbose=False, method='decomposition')
+                status, result = await http_request(port, "/top", {'parent': "丙", 'top_n': 5})
+                assert status == 200 and result['report']['proven_optimal']
+                assert [(item['combination'], item['score']) for item in result['results']] == expected
+
+                status, result = await http_request(port, f"/best?parent={quote('丙')}&method=decomposition"
+                                                          f"&excluded={quote(expected[0][0]['grandparent1'])}")
+                assert status == 200 and result['combination']['grandparent1'] != expected[0][0]['grandparent1']
+
+                status, result = await http_request(port, "/health")
+                assert status == 200 and result['status'] == 'ok' and result['num_umas'] == len(UMAS)
+
+                # 错误请求
+                assert (await http_request(port, "/nothing"))[0] == 404
+                assert (await http_request(port, "/pair", {'uma1': "甲", 'uma2': "不存在的马娘"}))[0] == 400
+                assert (await http_request(port, "/top", {'parent': "甲", 'method': 'brute_force'}))[0] == 400
+                assert (await http_request(port, "/top", {'parent': "甲", 'top_n': "十"}))[0] == 400
+                assert (await http_request(port, "/best", {'parent': "甲", 'timeout': 0}))[0] == 504
+
+                status, stats = await http_request(port, "/stats")
+                assert stats['latency']['pair']['count'] == 2 and stats['latency']['top']['count'] == 3
+                assert 0 <= stats['latency']['top']['p50_ms'] <= stats['latency']['top']['p99_ms']
+
+        with QueryService(data, num_workers=1) as service:
+            asyncio.run(scenario(service))
+
+
+def test_coalescing():
+    """测试相同参数的并发搜索只计算一次，参数不同时分别计算"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data = build_random_data(tmp, seed=1)
+
+        async def scenario(service: QueryService):
+            # 名单顺序不同但等价的请求也会合并
+            same = [service.query('top', {'parent': "甲", 'top_n': 3, 'allowed': "乙,丙,丁,戊,己"}),
+                    service.query('top', {'parent': "甲", 'top_n': 3, 'allowed': ["己", "戊", "丁", "丙", "乙"]}),
+                    service.query('top', {'parent': "甲", 'top_n': "3", 'allowed': "丙,乙,丁,戊,己"})]
+            results = await asyncio.gather(*same)
+            assert results[0] == results[1] == results[2]
+            assert service.coalesced == 2
+
+            different = await asyncio.gather(service.query('top', {'parent': "甲", 'top_n': 3}),
+                                             service.query('top', {'parent': "甲", 'top_n': 4}))
+            assert len(different[1]['results']) == 4
+            assert service.coalesced == 2 and not service._in_flight
+
+        with QueryService(data, num_workers=1) as service:
+            asyncio.run(scenario(service))
+            assert service.latency.summary()['top']['count'] == 5
+
+
+def test_latency_tracker():
+    """测试延迟分位数（最近秩法）"""
+    tracker = LatencyTracker(window=100)
+    for i in range(1, 201):
+        tracker.record('pair', i / 1000)
+    summary = tracker.summary()['pair']
+    # 只保留最近100次：0.101秒 ~ 0.200秒
+    assert summary['count'] == 200
+    assert abs(summary['p50_ms'] - 150) < 1e-9 and abs(summary['p99_ms'] - 199) < 1e-9
+    assert abs(summary['max_ms'] - 200) < 1e-9
+
+
+if __name__ == "__main__":
+    test_query_service()
+    test_coalescing()
+    test_latency_tracker()
+    print("本地查询服务测试完成！")